@@ -0,0 +1,171 @@
+"""Resolve svn user names to git author identities.
+
+The author map is a json file mapping svn user names to real names and
+email addresses:
+
+    {
+        "andre": {"name": "Ben Andre", "email": "andre@ucar.edu"},
+        ...
+    }
+
+The resolver loads the map once per process, resolves every svn
+author seen in a bulk log query in a single pass, keeps track of
+authors that are not in the map so they can be reported up front, and
+caches the resolved identities in a json file next to the author map
+so later runs don't need to redo the work.
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+
+# domain used for svn users that are not in the author map
+DEFAULT_EMAIL_DOMAIN = 'ucar.edu'
+
+CACHE_SUFFIX = 'cache'
+
+_resolvers = {}
+
+
+def get_author_resolver(author_map_filename, use_cache=True):
+    """Return the resolver for the specified author map, loading the map
+    at most once per process.
+
+    """
+    key = os.path.abspath(author_map_filename)
+    if key not in _resolvers:
+        cache_filename = None
+        if use_cache:
+            cache_filename = "{0}.{1}".format(key, CACHE_SUFFIX)
+        _resolvers[key] = AuthorResolver(key, cache_filename)
+    return _resolvers[key]
+
+
+def authors_from_log_xml(xml):
+    """Return the set of svn authors found in the parsed xml output of
+    'svn log --xml'.
+
+    """
+    authors = set()
+    for author in xml.findall('logentry/author'):
+        if author.text:
+            authors.add(author.text.strip())
+    return authors
+
+
+class AuthorResolver(object):
+    """Map svn user names to git 'Name <email>' strings.
+
+    """
+
+    def __init__(self, author_map_filename, cache_filename=None):
+        self._author_map_filename = author_map_filename
+        self._cache_filename = cache_filename
+        self._map_stamp = None
+        self._author_map = {}
+        self._lookup = {}
+        self._cache_dirty = False
+        self.unmapped = set()
+
+        self._load_author_map()
+        self._load_cache()
+
+    def _load_author_map(self):
+        """Read the author map from disk.
+
+        """
+        with open(self._author_map_filename, 'r') as author_file:
+            self._author_map = json.load(author_file)
+        stat = os.stat(self._author_map_filename)
+        self._map_stamp = [stat.st_mtime, stat.st_size]
+
+    def _load_cache(self):
+        """Read previously resolved identities. The cache is discarded if
+        the author map changed since it was written.
+
+        """
+        if not self._cache_filename:
+            return
+        if not os.path.isfile(self._cache_filename):
+            return
+        try:
+            with open(self._cache_filename, 'r') as cache_file:
+                cache = json.load(cache_file)
+        except ValueError:
+            # corrupt cache, just rebuild it
+            return
+        if cache.get('author_map_stamp') != self._map_stamp:
+            return
+        self._lookup.update(cache.get('authors', {}))
+        self.unmapped.update(cache.get('unmapped', []))
+
+    def save_cache(self):
+        """Write the resolved identities so later runs can reuse them.
+
+        """
+        if not self._cache_filename or not self._cache_dirty:
+            return
+        cache = {
+            'author_map': self._author_map_filename,
+            'author_map_stamp': self._map_stamp,
+            'authors': self._lookup,
+            'unmapped': sorted(self.unmapped),
+        }
+        # unique per process, parallel imports may save at the same time
+        tmp_filename = "{0}.{1}.tmp".format(self._cache_filename, os.getpid())
+        with open(tmp_filename, 'w') as cache_file:
+            json.dump(cache, cache_file, indent=4, sort_keys=True)
+        os.rename(tmp_filename, self._cache_filename)
+        self._cache_dirty = False
+
+    def _resolve_uncached(self, svn_author):
+        """Build the git identity for an svn author that hasn't been seen
+        before.
+
+        """
+        # setup a sane default based on svn user info
+        if '@' in svn_author:
+            name = svn_author.split('@')[0]
+            email = svn_author
+        else:
+            name = svn_author
+            email = '{0}@{1}'.format(svn_author, DEFAULT_EMAIL_DOMAIN)
+
+        # try to find real name from our map file
+        if name in self._author_map:
+            email = self._author_map[name]['email']
+            name = self._author_map[name]['name']
+        else:
+            self.unmapped.add(svn_author)
+
+        return '{0} <{1}>'.format(name, email)
+
+    def resolve(self, svn_author):
+        """Return the git author string for a single svn author.
+
+        """
+        svn_author = svn_author.strip()
+        if svn_author not in self._lookup:
+            self._lookup[svn_author] = self._resolve_uncached(svn_author)
+            self._cache_dirty = True
+            if svn_author in self.unmapped:
+                print("WARNING: svn author '{0}' is not in the author map, "
+                      "using '{1}'".format(svn_author,
+                                           self._lookup[svn_author]))
+        return self._lookup[svn_author]
+
+    def precompute(self, svn_authors):
+        """Resolve all the svn authors from a bulk log query at once.
+
+        Returns the sorted list of authors that are not in the author
+        map.
+
+        """
+        for svn_author in set(svn_authors):
+            svn_author = svn_author.strip()
+            if svn_author not in self._lookup:
+                self._lookup[svn_author] = self._resolve_uncached(svn_author)
+                self._cache_dirty = True
+        return sorted(a for a in set(svn_authors) if a in self.unmapped)
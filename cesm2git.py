@@ -10,27 +10,97 @@ from __future__ import print_function
 
 import sys
 
-if sys.hexversion < 0x02070000:
-    print(70 * "*")
-    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
-    print("It appears that you are running python {0}".format(
-        ".".join(str(x) for x in sys.version_info[0:3])))
-    print(70 * "*")
-    sys.exit(1)
+from python_version import check_python_version
+
+check_python_version()
 
 import argparse
-import json
 import os
 import shutil
 import subprocess
-import traceback
 import xml.etree.ElementTree as etree
-import xml.dom.minidom as minidom
 
-if sys.version_info[0] == 2:
-    from ConfigParser import SafeConfigParser as config_parser
-else:
-    from configparser import ConfigParser as config_parser
+from authors import authors_from_log_xml, get_author_resolver
+from git_backend import NULL_SHA, GitSession, get_git_session
+from staging import break_link
+from tag_job import TagJob, config_parser
+import profiling
+import progress
+import revmap
+import runner
+import staging
+
+# number of concurrent svn exports of individual files
+SVN_EXPORT_JOBS = 4
+
+# svn export options for the tag itself, see svn_checkout_cesm
+TAG_EXPORT_OPTIONS = ["--ignore-externals", "--ignore-keywords"]
+
+# svn export options of the shifted root files and directories, their
+# externals are exported with them
+ROOT_EXPORT_OPTIONS = ["--ignore-keywords"]
+
+# output of svn metadata commands run ahead of time, keyed by command,
+# see seed_svn_metadata
+_svn_metadata = {}
+
+
+# top level files and directories from svn that are removed from the
+# working copy before exporting a new tag, see remove_current_working_copy
+REMOVED_ROOT_FILES = [
+    "ChangeLog",
+    ".ChangeLog_template",
+    "ChangeSum",
+    "KnownBugs",
+    ".CLMTrunkChecklist",
+    "UpDateChangeLog.pl",
+    "README",
+    "README_cime",
+    "README_EXTERNALS",
+    "SVN_EXTERNAL_DIRECTORIES",
+    "ExpectedTestFails.xml",
+    "parse_cime.cs.status",
+    "Copyright",
+    "COPYRIGHT",
+    "README.DGVM",
+    "Quickstart.GUIDE",
+    "Quickstart.userdatasets",
+    "PTCLM.py",
+    "PTCLMmkdata",
+    "PTCLMsublist",
+    "PTCLMsublist_prog.py",
+    "batchque.py",
+    "buildtools",
+    "testcases.csh",
+]
+
+REMOVED_ROOT_DIRS = [
+    "components",
+    "models",
+    "cime",
+    "doc",
+    "bld",
+    "src",
+    "src_clm40",
+    "tools",
+    "test",
+    "cimetest",
+    "cime_config",
+    "cesmtest",
+    "source_glc",
+    "source_glc.latest",
+    "source_glimmer",
+    "source_glimmer-cism",
+    "source_glimmer.latest",
+    "source_slap",
+    "drivers",
+    "mpi",
+    "input_templates",
+    "PTCLM_sitedata",
+    "mydatafiles",
+    "test",
+    "usr_files",
+]
 
 
 # -------------------------------------------------------------------------------
@@ -59,93 +129,86 @@ def commandline_options():
     parser.add_argument('--config', nargs=1, required=True,
                         help='path to config file')
 
+    add_runner_options(parser)
+    add_staging_options(parser)
+
+    parser.add_argument('--git-plumbing', action='store_true', default=False,
+                        help='write tags without externals directly into '
+                        'the repo with git plumbing instead of a '
+                        'temporary clone.')
+
     parser.add_argument('--repo', nargs=1, default=['clm-experimental'],
                         help='path to rtm git repo, relative to cwd.')
 
     parser.add_argument('--feelin-lucky', action='store_true', default=False,
                         help='push update back to the master repo')
 
+    parser.add_argument('--profile', nargs=1, default=[''],
+                        help='profile the import per phase and write the '
+                        'profiles to the specified directory, see '
+                        'profiling.py.')
+
     options = parser.parse_args()
     return options
 
 
-def read_config_file(filename):
-    """The configuration file contains information about which cesm tag to
-    check out and which svn externals need to be changed:
+def add_runner_options(parser):
+    """Command line options controlling how svn and git are run, shared
+    with tag-loop.py.
 
-    [cesm]
-    repo = https://svn-ccsm-models.cgd.ucar.edu
-    piorepo = https://parallelio.googlecode.com
-    tag = cesm1/alphas/tags/cesm1_3_alpha13b
+    """
+    parser.add_argument('--command-log', nargs=1, default=[''],
+                        help='append the output of every svn and git '
+                        'command to the specified file.')
 
-    [externals]
-    scripts = scripts/trunk_tags/scripts4_140915
-    models/ocn/pop2  = pop2/trunk_tags/cesm_pop_2_1_20140828
+    parser.add_argument('--command-timeout', nargs=1, type=int,
+                        default=[runner.DEFAULT_TIMEOUT],
+                        help='seconds before an svn or git command is '
+                        'considered hung and killed.')
 
+    parser.add_argument('--retries', nargs=1, type=int,
+                        default=[runner.DEFAULT_RETRIES],
+                        help='number of times to retry commands that fail '
+                        'with transient network errors.')
 
 
-    NOTE: the options in the external sections are exactly the
-    directory paths used in SVN_EXTERNAL_DIRECTORIES, the values are
-    the url minus the repo prefix.
+def configure_runner(options):
+    """Setup the process wide command runner from the command line options.
+    """
+    return runner.configure(log_filename=options.command_log[0] or None,
+                            echo=options.debug,
+                            timeout=options.command_timeout[0],
+                            retries=options.retries[0])
 
-    FIXME(bja, 201410) This assumes we won't want to update an
-    external that isn't stored in svn. Probably a bad assumption.
+
+def add_staging_options(parser):
+    """Command line options for the svn export cache, shared with
+    tag-loop.py.
 
     """
-    print("Reading configuration file : {0}".format(filename))
+    parser.add_argument('--export-cache', nargs=1, default=[''],
+                        help='keep svn exports in the specified directory '
+                        'and link them into the working copy instead of '
+                        'exporting every time.')
 
-    cfg_file = os.path.abspath(filename)
-    if not os.path.isfile(cfg_file):
-        raise RuntimeError("Could not find config file: {0}".format(cfg_file))
+    parser.add_argument('--link-mode', nargs=1, default=['auto'],
+                        choices=staging.LINK_MODES,
+                        help='how cached exports are placed in the working '
+                        'copy, auto uses reflinks, then hard links, then '
+                        'copies.')
 
-    config = config_parser()
-    config.read(cfg_file)
-
-    repo_config = {}
-
-    def _check_for_required_section(conf, section):
-        if not conf.has_section(section):
-            raise RuntimeError("ERROR: repo config file must contain a "
-                               "'{0}' section".format(section))
-
-    def _get_section_required_option(conf, section, option, upper_case=False):
-        sect = list_to_dict(conf.items(section))
-        if option not in sect and option.upper() not in sect:
-            raise RuntimeError("ERROR: repo config section '{0}' must contain"
-                               "a '{1}' keyword.".format(section, option))
-
-        opt = {option: sect[option]}
-        if upper_case is True:
-            opt = {option.upper(): sect[option]}
-
-        return opt
-
-    section = "git"
-    repo_config[section] = {}
-    _check_for_required_section(config, section)
-    keys = ["branch", ]
-    for k in keys:
-        repo_config[section].update(
-            _get_section_required_option(
-                config, section, k))
-
-    section = "cesm"
-    repo_config[section] = {}
-    _check_for_required_section(config, section)
-    for k in config.items(section):
-        key = k[0]
-        repo_config[section].update(
-            _get_section_required_option(
-                config,
-                section,
-                key))
-
-    section = "externals"
-    repo_config[section] = {}
-    if config.has_section(section):
-        repo_config[section].update(list_to_dict(config.items(section)))
-
-    return repo_config
+    parser.add_argument('--sparse-fetch', action='store_true', default=False,
+                        help='fetch only the standalone path and shifted '
+                        'root files of collapsed tags through one sparse '
+                        'svn working copy, when not using --export-cache.')
+
+
+def configure_staging(options):
+    """Setup the process wide export cache from the command line options.
+    """
+    return staging.configure(cache_dir=options.export_cache[0] or None,
+                             mode=options.link_mode[0], jobs=SVN_EXPORT_JOBS,
+                             sparse_fetch=options.sparse_fetch)
 
 
 # -------------------------------------------------------------------------------
@@ -153,50 +216,22 @@ def read_config_file(filename):
 # misc work functions
 #
 # -------------------------------------------------------------------------------
-def list_to_dict(input_list, upper_case=False):
-    output_dict = {}
-    for item in input_list:
-        key = item[0]
-        value = item[1]
-        if upper_case is True:
-            key = key.upper()
-        output_dict[key] = value
-    return output_dict
-
-
-def string_to_bool(bool_string):
-    """Convert a boolean string to a boolean value
-    """
-    value = None
-    if bool_string.lower() == 'false':
-        value = False
-    elif bool_string.lower() == 'true':
-        value = True
-    else:
-        raise RuntimeError("Invalid string for boolean conversion "
-                           "'{0}'".format(bool_string))
-    return value
-
-
-def new_tag_from_config(config):
+def new_tag_from_job(job):
     """Generate a meaningful, if very verbose tag name from the specified
     cesm tag and externals
 
     """
-    new_tag = config["cesm"]["tag"].split('/')[-1]
-    for ext in config["externals"]:
-        tag = config["externals"][ext].split('/')[-1]
-        new_tag += "-{0}".format(tag)
-
+    new_tag = job.git_tag
     print("Creating new tag: {0}".format(new_tag))
     return new_tag
 
 
-def remove_current_working_copy(cesm_config):
+def remove_current_working_copy(job):
     """Removes the current working copy of cesm so that svn checkout will work.
 
     NOTE(bja, 2016, 2017): if the list of files in the root directory
-    changes from the hard coded list below, then svn co will have
+    changes from the hard coded REMOVED_ROOT_FILES and REMOVED_ROOT_DIRS
+    lists, then svn co will have
     problems with an error like:
 
         svn co https://svn-ccsm-models.cgd.ucar.edu/clm2/trunk_tags/clm4_5_12_r197 .
@@ -223,77 +258,25 @@ def remove_current_working_copy(cesm_config):
     shouldn't be an issue....
 
     """
-    suffix = "standalone"
-    if "shift_root_suffix" in cesm_config:
-        suffix = cesm_config["shift_root_suffix"]
-
-    rm_files = [
-        "ChangeLog",
-        ".ChangeLog_template",
-        "ChangeSum",
-        "KnownBugs",
-        ".CLMTrunkChecklist",
-        "UpDateChangeLog.pl",
-        "README",
-        "README_cime",
-        "README_EXTERNALS",
-        "SVN_EXTERNAL_DIRECTORIES",
-        "ExpectedTestFails.xml",
-        "parse_cime.cs.status",
-        "Copyright",
-        "COPYRIGHT",
-        "README.DGVM",
-        "Quickstart.GUIDE",
-        "Quickstart.userdatasets",
-        "PTCLM.py",
-        "PTCLMmkdata",
-        "PTCLMsublist",
-        "PTCLMsublist_prog.py",
-        "batchque.py",
-        "buildtools",
-        "testcases.csh",
-    ]
+    for name in removed_root_entries(job):
+        if os.path.isdir(name) and not os.path.islink(name):
+            shutil.rmtree(name)
+        elif os.path.exists(name):
+            os.remove(name)
 
-    for f in rm_files:
-        if os.path.exists(f):
-            os.remove(f)
-
-        shift_file = "{0}.{1}".format(f, suffix)
-        if os.path.exists(shift_file):
-            os.remove(shift_file)
-
-    rm_dirs = [
-        "components",
-        "models",
-        "cime",
-        "doc",
-        "bld",
-        "src",
-        "src_clm40",
-        "tools",
-        "test",
-        "cimetest",
-        "cime_config",
-        "cesmtest",
-        "source_glc",
-        "source_glc.latest",
-        "source_glimmer",
-        "source_glimmer-cism",
-        "source_glimmer.latest",
-        "source_slap",
-        "drivers",
-        "mpi",
-        "input_templates",
-        "PTCLM_sitedata",
-        "mydatafiles",
-        "test",
-        "usr_files",
 
-    ]
+def removed_root_entries(job):
+    """Names of the top level files and directories of the previous tag
+    that are removed before exporting a new tag.
 
-    for d in rm_dirs:
-        if os.path.exists(d):
-            shutil.rmtree(d)
+    """
+    suffix = job.shift_root_suffix
+    names = []
+    for f in REMOVED_ROOT_FILES:
+        names.append(f)
+        names.append("{0}.{1}".format(f, suffix))
+    names.extend(REMOVED_ROOT_DIRS)
+    return names
 
 
 # -------------------------------------------------------------------------------
@@ -301,15 +284,26 @@ def remove_current_working_copy(cesm_config):
 # svn wrapper functions
 #
 # -------------------------------------------------------------------------------
-def svn_checkout_cesm(cesm_config, debug):
+def svn_checkout_cesm(job, debug, kept_files=None):
     """Checkout the user specified cesm tag
+
+    kept_files are the top level entries of the previous tag that the
+    new tag is exported over, if they aren't in the current directory,
+    e.g. when exporting into an empty directory. Shifted root files
+    don't take their names, see shifted_root_destination.
+
     """
     print("Checking out cesm tag from svn...", end='')
-    url = cesm_config['repo']
-    cesm_tag = cesm_config['tag']
-    tag = os.path.join(url, cesm_tag)
-    if string_to_bool(cesm_config["collapse_standalone"]):
-        tag = os.path.join(tag, cesm_config['standalone_path'])
+    if staging.sparse_fetch_enabled() and staging.get_cache() is None and \
+       job.collapse_standalone and \
+       svn_sparse_fetch(job, debug, kept_files=kept_files):
+        if not debug:
+            print(" done.")
+        return
+
+    tag = job.url
+    if job.collapse_standalone:
+        tag = os.path.join(tag, job.standalone_path)
 
     cmd = [
         "svn",
@@ -320,13 +314,16 @@ def svn_checkout_cesm(cesm_config, debug):
         tag,
         "."
     ]
-    output = subprocess.STDOUT
     if debug:
         print("\n")
         print(" ".join(cmd))
-        output = None
+    export_cache = staging.get_cache()
     try:
-        subprocess.check_output(cmd, shell=False, stderr=output)
+        if export_cache is not None:
+            cached = export_cache.export(tag, options=TAG_EXPORT_OPTIONS)
+            export_cache.materialize(cached, ".")
+        else:
+            runner.run(cmd, capture=False, echo=debug)
     except subprocess.CalledProcessError as error:
         print(error)
         print("    {0}".format(" ".join(cmd)))
@@ -334,8 +331,8 @@ def svn_checkout_cesm(cesm_config, debug):
 
     if not debug:
         print(" done.")
-    if string_to_bool(cesm_config['shift_root_files']):
-        svn_shift_root_files(cesm_config)
+    if job.shift_root_files:
+        svn_shift_root_files(job, kept_files=kept_files)
 
 
 def update_svn_externals(temp_repo_dir, repo_url, external_mods):
@@ -349,6 +346,8 @@ def update_svn_externals(temp_repo_dir, repo_url, external_mods):
         return
 
     shutil.copy2(externals_filename, "{0}.orig".format(externals_filename))
+    # the file is rewritten in place, it may be linked to the export cache
+    break_link(externals_filename)
 
     new_externals = []
     with open(externals_filename, 'r') as externals_file:
@@ -385,7 +384,7 @@ def svn_set_new_externals():
         "SVN_EXTERNAL_DIRECTORIES",
         ".",
     ]
-    subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    runner.run(cmd, capture=False)
 
 
 def svn_update(path):
@@ -396,7 +395,7 @@ def svn_update(path):
         "update",
         path,
     ]
-    subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    runner.run(cmd, capture=False)
 
 
 def svn_switch(temp_repo_dir, switch_dir, url, tag):
@@ -413,31 +412,50 @@ def svn_switch(temp_repo_dir, switch_dir, url, tag):
         "switch",
         "{0}/{1}".format(url, tag),
     ]
-    subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    runner.run(cmd, capture=False)
     os.chdir(temp_repo_dir)
 
 
-def svn_log_info(cesm_config, author_map, debug):
-    """Extract the svn commit info so we can use it in the git commit.
+def seed_svn_metadata(cmd, output):
+    """Keep the output of an svn metadata command that was run ahead of
+    time, see svn_async.prefetch_metadata. The next svn_metadata call
+    for the same command returns it instead of running the command.
 
     """
-    print("Extracting cesm tag info from svn...", end='')
-    url = cesm_config['repo']
-    cesm_tag = cesm_config['tag']
-    cmd = [
+    _svn_metadata[tuple(cmd)] = output
+
+
+def svn_metadata(cmd):
+    """Output of an svn metadata command, prefetched or run now.
+    """
+    output = _svn_metadata.pop(tuple(cmd), None)
+    if output is None:
+        output = runner.run(cmd)
+    return output
+
+
+def svn_log_command(job):
+    return [
         "svn",
         "log",
         "--limit", "1",
         "--xml",
-        "{0}/{1}".format(url, cesm_tag),
+        job.url,
     ]
 
+
+def svn_log_info(job, author_resolver, debug):
+    """Extract the svn commit info so we can use it in the git commit.
+
+    """
+    print("Extracting cesm tag info from svn...", end='')
+    cmd = svn_log_command(job)
+
     if debug:
         print("\n")
         print(" ".join(cmd))
         output = None
-    output = subprocess.check_output(
-        cmd, shell=False, stderr=subprocess.STDOUT)
+    output = svn_metadata(cmd)
 
     if not debug:
         print(" done.")
@@ -447,24 +465,9 @@ def svn_log_info(cesm_config, author_map, debug):
     xml = etree.fromstring(output)
     # print(xml)
     author = xml.findall('logentry/author')[0].text
-
-    # setup a sane default based on svn user info
-    if '@' in author:
-        name = author.split('@')[0]
-        email = author
-    else:
-        name = author
-        email = '{0}@ucar.edu'.format(author)
-
-    # try to find real name from our map file
-    if name in author_map:
-        # NOTE(bja, 2017-11) must set name last because overwritting
-        # name will cause a key error!
-        email = author_map[name]['email']
-        name = author_map[name]['name']
-
-    author = '{0} <{1}>'.format(name, email)
-    log_info['author'] = author
+    log_info['author'] = author_resolver.resolve(author)
+    # last revision the tag was changed in, recorded in the revmap
+    log_info['revision'] = int(xml.findall('logentry')[0].get('revision'))
 
     log_info['date'] = xml.findall('logentry/date')[0].text
     log_info['msg'] = xml.findall('logentry/msg')[0].text
@@ -472,22 +475,269 @@ def svn_log_info(cesm_config, author_map, debug):
     return log_info
 
 
-def svn_list_root_files(cesm_config):
+def svn_log_authors(repo, tag_directory):
+    """Extract the svn authors of every commit to the tag directory with
+    a single log query, so author mapping can be resolved in bulk.
+
     """
+    cmd = [
+        "svn",
+        "log",
+        "--quiet",
+        "--xml",
+        "{0}/{1}".format(repo, tag_directory),
+    ]
+    output = runner.run(cmd)
+    xml = etree.fromstring(output)
+    return authors_from_log_xml(xml)
+
+
+def svn_list_xml(url, recursive=False):
+    """List the contents of an svn url, returning a list of dictionaries
+    with the kind, name (relative to url) and size of each entry.
+
     """
-    url = cesm_config['repo']
-    cesm_tag = cesm_config['tag']
     cmd = [
         "svn",
         "list",
-        "{0}/{1}".format(url, cesm_tag)
+        "--xml",
+    ]
+    if recursive:
+        cmd.append("--recursive")
+    cmd.append(url)
+    output = runner.run(cmd)
+    xml = etree.fromstring(output)
+    entries = []
+    for entry in xml.findall('list/entry'):
+        size = entry.find('size')
+        entries.append({
+            'kind': entry.get('kind'),
+            'name': entry.find('name').text,
+            'size': int(size.text) if size is not None else 0,
+        })
+    return entries
+
+
+def svn_list_root_command(job):
+    return [
+        "svn",
+        "list",
+        job.url,
     ]
-    output = subprocess.check_output(cmd, shell=False,
-                                     stderr=subprocess.STDOUT)
-    return output
 
 
-def svn_shift_root_files(cesm_config):
+def svn_list_root_files(job):
+    """
+    """
+    output = svn_metadata(svn_list_root_command(job))
+    return output.decode('utf-8')
+
+
+def svn_diff_summary_command(job):
+    """svn command summarizing the changes between the tag before the job
+    and the job's tag, or None if the working copy of the previous tag
+    isn't just updated with the svn changes: no previous tag, or svn
+    externals change files svn doesn't report. Tags that shift root
+    files are compared from the tag root, see svn_changed_paths.
+
+    """
+    if job.previous_tag is None or job.checkout_externals:
+        return None
+    urls = ["{0}/{1}".format(job.repo, job.previous_tag), job.url]
+    if job.collapse_standalone and not job.shift_root_files:
+        urls = [os.path.join(url, job.standalone_path) for url in urls]
+    return ["svn", "diff", "--summarize", "--xml"] + urls
+
+
+def svn_changed_paths(job):
+    """Paths relative to the working copy root that svn changed since
+    the previous tag, as lists of the added or modified paths and of
+    the deleted paths, or None if they aren't known. Needs the tag's
+    shifted root files, so only known after the export.
+
+    """
+    from urllib.parse import unquote
+
+    cmd = svn_diff_summary_command(job)
+    if cmd is None:
+        return None
+    try:
+        output = svn_metadata(cmd)
+    except subprocess.CalledProcessError as error:
+        print("    svn diff of the previous tag failed, adding every "
+              "file: {0}".format(error))
+        return None
+    roots = [url.rstrip('/') + '/' for url in cmd[-2:]]
+    changed = []
+    deleted = []
+    for path in etree.fromstring(output).iter('path'):
+        item = path.get('item')
+        if item == 'none' and path.get('kind') == 'dir':
+            # git doesn't track directory properties
+            continue
+        url = path.text.strip()
+        for root in roots:
+            if url.startswith(root):
+                names = working_copy_paths(job, unquote(url[len(root):]))
+                if item == 'deleted':
+                    deleted.extend(names)
+                else:
+                    changed.extend(names)
+                break
+    return changed, deleted
+
+
+def working_copy_paths(job, path):
+    """Where a path of the tag, relative to the root compared by
+    svn_diff_summary_command, is in the working copy: in the
+    standalone directory of collapsed tags, and for shifted root files
+    where svn_shift_root_files put them. Paths that aren't exported
+    have none.
+
+    """
+    if not job.shift_root_files:
+        return [path]
+    paths = []
+    if job.collapse_standalone:
+        prefix = job.standalone_path.rstrip('/') + '/'
+        if path.startswith(prefix):
+            paths.append(path[len(prefix):])
+    else:
+        paths.append(path)
+    top, separator, rest = path.partition('/')
+    destination = job.shifted_root_files.get(top)
+    if destination is not None:
+        paths.append(destination + separator + rest)
+    return paths
+
+
+def is_shifted_root_entry(job, root_file):
+    """Whether svn_shift_root_files copies a top level file or directory
+    of the tag into the repo.
+
+    """
+    if "trunk" in root_file:
+        # one-off mistake in clm4_5_32 that we need to skip to have
+        # everything run automatically
+        return False
+    if root_file in job.standalone_path:
+        # 'models' and 'components' directories are returned by svn
+        # list, but we want to skip them.
+        return False
+    if root_file in ['ChangeLog', 'ChangeSum']:
+        # don't copy changelog because it is in doc !
+        return False
+    return True
+
+
+def shifted_root_destination(job, root_file, existing_files):
+    """Name a shifted top level file or directory is exported as.
+    """
+    # by default we just use the same filename
+    destination = root_file
+    if destination == "SVN_EXTERNAL_DIRECTORIES":
+        # always want standalone externals renamed with suffix.
+        destination = "{0}.{1}".format(root_file,
+                                       job.shift_root_suffix)
+    if destination in existing_files:
+        # any other duplicate files get renamed
+        destination = "{0}.{1}".format(root_file,
+                                       job.shift_root_suffix)
+    return destination
+
+
+def sparse_fetch_plan(job):
+    """The paths of a tag that collapses the standalone directory that
+    svn_checkout_cesm needs, relative to the tag: the directories that
+    are fetched completely (the standalone path first) and the single
+    files. Directory names from 'svn list' end with a '/', the same as
+    in svn_shift_root_files.
+
+    """
+    directories = [job.standalone_path]
+    files = []
+    if job.shift_root_files:
+        for root_file in svn_list_root_files(job).split():
+            if not is_shifted_root_entry(job, root_file):
+                continue
+            if root_file.endswith('/'):
+                directories.append(root_file)
+            else:
+                files.append(root_file)
+    return directories, files
+
+
+def svn_sparse_fetch(job, debug, kept_files=None):
+    """Fetch exactly the paths in sparse_fetch_plan with a sparse working
+    copy, one checkout and at most two updates in place of an export
+    per path, then export them from the working copy into the current
+    directory the same way as svn_checkout_cesm and
+    svn_shift_root_files. Returns False without fetching anything if
+    a shifted root directory defines svn:externals, the sparse working
+    copy never fetches externals but svn_shift_root_files exports
+    them.
+
+    """
+    import tempfile
+
+    directories, files = sparse_fetch_plan(job)
+    if svn_externals_defined(job, directories[1:]):
+        return False
+    wc_dir = tempfile.mkdtemp(prefix='cesm2git-sparse-')
+    try:
+        wc = os.path.join(wc_dir, 'wc')
+        runner.run(["svn", "checkout", "--depth", "empty",
+                    "--ignore-externals", job.url, wc],
+                   capture=False, echo=debug)
+        dir_paths = [os.path.join(wc, d).rstrip('/') for d in directories]
+        runner.run(["svn", "update", "--parents", "--set-depth", "infinity",
+                    "--ignore-externals"] + dir_paths,
+                   capture=False, echo=debug)
+        if files:
+            runner.run(["svn", "update", "--ignore-externals"] +
+                       [os.path.join(wc, f) for f in files],
+                       capture=False, echo=debug)
+
+        # exports from the working copy don't touch the network
+        runner.run(["svn", "export", "--force", "--ignore-externals",
+                    "--ignore-keywords", dir_paths[0], "."],
+                   capture=False, echo=debug)
+        existing_files = set(os.listdir('.')) | set(kept_files or [])
+        export_cmds = []
+        for root_file in directories[1:] + files:
+            destination = shifted_root_destination(job, root_file,
+                                                   existing_files)
+            job.shifted_root_files[root_file.rstrip('/')] = \
+                destination.rstrip('/')
+            export_cmds.append(["svn", "export", "--force"] +
+                               ROOT_EXPORT_OPTIONS +
+                               [os.path.join(wc, root_file), destination])
+        runner.run_many(export_cmds, jobs=SVN_EXPORT_JOBS, capture=False)
+    finally:
+        shutil.rmtree(wc_dir, ignore_errors=True)
+    return True
+
+
+def svn_externals_defined(job, directories):
+    """Whether any of the top level directories of the tag, or anything
+    below them, sets svn:externals. One recursive propget for all
+    directories.
+
+    """
+    if not directories:
+        return False
+    cmd = [
+        "svn",
+        "propget",
+        "--recursive",
+        "svn:externals",
+    ]
+    cmd.extend(os.path.join(job.url, d).rstrip('/') for d in directories)
+    output = runner.run(cmd)
+    return bool(output.strip())
+
+
+def svn_shift_root_files(job, kept_files=None):
     """The main checkout shifted the standalone checkout contents back to
     the root of the repo directory. To preserve all information
     associated with a tag we need to grab the files from the
@@ -499,45 +749,49 @@ def svn_shift_root_files(cesm_config):
     single files. But since we already have a checkout of the main
     model/component dir, export is simpler and avoids confusing svn.)
 
+    kept_files are top level entries of the previous tag that aren't
+    in the current directory, see svn_checkout_cesm.
+
     """
-    root_files = svn_list_root_files(cesm_config).split()
-    existing_files = os.listdir('.')
+    root_files = svn_list_root_files(job).split()
+    existing_files = set(os.listdir('.')) | set(kept_files or [])
 
-    url = cesm_config['repo']
-    cesm_tag = cesm_config['tag']
-    tag = os.path.join(url, cesm_tag)
+    tag = job.url
 
+    exports = []
     for root_file in root_files:
-        if "trunk" in root_file:
-            # one-off mistake in clm4_5_32 that we need to skip to have
-            # everything run automatically
-            continue
-        if root_file in cesm_config["standalone_path"]:
-            # 'models' and 'components' directories are returned by svn
-            # list, but we want to skip them.
-            continue
-        if root_file in ['ChangeLog', 'ChangeSum']:
-            # don't copy changelog because it is in doc !
+        if not is_shifted_root_entry(job, root_file):
             continue
-        # by default we just use the same filename
-        destination = root_file
-        if destination == "SVN_EXTERNAL_DIRECTORIES":
-            # always want standalone externals renamed with suffix.
-            destination = "{0}.{1}".format(root_file,
-                                           cesm_config["shift_root_suffix"])
-        if destination in existing_files:
-            # any other duplicate files get renamed
-            destination = "{0}.{1}".format(root_file,
-                                           cesm_config["shift_root_suffix"])
+        destination = shifted_root_destination(job, root_file,
+                                               existing_files)
         checkout_path = os.path.join(tag, root_file)
+        exports.append((checkout_path, destination))
+        job.shifted_root_files[root_file.rstrip('/')] = \
+            destination.rstrip('/')
+
+    export_cache = staging.get_cache()
+    if export_cache is not None:
+        if exports:
+            cached = export_cache.export_many([e[0] for e in exports],
+                                              options=ROOT_EXPORT_OPTIONS)
+            for path, (_, destination) in zip(cached, exports):
+                export_cache.materialize(path, destination)
+        return
+
+    export_cmds = []
+    for checkout_path, destination in exports:
         cmd = [
             "svn",
             "export",
+            "--force",
+        ] + ROOT_EXPORT_OPTIONS + [
             checkout_path,
             destination,
         ]
-        subprocess.check_output(cmd, shell=False,
-                                stderr=subprocess.STDOUT)
+        export_cmds.append(cmd)
+
+    # the exports are independent of each other, so run them concurrently
+    runner.run_many(export_cmds, jobs=SVN_EXPORT_JOBS, capture=False)
 
 
 # -------------------------------------------------------------------------------
@@ -552,15 +806,20 @@ def clone_cesm_git(repo_dir, temp_repo_dir):
     executed from directory 'work', then work/ed-clm-git is the main git
     repo to pull new src into.
 
+    The clone borrows the repo's objects through alternates (--shared)
+    instead of copying or linking every object file, the new objects
+    are pushed back before the clone is removed.
+
     """
     print("Cloning git repo at : {0}".format(repo_dir))
     cmd = [
         "git",
         "clone",
+        "--shared",
         repo_dir,
         temp_repo_dir,
     ]
-    subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    runner.run(cmd, capture=False)
 
 
 def switch_git_branch(branch):
@@ -571,7 +830,7 @@ def switch_git_branch(branch):
         "checkout",
         branch,
     ]
-    subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    runner.run(cmd, capture=False)
 
 
 def find_git_externals(temp_repo_dir):
@@ -623,6 +882,13 @@ def git_update_subtree(git_externals):
     """
     print("Updating git subtrees....")
     print(git_externals)
+    if git_externals:
+        # the svn changes to the subtrees weren't committed, subtree
+        # pull needs a clean working copy.
+        ext_dirs = [ext['ext_dir'] for ext in git_externals]
+        runner.run(['git', 'checkout', '--'] + ext_dirs, capture=False)
+        runner.run(['git', 'clean', '-d', '-f', '--'] + ext_dirs,
+                   capture=False)
     for e in git_externals:
         cmd = [
             'git',
@@ -636,7 +902,7 @@ def git_update_subtree(git_externals):
         ]
         print("    {0}".format(' '.join(cmd)))
         try:
-            subprocess.check_call(cmd, shell=False, stderr=subprocess.STDOUT)
+            runner.run(cmd, capture=False, echo=True, retries=0)
         except subprocess.CalledProcessError:
                 git_remove_add_subtree(cmd, e['ext_dir'])
 
@@ -655,7 +921,7 @@ def git_remove_add_subtree(subtree_cmd, ext_dir):
     print("    {0}".format(' '.join(cmd)))
     commit_removal = False
     try:
-        subprocess.check_call(cmd, shell=False, stderr=subprocess.STDOUT)
+        runner.run(cmd, capture=False, echo=True)
         commit_removal = True
     except subprocess.CalledProcessError as e:
         # error 128 seems to be the return code for non-existant
@@ -671,7 +937,7 @@ def git_remove_add_subtree(subtree_cmd, ext_dir):
                    ext_dir),
         ]
         print("    {0}".format(' '.join(cmd)))
-        subprocess.check_call(cmd, shell=False, stderr=subprocess.STDOUT)
+        runner.run(cmd, capture=False, echo=True)
 
     # NOTE(bja, 201609) directory won't be empty because of the hidden
     # .svn directory. need to use shutil.rmtree instead of os.rmdir.
@@ -681,43 +947,110 @@ def git_remove_add_subtree(subtree_cmd, ext_dir):
     subtree_cmd[2] = 'add'
     print("    {0}".format(' '.join(subtree_cmd)))
     try:
-        subprocess.check_call(subtree_cmd, shell=False,
-                              stderr=subprocess.STDOUT)
+        runner.run(subtree_cmd, capture=False, echo=True)
     except subprocess.CalledProcessError as error:
         print("subtree error :\n{0}".format(error))
         raise RuntimeError(error)
 
 
-def git_add_new_cesm(new_tag, git_externals, log_info):
-    """Add the new cesm files to git
+def git_changed_paths(job, generated):
+    """Paths of the working copy that differ from the branch head, as
+    lists of the paths to add and of the paths to remove from the
+    index, or None if the branch head isn't the previous tag or the svn
+    changes aren't known, then every file has to be added.
+
+    The paths to add are the paths svn added or modified and the
+    generated files, minus the ignored untracked ones. Paths deleted in
+    svn are only removed inside the top level entries that
+    remove_current_working_copy removed, the other files of the
+    previous tag are kept, the same as adding every file.
+
     """
-    print("Removing git_externals changes from delta.")
-    for ext in git_externals:
-        # reset any changed files
-        cmd = [
-            'git',
-            'checkout',
-            '--',
-            ext['ext_dir'],
-        ]
-        subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
-        # remove any added files
-        cmd = [
-            'git',
-            'clean',
-            '-d',
-            '-f',
-            ext['ext_dir'],
-        ]
-        subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    if job.previous_tag is None:
+        return None
+    try:
+        output = runner.run(["git", "rev-parse", "HEAD",
+                             "refs/tags/{0}^{{commit}}".format(
+                                 job.previous_git_tag)])
+    except subprocess.CalledProcessError:
+        return None
+    head, previous = output.decode('ascii').split()
+    if head != previous:
+        return None
+    paths = svn_changed_paths(job)
+    if paths is None:
+        return None
+    changed, deleted = paths
+    missing = [path for path in changed if not os.path.lexists(path)]
+    if missing:
+        print("    {0} paths changed in svn are missing from the export, "
+              "adding every file".format(len(missing)))
+        return None
+
+    output = runner.run(["git", "ls-tree", "--name-only", "-z", "HEAD"])
+    head_names = set(output.decode('utf-8').split('\0'))
+    removed_entries = set(removed_root_entries(job))
+    removed = [path for path in deleted
+               if path.split('/')[0] in removed_entries]
+    # removed top level entries that the export didn't bring back, e.g.
+    # files that were never in svn
+    removed.extend(name for name in head_names
+                   if name in removed_entries and not os.path.lexists(name))
+    # shifted root files can land under a new name without changing in
+    # svn, when an earlier tag left a file with their name
+    changed.extend(destination
+                   for destination in job.shifted_root_files.values()
+                   if destination not in head_names)
+    added = set(changed + generated)
+    # 'git add --all' of the whole tree skips untracked ignored files,
+    # naming them explicitly is an error.
+    added.difference_update(git_ignored_paths(sorted(added)))
+    return sorted(added), sorted(set(removed))
+
+
+def git_ignored_paths(paths):
+    """The untracked paths that .gitignore excludes, tracked paths are
+    never ignored.
+
+    """
+    if not paths:
+        return []
+    cmd = ["git", "check-ignore", "--stdin", "-z"]
+    try:
+        output = runner.run(cmd, stdin_data='\0'.join(paths).encode('utf-8'))
+    except subprocess.CalledProcessError as error:
+        if error.returncode == 1:
+            # nothing is ignored
+            return []
+        raise
+    return [path for path in output.decode('utf-8').split('\0') if path]
+
+
+def git_add_new_cesm(new_tag, git_externals, log_info, changed_paths=None):
+    """Add the new cesm files to git and commit them.
+
+    With the changed paths from git_changed_paths only those paths are
+    updated in the index, and the commit is written from the index with
+    plumbing commands, since 'git commit' would check every file the
+    export rewrote. Without them every file is added. The git externals
+    are never added, they are updated as subtrees afterwards.
+
+    """
+    if changed_paths is not None:
+        git_commit_changed_paths(new_tag, log_info, *changed_paths)
+        return
 
     print("Committing new cesm to git")
     cmd = [
         "git",
         "add",
         "--all",
+        "--",
+        ".",
     ]
-    subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    cmd.extend(":(exclude){0}".format(ext['ext_dir'])
+               for ext in git_externals)
+    runner.run(cmd, capture=False)
 
     tmp_filename = 'svn-msg.tmp'
     with open(tmp_filename, 'w') as msg:
@@ -734,7 +1067,7 @@ def git_add_new_cesm(new_tag, git_externals, log_info):
     ]
     if True:
         print(" ".join(cmd))
-    subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    runner.run(cmd, capture=False)
     os.remove(tmp_filename)
 
     cmd = [
@@ -745,7 +1078,66 @@ def git_add_new_cesm(new_tag, git_externals, log_info):
     ]
     if True:
         print(" ".join(cmd))
-    subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    runner.run(cmd, capture=False)
+
+
+def git_commit_changed_paths(new_tag, log_info, changed, removed):
+    """Add the changed paths to the index, remove the removed paths from
+    it and commit it on top of HEAD, with the same message and author
+    as git_add_new_cesm. The index cost is proportional to the number
+    of paths.
+
+    """
+    print("Committing {0} changed and {1} removed paths to git".format(
+        len(changed), len(removed)))
+    for cmd, paths in [(["add", "--all"], changed),
+                       (["rm", "-r", "-q", "--cached", "--ignore-unmatch"],
+                        removed)]:
+        if not paths:
+            continue
+        cmd = ["git", "--literal-pathspecs"] + cmd + [
+            "--pathspec-from-file=-", "--pathspec-file-nul"]
+        runner.run(cmd, stdin_data='\0'.join(paths).encode('utf-8'))
+
+    session = GitSession(os.getcwd())
+    tree = runner.run(["git", "write-tree"]).decode('ascii').strip()
+    head = session.rev_parse("HEAD")
+    message = '{0}\n\n'.format(new_tag)
+    if log_info['msg']:
+        message += "{0}\n".format(log_info['msg'])
+    commit = session.commit_tree(tree, [head], message, log_info['author'],
+                                 log_info['date'])
+    session.update_refs([("HEAD", commit, head)])
+    session.close()
+
+    cmd = [
+        "git",
+        "tag", "--annotate",
+        "-m", "tag {0} from svn".format(new_tag),
+        new_tag
+    ]
+    print(" ".join(cmd))
+    runner.run(cmd, capture=False)
+
+
+def git_check_branch_not_checked_out(repo_dir, branch_ref):
+    """Updating the ref of a branch that is checked out would leave that
+    working copy out of sync, so refuse to do it.
+
+    """
+    cmd = [
+        "git",
+        "-C", repo_dir,
+        "worktree",
+        "list",
+        "--porcelain",
+    ]
+    output = runner.run(cmd).decode('utf-8')
+    for line in output.splitlines():
+        if line == "branch {0}".format(branch_ref):
+            raise RuntimeError("ERROR: branch '{0}' is checked out in a "
+                               "working copy of {1}".format(branch_ref,
+                                                            repo_dir))
 
 
 def git_status():
@@ -756,7 +1148,7 @@ def git_status():
         "git",
         "status",
     ]
-    subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    runner.run(cmd, capture=False)
 
 
 def push_to_origin_and_cleanup(branch, new_dir, temp_repo_dir):
@@ -770,7 +1162,7 @@ def push_to_origin_and_cleanup(branch, new_dir, temp_repo_dir):
         "origin",
         branch,
     ]
-    subprocess.check_output(cmd, shell=False, stderr=subprocess.STDOUT)
+    runner.run(cmd, capture=False)
     os.chdir(new_dir)
     shutil.rmtree(temp_repo_dir)
 
@@ -779,6 +1171,9 @@ def convert_externals_to_model_definition_xml(
         externals_filename, model_filename):
     """
     """
+    # only needed by the tags that convert externals
+    import xml.dom.minidom as minidom
+
     print("Converting externals to model definition xml : {0} : {1}".format(
         externals_filename, model_filename))
     externals_list = []
@@ -948,62 +1343,223 @@ def convert_externals_to_externals_description_cfg(
         config.write(file_handle)
 
 
+def generate_externals_description():
+    """Convert the svn externals files in the current directory to
+    externals description cfg files. Returns the names of the files
+    that were written.
+
+    """
+    file_list = [
+        ("SVN_EXTERNAL_DIRECTORIES.standalone", "CESM.cfg"),
+        ("SVN_EXTERNAL_DIRECTORIES", "CLM.cfg"),
+    ]
+    generated = []
+    for externals_filename, cfg_filename in file_list:
+        if os.path.isfile(externals_filename):
+            convert_externals_to_externals_description_cfg(
+                externals_filename, cfg_filename)
+            generated.append(cfg_filename)
+    return generated
+
+
 # -------------------------------------------------------------------------------
 #
 # main
 #
 # -------------------------------------------------------------------------------
-def main(options):
+def import_tag(job, repo, authors='author-map.json', debug=False,
+               push=False, plumbing=False):
+    """Import a single svn tag described by a TagJob into the git repo.
+
+    repo is the path to the git repo relative to the current working
+    directory, authors is the path to the author map relative to the
+    repo. If push is true, the new commit and tag are pushed back to
+    the repo and the temporary clone is removed.
 
-    config = read_config_file(options.config[0])
-    new_tag = new_tag_from_config(config)
+    If plumbing is true, tags that don't need svn externals are
+    written directly into the repo with git plumbing commands instead
+    of through a temporary clone, see git_backend.py.
+
+    """
+    new_tag = new_tag_from_job(job)
+    if plumbing and not job.checkout_externals:
+        return import_tag_plumbing(job, new_tag, repo, authors=authors,
+                                   debug=debug, push=push)
 
     # NOTE: just assume git is available in the path!
     cwd = os.getcwd()
 
-    repo_dir = os.path.abspath("{0}/{1}".format(cwd, options.repo[0]))
+    repo_dir = os.path.abspath("{0}/{1}".format(cwd, repo))
 
-    temp_repo_dir = "{0}/{1}-update-{2}".format(cwd, options.repo[0], new_tag)
+    temp_repo_dir = "{0}/{1}-update-{2}".format(cwd, repo, new_tag)
     if os.path.isdir(temp_repo_dir):
         raise RuntimeError("ERROR: temporary git repo dir already exists:\n"
                            "{0}".format(temp_repo_dir))
 
+    progress.phase('git clone')
     clone_cesm_git(repo_dir, temp_repo_dir)
     os.chdir(temp_repo_dir)
-    switch_git_branch(config["git"]["branch"])
-    remove_current_working_copy(config["cesm"])
-
-    svn_checkout_cesm(config['cesm'], debug=options.debug)
-    authors_path = os.path.join(repo_dir, options.authors[0])
-    with open(authors_path, 'r') as author_file:
-        author_map = json.load(author_file)
-    svn_log = svn_log_info(config['cesm'], author_map, debug=options.debug)
-    git_externals = []
-    if string_to_bool(config['cesm']['checkout_externals']):
-        update_svn_externals(
-            temp_repo_dir,
-            config['cesm']['repo'],
-            config['externals'])
-
-        git_externals = find_git_externals(temp_repo_dir)
-
-    gen_ext_descr = 'generate_externals_description'
-    if gen_ext_descr in config['cesm']:
-        if string_to_bool(config['cesm'][gen_ext_descr]):
-            file_list = [
-                ("SVN_EXTERNAL_DIRECTORIES.standalone", "CESM.cfg"),
-                ("SVN_EXTERNAL_DIRECTORIES", "CLM.cfg"),
-            ]
-            for group in file_list:
-                convert_externals_to_externals_description_cfg(group[0], group[1])
-
-    git_add_new_cesm(new_tag, git_externals, svn_log)
-    git_update_subtree(git_externals)
-
-    if (options.feelin_lucky):
-        push_to_origin_and_cleanup(config["git"]["branch"], cwd, temp_repo_dir)
+    try:
+        switch_git_branch(job.branch)
+        remove_current_working_copy(job)
+
+        progress.phase('svn export')
+        svn_checkout_cesm(job, debug=debug)
+        progress.phase('svn log')
+        authors_path = os.path.join(repo_dir, authors)
+        author_resolver = get_author_resolver(authors_path)
+        svn_log = svn_log_info(job, author_resolver, debug=debug)
+        author_resolver.save_cache()
+        job.svn_revision = svn_log['revision']
+        git_externals = []
+        if job.checkout_externals:
+            progress.phase('svn externals')
+            update_svn_externals(
+                temp_repo_dir,
+                job.repo,
+                job.externals)
+
+            git_externals = find_git_externals(temp_repo_dir)
+
+        generated = []
+        if job.generate_externals_description:
+            generated = generate_externals_description()
+
+        progress.phase('git commit')
+        changed_paths = git_changed_paths(job, generated)
+        git_add_new_cesm(new_tag, git_externals, svn_log,
+                         changed_paths=changed_paths)
+        git_update_subtree(git_externals)
+
+        if push:
+            progress.phase('git push')
+            push_to_origin_and_cleanup(job.branch, cwd, temp_repo_dir)
+    finally:
+        os.chdir(cwd)
+    if push:
+        revmap.record(job, new_tag)
 
     print("Finished updating cesm to git.")
+    return new_tag
+
+
+def import_tag_plumbing(job, new_tag, repo, authors='author-map.json',
+                        debug=False, push=False):
+    """Import a tag by exporting it into an empty directory and building
+    the commit from the export and the previous tag's tree with git
+    plumbing. If push is false the objects are written but the branch
+    and tag refs are left unchanged.
+
+    """
+    cwd = os.getcwd()
+    repo_dir = os.path.abspath("{0}/{1}".format(cwd, repo))
+    session = get_git_session(repo_dir)
+
+    branch_ref = "refs/heads/{0}".format(job.branch)
+    tag_ref = "refs/tags/{0}".format(new_tag)
+    if session.rev_parse(tag_ref) is not None:
+        raise RuntimeError("ERROR: git tag '{0}' already exists".format(
+            new_tag))
+    parent = session.rev_parse(branch_ref)
+    if parent is None:
+        raise RuntimeError("ERROR: git branch '{0}' does not exist".format(
+            job.branch))
+    git_check_branch_not_checked_out(repo_dir, branch_ref)
+
+    export_dir = "{0}/{1}-update-{2}".format(cwd, repo, new_tag)
+    commit = build_plumbing_commit(job, new_tag, repo_dir, parent,
+                                   export_dir, authors=authors, debug=debug)
+    publish_plumbing_commit(session, job.branch, new_tag, commit, parent,
+                            push=push)
+    if push:
+        revmap.record(job, new_tag, commit=commit)
+        shutil.rmtree(export_dir)
+    print("Finished updating cesm to git.")
+    return new_tag
+
+
+def publish_plumbing_commit(session, branch, new_tag, commit, parent,
+                            push=True):
+    """Tag a commit written on top of the branch head parent. If push is
+    true the branch and the new tag are updated in one transaction,
+    which fails if the branch moved or the tag exists.
+
+    """
+    tag = session.make_tag(new_tag, commit,
+                           "tag {0} from svn".format(new_tag))
+    print("    {0} {1} : {2}".format(branch, new_tag, commit))
+    if push:
+        session.update_refs([("refs/heads/{0}".format(branch), commit,
+                              parent),
+                             ("refs/tags/{0}".format(new_tag), tag,
+                              NULL_SHA)])
+    return tag
+
+
+def build_plumbing_commit(job, new_tag, repo_dir, parent, export_dir,
+                          authors='author-map.json', debug=False):
+    """Export the tag into export_dir and write its commit on top of the
+    parent commit with git plumbing, without changing any refs.
+    Returns the commit sha, the export directory is left for the
+    caller to remove.
+
+    """
+    session = get_git_session(repo_dir)
+    if os.path.isdir(export_dir):
+        raise RuntimeError("ERROR: temporary export dir already exists:\n"
+                           "{0}".format(export_dir))
+    cwd = os.getcwd()
+    os.mkdir(export_dir)
+    os.chdir(export_dir)
+    try:
+        entries = session.read_tree(parent)
+        for name in removed_root_entries(job):
+            entries.pop(name, None)
+        progress.phase('svn export')
+        # the export directory starts empty, shifted root files have to
+        # be renamed for the files the parent tree keeps as well
+        svn_checkout_cesm(job, debug=debug, kept_files=list(entries))
+        progress.phase('svn log')
+        authors_path = os.path.join(repo_dir, authors)
+        author_resolver = get_author_resolver(authors_path)
+        svn_log = svn_log_info(job, author_resolver, debug=debug)
+        author_resolver.save_cache()
+        job.svn_revision = svn_log['revision']
+
+        if job.generate_externals_description:
+            generate_externals_description()
+
+        progress.phase('git commit')
+        print("Committing new cesm to git")
+        tree = session.merge_directory(entries, '.')
+        message = '{0}\n\n'.format(new_tag)
+        if svn_log['msg']:
+            message += "{0}\n".format(svn_log['msg'])
+        commit = session.commit_tree(tree, [parent], message,
+                                     svn_log['author'], svn_log['date'])
+    finally:
+        os.chdir(cwd)
+    return commit
+
+
+def main(options):
+    configure_runner(options)
+    configure_staging(options)
+    profiling.configure(options.profile[0] or None)
+    if options.feelin_lucky:
+        revmap.configure(options.repo[0])
+    job = TagJob.from_config_file(options.config[0])
+    profiling.start_tag(job.tag_name)
+    try:
+        import_tag(job, options.repo[0], authors=options.authors[0],
+                   debug=options.debug, push=options.feelin_lucky,
+                   plumbing=options.git_plumbing)
+    finally:
+        if revmap.get_revmap() is not None:
+            print("Wrote {0} svn notes to {1}".format(
+                revmap.get_revmap().write_notes(), revmap.NOTES_REF))
+            revmap.configure()
+        profiling.finish()
     return 0
 
 
@@ -1015,5 +1571,6 @@ if __name__ == "__main__":
     except Exception as error:
         print(str(error))
         if options.backtrace:
+            import traceback
             traceback.print_exc()
         sys.exit(1)
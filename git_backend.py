@@ -0,0 +1,575 @@
+"""Write svn tags into git with plumbing commands.
+
+The porcelain import path clones the repo, checks out the branch,
+exports svn on top of the working copy and runs 'git add --all',
+'git commit', 'git tag' and 'git push' for every tag. The plumbing
+path instead keeps a few long running git processes open against the
+main repo for the whole run:
+
+    git cat-file --batch             read refs, trees and objects
+    git hash-object -w --stdin-paths write file contents as blobs
+    git mktree --batch -z            write trees
+
+With configure(write_packs=True) the blobs are streamed into 'git
+fast-import' instead of hash-object, so they are written to a pack
+rather than one loose object per file. The pack is finished
+('checkpoint') before the commit is written, so every tag adds one
+pack instead of thousands of loose objects, see maintenance.py.
+
+and builds the new commit directly from the svn export directory:
+
+  * the tree of the previous tag on the branch is read with cat-file,
+
+  * the top level files and directories that
+    remove_current_working_copy would delete are dropped,
+
+  * the exported files are hashed and merged on top, the same as
+    exporting into the working copy, and the trees are written with
+    mktree. Subtrees that don't change are reused without reading
+    them,
+
+  * the commit and tag objects are created with commit-tree and mktag
+    and the branch and tag refs are updated in a single update-ref
+    transaction.
+
+No working copy, index or push is involved, so the per-tag git cost
+is a few pipe writes plus three short lived processes.
+
+NOTE: the exported files are committed as is, .gitignore files on the
+branch are not applied to them like 'git add --all' would.
+
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import shutil
+import stat
+import subprocess
+
+import runner
+
+# number of paths written to hash-object before reading the results,
+# keeps both pipes well below their buffer size.
+HASH_CHUNK_SIZE = 500
+
+# number of trees kept in memory to avoid re-reading them
+TREE_CACHE_SIZE = 50000
+
+# bytes of a file streamed to fast-import at once
+PACK_CHUNK_SIZE = 1024 * 1024
+
+# fast-import progress line that marks the end of a checkpoint
+_CHECKPOINT_DONE = b'progress cesm2git checkpoint\n'
+
+NULL_SHA = '0' * 40
+
+MODE_TREE = '40000'
+MODE_FILE = '100644'
+MODE_EXECUTABLE = '100755'
+MODE_SYMLINK = '120000'
+MODE_GITLINK = '160000'
+
+# directories in an export that are never part of the tree
+IGNORED_DIRS = ['.svn', '.git']
+
+_AUTHOR_RE = re.compile(r'^\s*(.*?)\s*<(.*)>\s*$')
+
+_sessions = {}
+_write_packs = False
+
+
+def configure(write_packs=False):
+    """Setup how sessions started from now on write blobs, see the module
+    docstring.
+
+    """
+    global _write_packs
+    _write_packs = write_packs
+
+
+def get_git_session(git_dir):
+    """Return the session for a repo, starting it if needed. Sessions are
+    kept for the life of the process so they can be shared by all the
+    tags imported in a run.
+
+    """
+    key = os.path.abspath(git_dir)
+    if key not in _sessions:
+        _sessions[key] = GitSession(key, write_packs=_write_packs)
+    return _sessions[key]
+
+
+def close_git_sessions():
+    """Stop the long running git processes of every session.
+    """
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+
+
+def split_author(author):
+    """Split 'Name <email>' into name and email.
+    """
+    match = _AUTHOR_RE.match(author)
+    if not match:
+        raise RuntimeError("Invalid author string '{0}'".format(author))
+    return match.group(1), match.group(2)
+
+
+def svn_date_to_git(date):
+    """svn log dates are ISO 8601 with microseconds, which git's date
+    parser doesn't accept, e.g. '2017-11-03T21:18:29.123456Z'.
+
+    """
+    return re.sub(r'\.\d+Z$', 'Z', date.strip())
+
+
+def cleanup_message(message):
+    """Whitespace cleanup equivalent to 'git commit --cleanup=whitespace',
+    so plumbing commits get the same messages as porcelain commits.
+
+    """
+    lines = [line.rstrip() for line in message.splitlines()]
+    cleaned = []
+    for line in lines:
+        if not line and (not cleaned or not cleaned[-1]):
+            continue
+        cleaned.append(line)
+    while cleaned and not cleaned[-1]:
+        cleaned.pop()
+    return '\n'.join(cleaned) + '\n'
+
+
+class GitSession(object):
+    """Long running git plumbing processes for a single repo.
+
+    """
+
+    def __init__(self, git_dir, write_packs=False):
+        self.git_dir = git_dir
+        self.write_packs = write_packs
+        self._cat_file = None
+        self._hash_object = None
+        self._mktree = None
+        self._fast_import = None
+        self._pack_pending = False
+        self._tree_cache = {}
+        self._tmp_dir = None
+
+    # ---------------------------------------------------------------
+    # process management
+    # ---------------------------------------------------------------
+    def _git(self, *args):
+        return ['git', '-C', self.git_dir] + list(args)
+
+    def _start(self, *args):
+        return subprocess.Popen(self._git(*args), shell=False,
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+
+    def close(self):
+        """Stop the long running processes, fast-import writes its pack
+        when it stops.
+
+        """
+        for process in [self._cat_file, self._hash_object, self._mktree,
+                        self._fast_import]:
+            if process is not None:
+                process.stdin.close()
+                process.wait()
+                process.stdout.close()
+        self._cat_file = None
+        self._hash_object = None
+        self._mktree = None
+        self._fast_import = None
+        self._pack_pending = False
+        if self._tmp_dir:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def _check(self, process, name, line):
+        """The processes only stop writing output when they fail.
+        """
+        if not line:
+            process.wait()
+            # start a new process on the next request
+            for attr in ['_cat_file', '_hash_object', '_mktree',
+                         '_fast_import']:
+                if getattr(self, attr) is process:
+                    setattr(self, attr, None)
+            raise RuntimeError("git {0} session exited unexpectedly with "
+                               "status {1}".format(name, process.returncode))
+
+    # ---------------------------------------------------------------
+    # reading
+    # ---------------------------------------------------------------
+    def _request_object(self, rev):
+        """Ask cat-file for an object, returns (sha, type, size) with the
+        contents waiting on stdout, or None if it doesn't exist.
+
+        """
+        info = self._request_object_once(rev)
+        if info is None and self._pack_pending:
+            # it may be a blob fast-import hasn't written out yet
+            self.flush_pack()
+            info = self._request_object_once(rev)
+        return info
+
+    def _request_object_once(self, rev):
+        if self._cat_file is None:
+            self._cat_file = self._start('cat-file', '--batch')
+        process = self._cat_file
+        process.stdin.write("{0}\n".format(rev).encode('utf-8'))
+        process.stdin.flush()
+        header = process.stdout.readline()
+        self._check(process, 'cat-file', header)
+        fields = header.decode('utf-8').split()
+        if len(fields) != 3:
+            # '<rev> missing' or '<rev> ambiguous'
+            return None
+        sha, kind, size = fields
+        return sha, kind, int(size)
+
+    def read_object(self, rev):
+        """Return (sha, type, data) for a revision or object name, or None
+        if it doesn't exist.
+
+        """
+        info = self._request_object(rev)
+        if info is None:
+            return None
+        sha, kind, size = info
+        stdout = self._cat_file.stdout
+        data = stdout.read(size)
+        # object content is followed by a newline
+        stdout.read(1)
+        return sha, kind, data
+
+    def read_object_into(self, rev, buffer):
+        """Stream the contents of an object into a spool.SpooledBuffer in
+        chunks instead of reading it into memory at once. Returns (sha,
+        type, size), or None if it doesn't exist.
+
+        """
+        info = self._request_object(rev)
+        if info is None:
+            return None
+        stdout = self._cat_file.stdout
+        buffer.copy_from(stdout, info[2])
+        stdout.read(1)
+        return info
+
+    def rev_parse(self, rev):
+        """sha of a revision or None if it doesn't exist.
+        """
+        info = self.read_object(rev)
+        if info is None:
+            return None
+        return info[0]
+
+    def read_tree(self, tree):
+        """Entries of a tree as a dict of name -> (mode, sha). The tree can
+        be a tree sha or anything that peels to a tree, e.g. a branch.
+
+        """
+        if tree in self._tree_cache:
+            return dict(self._tree_cache[tree])
+        info = self.read_object("{0}^{{tree}}".format(tree))
+        if info is None:
+            raise RuntimeError("Could not read git tree '{0}'".format(tree))
+        sha, _, data = info
+        entries = {}
+        pos = 0
+        while pos < len(data):
+            space = data.index(b' ', pos)
+            nul = data.index(b'\0', space)
+            mode = data[pos:space].decode('ascii')
+            name = data[space + 1:nul].decode('utf-8', 'surrogateescape')
+            entry_sha = data[nul + 1:nul + 21]
+            entries[name] = (mode, _hex(entry_sha))
+            pos = nul + 21
+        self._cache_tree(sha, entries)
+        return dict(entries)
+
+    # ---------------------------------------------------------------
+    # writing
+    # ---------------------------------------------------------------
+    def hash_files(self, paths):
+        """Write the files as blobs, returning their shas in the same order.
+
+        """
+        if self.write_packs:
+            return [self._pack_blob(os.path.getsize(path), path)
+                    for path in paths]
+        if self._hash_object is None:
+            self._hash_object = self._start('hash-object', '-w',
+                                            '--stdin-paths')
+        process = self._hash_object
+        shas = []
+        for start in range(0, len(paths), HASH_CHUNK_SIZE):
+            chunk = paths[start:start + HASH_CHUNK_SIZE]
+            for path in chunk:
+                if '\n' in path:
+                    raise RuntimeError(
+                        "Can not hash path with newline: {0}".format(path))
+                process.stdin.write(
+                    "{0}\n".format(os.path.abspath(path)).encode(
+                        'utf-8', 'surrogateescape'))
+            process.stdin.flush()
+            for _ in chunk:
+                line = process.stdout.readline()
+                self._check(process, 'hash-object', line)
+                shas.append(line.decode('ascii').strip())
+        return shas
+
+    def hash_data(self, data):
+        """Write a blob from memory, e.g. the target of a symlink.
+        """
+        if self.write_packs:
+            return self._pack_blob(len(data), data=data)
+        if self._tmp_dir is None:
+            import tempfile
+            self._tmp_dir = tempfile.mkdtemp(prefix='cesm2git-')
+        tmp_filename = os.path.join(self._tmp_dir, 'blob')
+        with open(tmp_filename, 'wb') as tmp_file:
+            tmp_file.write(data)
+        return self.hash_files([tmp_filename])[0]
+
+    def _pack_blob(self, size, path=None, data=None):
+        """Stream a file, or data, to fast-import as a blob. Returns the
+        blob sha, computed here since fast-import doesn't report it.
+
+        """
+        import hashlib
+
+        if self._fast_import is None:
+            # packs of any size are kept, see fastimport.unpackLimit
+            self._fast_import = self._start(
+                '-c', 'fastimport.unpackLimit=1', 'fast-import', '--quiet')
+        stdin = self._fast_import.stdin
+        sha = hashlib.sha1("blob {0}\0".format(size).encode('ascii'))
+        stdin.write("blob\ndata {0}\n".format(size).encode('ascii'))
+        if path is None:
+            sha.update(data)
+            stdin.write(data)
+        else:
+            written = 0
+            with open(path, 'rb') as blob_file:
+                for chunk in iter(lambda: blob_file.read(PACK_CHUNK_SIZE),
+                                  b''):
+                    sha.update(chunk)
+                    stdin.write(chunk)
+                    written += len(chunk)
+            if written != size:
+                raise RuntimeError("File changed while it was written to "
+                                   "git: {0}".format(path))
+        stdin.write(b'\n')
+        self._pack_pending = True
+        return sha.hexdigest()
+
+    def flush_pack(self):
+        """Make the blobs written to fast-import so far readable by other
+        git commands, they are in a finished pack when this returns.
+
+        """
+        if not self._pack_pending:
+            return
+        process = self._fast_import
+        process.stdin.write(b'checkpoint\n' + _CHECKPOINT_DONE)
+        process.stdin.flush()
+        while True:
+            line = process.stdout.readline()
+            self._check(process, 'fast-import', line)
+            if line == _CHECKPOINT_DONE:
+                break
+        self._pack_pending = False
+
+    def mktree(self, entries):
+        """Write a tree from a dict of name -> (mode, sha), returns its sha.
+        """
+        if self._mktree is None:
+            args = ['mktree', '--batch', '-z']
+            if self.write_packs:
+                # blobs may still be in fast-import, see flush_pack
+                args.append('--missing')
+            self._mktree = self._start(*args)
+        process = self._mktree
+        data = []
+        for name in sorted(entries):
+            mode, sha = entries[name]
+            kind = 'blob'
+            if mode == MODE_TREE:
+                kind = 'tree'
+            elif mode == MODE_GITLINK:
+                kind = 'commit'
+            data.append("{0} {1} {2}\t{3}\0".format(mode, kind, sha, name))
+        data.append("\0")
+        process.stdin.write(''.join(data).encode('utf-8', 'surrogateescape'))
+        process.stdin.flush()
+        line = process.stdout.readline()
+        self._check(process, 'mktree', line)
+        sha = line.decode('ascii').strip()
+        self._cache_tree(sha, dict(entries))
+        return sha
+
+    def _cache_tree(self, sha, entries):
+        if len(self._tree_cache) >= TREE_CACHE_SIZE:
+            self._tree_cache.clear()
+        self._tree_cache[sha] = entries
+
+    def commit_tree(self, tree, parents, message, author, date):
+        """Create a commit object, returns its sha.
+
+        author is 'Name <email>', date is an svn log date.
+
+        """
+        # the tree's blobs must be in the repo before anything refers to
+        # the commit.
+        self.flush_pack()
+        name, email = split_author(author)
+        env = dict(os.environ)
+        env['GIT_AUTHOR_NAME'] = name
+        env['GIT_AUTHOR_EMAIL'] = email
+        env['GIT_AUTHOR_DATE'] = svn_date_to_git(date)
+        cmd = self._git('commit-tree', tree)
+        for parent in parents:
+            cmd.extend(['-p', parent])
+        output = runner.run(cmd, env=env, retries=0,
+                            stdin_data=cleanup_message(message).encode(
+                                'utf-8'))
+        return output.decode('ascii').strip()
+
+    def make_tag(self, name, target, message, kind='commit'):
+        """Create an annotated tag object, returns its sha.
+        """
+        output = runner.run(self._git('var', 'GIT_COMMITTER_IDENT'))
+        tagger = output.decode('utf-8').strip()
+        data = "object {0}\ntype {1}\ntag {2}\ntagger {3}\n\n{4}".format(
+            target, kind, name, tagger, cleanup_message(message))
+        output = runner.run(self._git('mktag'), retries=0,
+                            stdin_data=data.encode('utf-8'))
+        return output.decode('ascii').strip()
+
+    def reparent_commit(self, commit, parents):
+        """Write a copy of a commit with different parents, returns its sha.
+        Everything else, including the tree, author, committer and
+        message, is copied byte for byte.
+
+        """
+        info = self.read_object(commit)
+        if info is None or info[1] != 'commit':
+            raise RuntimeError("Could not read git commit '{0}'".format(
+                commit))
+        header, _, body = info[2].partition(b'\n\n')
+        lines = [line for line in header.split(b'\n')
+                 if not line.startswith(b'parent ')]
+        for parent in reversed(parents):
+            lines.insert(1, "parent {0}".format(parent).encode('ascii'))
+        data = b'\n'.join(lines) + b'\n\n' + body
+        output = runner.run(self._git('hash-object', '-t', 'commit', '-w',
+                                      '--stdin'),
+                            retries=0, stdin_data=data)
+        return output.decode('ascii').strip()
+
+    def update_refs(self, updates):
+        """Update several refs in a single transaction. updates is a list of
+        (ref, new_sha, old_sha) tuples, old_sha of None means the ref
+        may have any value, NULL_SHA that it must not exist yet. A
+        new_sha of None deletes the ref.
+
+        """
+        lines = []
+        for ref, new, old in updates:
+            if new is None and old is None:
+                lines.append("delete {0}\n".format(ref))
+            elif new is None:
+                lines.append("delete {0} {1}\n".format(ref, old))
+            elif old is None:
+                lines.append("update {0} {1}\n".format(ref, new))
+            else:
+                lines.append("update {0} {1} {2}\n".format(ref, new, old))
+        runner.run(self._git('update-ref', '--stdin'), retries=0,
+                   stdin_data=''.join(lines).encode('utf-8'))
+
+    def overlay_tree(self, entries, overlay):
+        """Write the tree with the overlay entries on top of entries. Where
+        both have a directory the contents are merged, the same as
+        copying the overlay directory over a checkout of the tree.
+        Returns the new tree sha, or None if the result is empty.
+
+        """
+        entries = dict(entries)
+        for name, (mode, sha) in overlay.items():
+            if mode == MODE_TREE and name in entries and \
+               entries[name][0] == MODE_TREE and entries[name][1] != sha:
+                merged = self.overlay_tree(self.read_tree(entries[name][1]),
+                                           self.read_tree(sha))
+                entries[name] = (MODE_TREE, merged)
+            else:
+                entries[name] = (mode, sha)
+        if not entries:
+            return None
+        return self.mktree(entries)
+
+    # ---------------------------------------------------------------
+    # trees from directories
+    # ---------------------------------------------------------------
+    def merge_directory(self, entries, directory):
+        """Merge the contents of a directory on top of the tree entries,
+        the same as copying the directory over a checkout of the tree.
+        Returns the new tree sha, or None if the result is empty.
+
+        """
+        files = []
+        _collect_files(directory, files)
+        blobs = dict(zip(files, self.hash_files(files)))
+        return self._merge(entries, directory, blobs)
+
+    def _merge(self, entries, directory, blobs):
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.islink(path):
+                target = os.readlink(path).encode('utf-8', 'surrogateescape')
+                entries[name] = (MODE_SYMLINK, self.hash_data(target))
+            elif os.path.isdir(path):
+                if name in IGNORED_DIRS:
+                    continue
+                sub_entries = {}
+                if name in entries and entries[name][0] == MODE_TREE:
+                    sub_entries = self.read_tree(entries[name][1])
+                sha = self._merge(sub_entries, path, blobs)
+                if sha is None:
+                    # git doesn't store empty directories
+                    entries.pop(name, None)
+                else:
+                    entries[name] = (MODE_TREE, sha)
+            else:
+                mode = MODE_FILE
+                if os.stat(path).st_mode & stat.S_IXUSR:
+                    mode = MODE_EXECUTABLE
+                entries[name] = (mode, blobs[path])
+        if not entries:
+            return None
+        return self.mktree(entries)
+
+
+def _collect_files(directory, files):
+    """Paths of the regular files under directory.
+    """
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.islink(path):
+            continue
+        if os.path.isdir(path):
+            if name not in IGNORED_DIRS:
+                _collect_files(path, files)
+            continue
+        files.append(path)
+
+
+def _hex(raw):
+    """Hex string for a raw 20 byte sha.
+    """
+    return ''.join('{0:02x}'.format(c) for c in bytearray(raw))
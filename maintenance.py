@@ -0,0 +1,244 @@
+"""Object storage maintenance for bulk imports.
+
+Every imported tag adds thousands of objects to the repo. Left alone
+they accumulate as loose objects (and many small packs from pushes)
+until git's automatic gc runs at an arbitrary point in the loop, and
+every clone, push and object lookup slows down in between. A
+RepoMaintenance instead keeps the repo compact on a schedule:
+
+  * prepare() configures the repo for it: pushes from the temporary
+    clones are kept as packs instead of being exploded into loose
+    objects (receive.unpackLimit) and receive doesn't start a gc
+    (receive.autogc), the loop repacks instead. The settings the repo
+    had before are restored by finish(),
+
+  * after_tag() counts the tags imported. Every --repack-every tags,
+    or as soon as there are more than --loose-objects loose objects,
+    the loose objects are packed and the packs are combined
+    geometrically ('git repack -d --geometric=2', git >= 2.32, older
+    gits only pack the loose objects). Neither drops unreachable
+    objects, so objects of tags whose refs aren't written yet (svn
+    dump imports, segments) are safe. The commit-graph is extended
+    with a new split layer,
+
+  * finish() writes a single pack with a reachability bitmap and a
+    full commit-graph, so push negotiation and clones of the finished
+    repo are fast, and restores the repo config. Unreachable objects
+    are kept, pruning them is left to 'git gc'. With a shared object
+    store the repo's objects are moved into the store instead, see
+    object_store.py.
+
+With git_backend.configure(write_packs=True) the plumbing backend
+writes blobs into packs in the first place, see git_backend.py.
+
+"""
+
+from __future__ import print_function
+
+import re
+import subprocess
+import time
+
+import object_store
+import runner
+from git_backend import get_git_session
+
+# default number of tags imported between repacks, 0 disables maintenance
+DEFAULT_REPACK_EVERY = 25
+
+# default number of loose objects that triggers a repack before that
+DEFAULT_LOOSE_OBJECTS = 20000
+
+# first git version with 'repack --geometric'
+GEOMETRIC_GIT_VERSION = (2, 32)
+
+# repo config while tags are imported, restored by finish()
+IMPORT_CONFIG = [('receive.unpackLimit', '1'),
+                 ('receive.autogc', 'false'),
+                 ('core.commitGraph', 'true')]
+
+
+def git_version():
+    """Version of the git in the path as a tuple of ints.
+    """
+    output = runner.run(["git", "--version"]).decode('utf-8')
+    match = re.search(r'(\d+)\.(\d+)', output)
+    if match is None:
+        return (0, 0)
+    return tuple(int(part) for part in match.groups())
+
+
+def count_objects(repo_dir):
+    """'git count-objects -v' as a dict of ints, e.g. 'count' (loose
+    objects), 'packs' and 'size-pack' (kB).
+
+    """
+    output = runner.run(["git", "-C", repo_dir, "count-objects", "-v"])
+    counts = {}
+    for line in output.decode('utf-8').splitlines():
+        key, _, value = line.partition(':')
+        try:
+            counts[key.strip()] = int(value)
+        except ValueError:
+            continue
+    return counts
+
+
+class RepoMaintenance(object):
+    """Repack policy for a repo that tags are being imported into.
+
+    """
+
+    def __init__(self, repo_dir, every=DEFAULT_REPACK_EVERY,
+                 loose_objects=DEFAULT_LOOSE_OBJECTS):
+        self.repo_dir = repo_dir
+        self.every = every
+        self.loose_objects = loose_objects
+        self.tags_since_repack = 0
+        self.tags = 0
+        self.repacks = 0
+        self._geometric = git_version() >= GEOMETRIC_GIT_VERSION
+        # key -> repo config value before prepare(), None if unset
+        self._saved_config = {}
+
+    def _git(self, *args):
+        return ["git", "-C", self.repo_dir] + list(args)
+
+    def _config_value(self, key):
+        try:
+            output = runner.run(self._git('config', '--local', '--get', key),
+                                retries=0)
+        except subprocess.CalledProcessError:
+            # not set
+            return None
+        return output.decode('utf-8').strip()
+
+    def prepare(self):
+        """Configure the repo so objects aren't unpacked or gc'ed behind
+        the loop's back, saving the settings for restore_config.
+
+        """
+        for key, value in IMPORT_CONFIG:
+            if key not in self._saved_config:
+                self._saved_config[key] = self._config_value(key)
+            runner.run(self._git('config', '--local', key, value))
+
+    def restore_config(self):
+        """Put back the repo config prepare() changed.
+        """
+        for key, value in sorted(self._saved_config.items()):
+            if value is None:
+                runner.run(self._git('config', '--local', '--unset', key),
+                           retries=0)
+            else:
+                runner.run(self._git('config', '--local', key, value))
+        self._saved_config = {}
+
+    def after_tag(self, count=1):
+        """Count imported tags and repack if it is due.
+        """
+        self.tags += count
+        self.tags_since_repack += count
+        if self.tags_since_repack >= self.every:
+            self.repack()
+            return
+        if count_objects(self.repo_dir).get('count', 0) >= \
+           self.loose_objects:
+            self.repack()
+
+    def _release_objects(self):
+        """Finish the session's pack and stop its processes, so no git
+        process keeps using packs the repack removes. The processes are
+        restarted on the next request.
+
+        """
+        get_git_session(self.repo_dir).close()
+
+    def repack(self):
+        """Pack the loose objects and combine small packs, without
+        dropping any object.
+
+        """
+        start = time.time()
+        self._release_objects()
+        before = count_objects(self.repo_dir)
+        cmd = self._git('repack', '-d', '-q', '--no-write-bitmap-index')
+        if self._geometric:
+            cmd.append('--geometric=2')
+        runner.run(cmd, retries=0)
+        runner.run(self._git('commit-graph', 'write', '--reachable',
+                             '--split'), retries=0)
+        after = count_objects(self.repo_dir)
+        self.tags_since_repack = 0
+        self.repacks += 1
+        print("    repacked {0} loose objects, {1} -> {2} packs "
+              "({3:.1f} s)".format(before.get('count', 0),
+                                   before.get('packs', 0),
+                                   after.get('packs', 0),
+                                   time.time() - start))
+
+    def finish(self):
+        """Write a single pack with a bitmap and a full commit-graph, if
+        any tags were imported, and restore the repo config. With a
+        shared object store the objects are moved to the store instead,
+        see object_store.py.
+
+        """
+        try:
+            self._finish_packs()
+        finally:
+            self.restore_config()
+
+    def _finish_packs(self):
+        if not self.tags:
+            return
+        start = time.time()
+        self._release_objects()
+        store = object_store.get_store()
+        if store is not None:
+            # bitmaps need every object in the pack, they are written
+            # for the store.
+            store.absorb(self.repo_dir)
+            store.repack()
+            return
+        runner.run(self._git('repack', '-a', '-d', '-q', '--keep-unreachable',
+                             '--write-bitmap-index'), retries=0)
+        runner.run(self._git('commit-graph', 'write', '--reachable'),
+                   retries=0)
+        after = count_objects(self.repo_dir)
+        print("Repacked repo: {0} packs, {1} loose objects, {2} kB "
+              "({3:.1f} s)".format(after.get('packs', 0),
+                                   after.get('count', 0),
+                                   after.get('size-pack', 0),
+                                   time.time() - start))
+
+
+_maintenance = None
+
+
+def configure(repo_dir=None, every=DEFAULT_REPACK_EVERY,
+              loose_objects=DEFAULT_LOOSE_OBJECTS):
+    """Setup the process wide maintenance of the repo tags are imported
+    into, no repo_dir or every of 0 disables it.
+
+    """
+    global _maintenance
+    _maintenance = None
+    if repo_dir and every > 0:
+        _maintenance = RepoMaintenance(repo_dir, every=every,
+                                       loose_objects=loose_objects)
+        _maintenance.prepare()
+    return _maintenance
+
+
+def get_maintenance():
+    """The process wide maintenance, or None.
+    """
+    return _maintenance
+
+
+def after_tag(count=1):
+    """Report imported tags, if the repo is being maintained.
+    """
+    if _maintenance is not None:
+        _maintenance.after_tag(count)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+"""Order a tag file by svn history.
+
+The tag files are ordered by hand, and a tag in the wrong place (e.g.
+a retag like clm4_5_1_r076 that was cut after clm4_6_00 from older
+trunk code) gives a git history that has to be rolled back and
+imported again. manifest.py orders the tags the way svn created them
+instead, from two queries made concurrently (svn_async.py): the
+verbose log of the tag directory, which has the revision every tag
+was created in and the path and revision it was copied from, and the
+listing of the tag directory. The log has paths relative to the svn
+repository root, which needn't be the repo url of the tag file, the
+path of the tag directory in the repository comes from its svn info.
+
+Tags are sorted by the revision they were copied from, i.e. the age
+of the code they tag, then by the revision they were created in.
+Tags in the tag file keep their settings, entries that aren't svn
+tags (or whose history isn't known) stay after the entry they follow
+now. With --add-new the svn tags that aren't in the tag file are
+added, with the settings of the tag before them.
+
+Trunk and branch tags are told apart by the path they were copied
+from. --source keeps only the tags copied from paths containing the
+specified text, the others are listed and left out of new entries.
+The copied from paths are relative to the svn repository root, as
+'svn info --show-item relative-url' prints them without the '^', e.g.
+/clm2/trunk if the repository root is
+https://svn-ccsm-models.cgd.ucar.edu. --record-sources writes the
+source path and revision, and the tag the new history puts before it,
+into every entry (svn_source, svn_source_rev, svn_parent), tag-loop.py
+ignores them.
+
+    ./manifest.py --repo clm --tag-file clm-trunk-tags.json --dry-run
+    ./manifest.py --repo clm --tag-file clm-trunk-tags.json --add-new \\
+        --source /clm2/trunk
+
+If tags that are already imported move, the tag to roll back to with
+rollback.py is printed.
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+from python_version import check_python_version
+
+check_python_version()
+
+#
+# built-in modules
+#
+import argparse
+import asyncio
+import os
+import traceback
+from urllib.parse import unquote
+
+#
+# other modules in this package
+#
+import svn_async
+from cesm2git import add_runner_options, configure_runner
+from plan import git_tag_names
+from tag_job import TagJob, read_manifest, write_manifest
+
+# tag file entries that describe a single tag and aren't carried over
+# to new tags
+TAG_ONLY_SETTINGS = ['tag', 'alias', 'skip', 'comment', 'svn_source',
+                     'svn_source_rev', 'svn_parent']
+
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Order the tags of a tag file by the svn revisions '
+        'they were copied from.')
+
+    parser.add_argument('--add-new', action='store_true', default=False,
+                        help='add svn tags that are not in the tag file.')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--debug', action='store_true',
+                        help='extra debugging output')
+
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='only print the new order.')
+
+    parser.add_argument('--record-sources', action='store_true',
+                        default=False,
+                        help='write the svn source path, source revision '
+                        'and previous tag into every entry.')
+
+    parser.add_argument('--repo', nargs=1, required=True,
+                        help='path to repo')
+
+    parser.add_argument('--source', nargs=1, default=[''],
+                        help='only add tags copied from svn paths '
+                        'containing the specified text. The paths are '
+                        'relative to the svn repository root, e.g. '
+                        '/clm2/trunk.')
+
+    parser.add_argument('--tag-file', nargs=1, required=True,
+                        help='tag file to order, relative to repo')
+
+    add_runner_options(parser)
+
+    options = parser.parse_args()
+    return options
+
+
+# -------------------------------------------------------------------------------
+#
+# work functions
+#
+# -------------------------------------------------------------------------------
+async def _query_tag_directory(url):
+    client = svn_async.SvnMetadataClient()
+    return await asyncio.gather(client.info(url),
+                                client.log(url, limit=None, verbose=True),
+                                client.list(url))
+
+
+def repository_path(info):
+    """Path of an svn url relative to the repository root, the form of
+    the paths in svn log, from the svn info of the url.
+
+    """
+    return unquote(info['relative_url'].lstrip('^')).rstrip('/')
+
+
+def svn_tag_history(base_info):
+    """History of the tags that exist in the tag directory, as a dict of
+    tag name -> {'created': revision, 'source': copied from path,
+    'source_rev': copied from revision}. Source is None for tags that
+    weren't copied.
+
+    """
+    url = "{0}/{1}".format(base_info['repo'], base_info['tag_directory'])
+    info, log, listing = svn_async.run_coroutine(_query_tag_directory(url))
+    if info is None:
+        raise RuntimeError("svn tag directory '{0}' doesn't exist".format(
+            url))
+    existing = set(entry['name'] for entry in listing
+                   if entry['kind'] == 'dir')
+    prefix = "{0}/".format(repository_path(info))
+    history = {}
+    # oldest first, so a tag that was replaced has its latest history
+    for entry in sorted(log, key=lambda e: e['revision']):
+        for path in entry.get('paths', []):
+            name = path['path'][len(prefix):]
+            if not path['path'].startswith(prefix) or '/' in name or \
+               path['action'] not in ('A', 'R'):
+                continue
+            history[name] = {
+                'created': entry['revision'],
+                'source': path['copyfrom_path'],
+                'source_rev': path['copyfrom_rev'],
+            }
+    return dict((name, info) for name, info in history.items()
+                if name in existing)
+
+
+def _order_key(info):
+    source_rev = info['source_rev']
+    if source_rev is None:
+        source_rev = info['created']
+    return (source_rev, info['created'])
+
+
+def order_tags(manifest, history, add_new=False, source=''):
+    """The tag file entries in svn order. Returns the new entries and the
+    names of the svn tags left out because of their source.
+
+    """
+    tags = [dict(tag) for tag in manifest['tags']]
+    known = set(tag['tag'] for tag in tags)
+    excluded = []
+    added = set()
+    if add_new:
+        for name in sorted(history):
+            if name in known:
+                continue
+            if source and source not in (history[name]['source'] or ''):
+                excluded.append(name)
+                continue
+            tags.append({'tag': name})
+            added.add(name)
+
+    # entries without svn history sort right after the entry before them
+    keyed = []
+    key = (0, 0)
+    for index, tag in enumerate(tags):
+        if tag['tag'] in history:
+            key = _order_key(history[tag['tag']])
+        keyed.append((key, index, tag))
+    keyed.sort(key=lambda item: (item[0], item[1]))
+    ordered = [tag for _, _, tag in keyed]
+
+    template = {}
+    for tag in ordered:
+        if tag['tag'] in known:
+            template = dict(tag)
+            for name in TAG_ONLY_SETTINGS:
+                template.pop(name, None)
+        elif tag['tag'] in added:
+            tag.update(template)
+    return ordered, excluded
+
+
+def record_sources(tags, history):
+    """Write the svn source of every tag, and the tag before it with the
+    same source, into the entries.
+
+    """
+    previous = {}
+    for tag in tags:
+        info = history.get(tag['tag'])
+        if info is None:
+            continue
+        tag['svn_source'] = info['source']
+        tag['svn_source_rev'] = info['source_rev']
+        parent = previous.get(info['source'])
+        if parent is not None:
+            tag['svn_parent'] = parent
+        else:
+            tag.pop('svn_parent', None)
+        previous[info['source']] = tag['tag']
+
+
+def first_changed_import(base_info, old_tags, new_tags, git_tags):
+    """Position of the first change in the order if an imported tag is at
+    or after it, those tags have to be imported again. None if only
+    tags after the imported ones change.
+
+    """
+    index = 0
+    for old, new in zip(old_tags, new_tags):
+        if old['tag'] != new['tag']:
+            break
+        index += 1
+    if any(TagJob.from_manifest(base_info, tag).git_tag in git_tags
+           for tag in old_tags[index:]):
+        return index
+    return None
+
+
+def print_order(old_tags, new_tags, history, excluded):
+    old_names = [tag['tag'] for tag in old_tags]
+    for index, tag in enumerate(new_tags):
+        info = history.get(tag['tag'])
+        where = "          "
+        if tag['tag'] not in old_names:
+            where = "new       "
+        elif old_names.index(tag['tag']) != index:
+            where = "moved     "
+        source = ""
+        if info is not None:
+            source = "{0}@{1} r{2}".format(info['source'], info['source_rev'],
+                                           info['created'])
+        print("    {0}{1:<40} {2}".format(where, tag['tag'], source))
+    for name in excluded:
+        info = history[name]
+        print("    excluded  {0:<40} {1}@{2}".format(name, info['source'],
+                                                     info['source_rev']))
+
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+def main(options):
+    configure_runner(options)
+    tag_filename = os.path.join(options.repo[0], options.tag_file[0])
+    manifest = read_manifest(tag_filename)
+    history = svn_tag_history(manifest['config'])
+    tags, excluded = order_tags(manifest, history, add_new=options.add_new,
+                                source=options.source[0])
+    if options.record_sources:
+        record_sources(tags, history)
+
+    print("Order of {0} by svn history:".format(tag_filename))
+    print_order(manifest['tags'], tags, history, excluded)
+    moved = first_changed_import(manifest['config'], manifest['tags'], tags,
+                                 git_tag_names(options.repo[0]))
+    if moved is not None:
+        if moved == 0:
+            print("WARNING: the first imported tag changes, roll back with "
+                  "rollback.py --root")
+        else:
+            print("WARNING: imported tags change order, roll back with "
+                  "rollback.py --to {0}".format(
+                      manifest['tags'][moved - 1]['tag']))
+    if options.dry_run:
+        return 0
+    manifest['tags'] = tags
+    write_manifest(tag_filename, manifest)
+    print("Wrote {0} tags to {1}".format(len(tags), tag_filename))
+    return 0
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            traceback.print_exc()
+        sys.exit(1)
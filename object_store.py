@@ -0,0 +1,187 @@
+"""Object store shared by the component repos.
+
+The component repos (clm, hillslope, ptclm, rtm, ...) are imported
+from overlapping svn trees, so most of their blobs and many of their
+trees are identical. With --object-store DIR every component repo
+borrows objects from one bare repo at DIR through git alternates
+(objects/info/alternates) instead of keeping its own copy:
+
+  * link() adds the store to a component repo's alternates, objects
+    already in the store are never written to the repo again,
+
+  * absorb() at the end of a run fetches the component's refs into
+    the store under refs/components/<name>/, so everything the
+    component references is stored (once) in the store, and repacks
+    the component with 'git repack -a -d -l', which drops the objects
+    the store has. The name is the repo's directory name and a hash
+    of its path, so repos with the same directory name don't replace
+    each other's refs. The path every name belongs to is kept in the
+    store's config (component.<name>.path) and a name is never reused
+    for a different repo,
+
+  * the store itself is repacked with a bitmap.
+
+The temporary clones made for every tag use 'git clone --shared' for
+the same reason, so cloning is independent of the repo size.
+
+The store keeps the refs of every component, so 'git gc' in the store
+never prunes objects a component needs. Don't remove the store, or a
+component's refs from it, while the component repo links to it; use
+'git repack -a -d' without -l in the component first to take back its
+objects.
+
+"""
+
+from __future__ import print_function
+
+import hashlib
+import os
+import subprocess
+import time
+
+import runner
+
+# refs of each component are kept in the store under this prefix
+COMPONENT_REFS = 'refs/components/{0}/'
+
+# store config with the path of the repo a component name belongs to
+COMPONENT_PATH = 'component.{0}.path'
+
+
+def git_objects_dir(repo_dir):
+    """Absolute path of a repo's object directory.
+    """
+    output = runner.run(["git", "-C", repo_dir, "rev-parse", "--git-path",
+                         "objects"])
+    path = output.decode('utf-8').strip()
+    return os.path.abspath(os.path.join(repo_dir, path))
+
+
+def component_name(repo_dir):
+    """Name of a repo's refs in the store: the directory name and a hash
+    of the path, e.g. clm-3f2a9c0e51d4.
+
+    """
+    path = os.path.realpath(repo_dir)
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+    return "{0}-{1}".format(os.path.basename(path), digest[:12])
+
+
+def read_alternates(repo_dir):
+    """Object directories a repo borrows from.
+    """
+    filename = os.path.join(git_objects_dir(repo_dir), 'info', 'alternates')
+    if not os.path.isfile(filename):
+        return []
+    with open(filename, 'r') as alternates:
+        return [line.strip() for line in alternates
+                if line.strip() and not line.startswith('#')]
+
+
+class ObjectStore(object):
+    """Bare repo holding the objects of every component repo.
+
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = os.path.abspath(store_dir)
+        if not os.path.isdir(self.store_dir):
+            print("Creating object store at : {0}".format(self.store_dir))
+            runner.run(["git", "init", "--bare", "-q", self.store_dir])
+            # objects are only unreachable here once no component
+            # references them, never prune them behind their back.
+            for key, value in [('gc.auto', '0'),
+                               ('gc.pruneExpire', 'never'),
+                               ('core.commitGraph', 'true')]:
+                runner.run(self._git('config', key, value))
+        self.objects_dir = git_objects_dir(self.store_dir)
+
+    def _git(self, *args):
+        return ["git", "-C", self.store_dir] + list(args)
+
+    def link(self, repo_dir):
+        """Make the repo borrow objects from the store, returns False if it
+        already does.
+
+        """
+        if self.objects_dir in read_alternates(repo_dir):
+            return False
+        info_dir = os.path.join(git_objects_dir(repo_dir), 'info')
+        if not os.path.isdir(info_dir):
+            os.makedirs(info_dir)
+        with open(os.path.join(info_dir, 'alternates'), 'a') as alternates:
+            alternates.write("{0}\n".format(self.objects_dir))
+        print("Linked {0} to object store {1}".format(repo_dir,
+                                                      self.store_dir))
+        return True
+
+    def _claim_name(self, name, repo_dir):
+        """Record that the component name belongs to the repo, refuse a
+        name that belongs to a different repo.
+
+        """
+        path = os.path.realpath(repo_dir)
+        key = COMPONENT_PATH.format(name)
+        try:
+            owner = runner.run(self._git('config', '--get', key),
+                               retries=0).decode('utf-8').strip()
+        except subprocess.CalledProcessError:
+            # name not used yet
+            owner = None
+        if owner is None:
+            runner.run(self._git('config', key, path))
+        elif owner != path:
+            raise RuntimeError("ERROR: object store {0} already keeps the "
+                               "refs of {1} as '{2}', not absorbing {3} "
+                               "under that name".format(self.store_dir,
+                                                        owner, name, path))
+
+    def absorb(self, repo_dir, name=None):
+        """Move the objects of a linked repo into the store, keeping its
+        refs in the store under the component name so they stay
+        reachable. The name defaults to component_name(repo_dir).
+
+        """
+        if name is None:
+            name = component_name(repo_dir)
+        self._claim_name(name, repo_dir)
+        start = time.time()
+        prefix = COMPONENT_REFS.format(name)
+        runner.run(self._git('fetch', '--quiet', '--prune', '--no-tags',
+                             os.path.abspath(repo_dir),
+                             "+refs/*:{0}*".format(prefix)),
+                   retries=0)
+        # -l keeps only the objects the store doesn't have
+        runner.run(["git", "-C", repo_dir, "repack", "-a", "-d", "-l", "-q",
+                    "--keep-unreachable"], retries=0)
+        runner.run(["git", "-C", repo_dir, "commit-graph", "write",
+                    "--reachable"], retries=0)
+        print("Moved objects of {0} into the object store ({1:.1f} "
+              "s)".format(repo_dir, time.time() - start))
+
+    def repack(self):
+        """Single pack with a bitmap for the store.
+        """
+        runner.run(self._git('repack', '-a', '-d', '-q', '--keep-unreachable',
+                             '--write-bitmap-index'), retries=0)
+        runner.run(self._git('commit-graph', 'write', '--reachable'),
+                   retries=0)
+
+
+_store = None
+
+
+def configure(store_dir=None):
+    """Setup the process wide object store, no store_dir disables it.
+    """
+    global _store
+    _store = None
+    if store_dir:
+        _store = ObjectStore(store_dir)
+    return _store
+
+
+def get_store():
+    """The process wide object store, or None.
+    """
+    return _store
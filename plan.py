@@ -0,0 +1,235 @@
+"""Compute the import plan for one or more tag files without importing
+anything.
+
+For every tag in a tag file the plan records whether the tag is
+already in the git repo, will be skipped or imported under an alias,
+which optional processing steps it needs (externals, collapsing the
+standalone directory, shifting root files) and an estimate of the
+bytes transferred from svn and the number of subprocesses the import
+will spawn, which depends on how the tag is imported (temporary clone
+adding every file or only the paths svn changed, or git plumbing).
+The size estimates come from 'svn list --xml --recursive' of the paths
+that will be exported.
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+import runner
+from cesm2git import is_shifted_root_entry, svn_list_xml
+from tag_job import TagJob, jobs_from_manifest
+
+# subprocesses spawned by cesm2git.import_tag for a tag imported
+# through a temporary clone, adding every file: clone, checkout,
+# export, log, add, commit, tag, push
+CLONE_SUBPROCESS_COUNT = 8
+
+# the same with the paths svn changed since the previous tag, see
+# cesm2git.git_changed_paths: clone, checkout, export, log, rev-parse,
+# svn diff, ls-tree, check-ignore, add, write-tree, cat-file,
+# commit-tree, update-ref, tag, push
+CHANGED_PATHS_SUBPROCESS_COUNT = 15
+
+# --git-plumbing imports: export, log, commit-tree, mktag, update-ref.
+# The cat-file, hash-object and mktree processes are shared by every
+# tag of the run.
+PLUMBING_SUBPROCESS_COUNT = 5
+
+# svn propset + svn update when externals are checked out
+EXTERNALS_SUBPROCESS_COUNT = 2
+
+# svn list of the tag root when root files are shifted, the root file
+# exports are counted per file.
+SHIFT_ROOT_SUBPROCESS_COUNT = 1
+
+
+def git_tag_names(repo_dir):
+    """Return the set of tag names in the git repo with a single call.
+
+    """
+    cmd = [
+        "git",
+        "-C", repo_dir,
+        "for-each-ref",
+        "--format=%(refname:short)",
+        "refs/tags",
+    ]
+    output = runner.run(cmd)
+    return set(output.decode('utf-8').split())
+
+
+def _plan_tag(base_info, tag, git_tags):
+    """Classify a single tag file entry.
+
+    """
+    entry = {
+        'tag': tag['tag'],
+        'git_tag': TagJob.from_manifest(base_info, tag).git_tag,
+        'tag_path': os.path.join(base_info['tag_directory'], tag['tag']),
+        'checkout_externals': tag.get('checkout_externals', False),
+        'collapse_standalone': tag.get('collapse_standalone', False),
+        'shift_root_files': tag.get('shift_root_files', False),
+        'generate_externals_description': tag.get(
+            'generate_externals_description', False),
+        'bytes': None,
+        'files': None,
+        'subprocesses': None,
+    }
+    if tag.get('skip', False):
+        entry['action'] = 'skip'
+        entry['reason'] = tag.get('comment', '')
+    elif entry['git_tag'] in git_tags:
+        entry['action'] = 'imported'
+    elif 'alias' in tag:
+        entry['action'] = 'alias'
+    else:
+        entry['action'] = 'import'
+    return entry
+
+
+def import_subprocess_count(job, plumbing=False):
+    """Subprocesses spawned to import a job, before the optional
+    processing steps, see cesm2git.import_tag.
+
+    """
+    if job.checkout_externals:
+        return CLONE_SUBPROCESS_COUNT
+    if plumbing:
+        return PLUMBING_SUBPROCESS_COUNT
+    if job.previous_tag is not None:
+        return CHANGED_PATHS_SUBPROCESS_COUNT
+    return CLONE_SUBPROCESS_COUNT
+
+
+def _estimate_cost(job, entry, plumbing=False):
+    """Estimate the bytes and subprocesses needed to import a tag from
+    the svn listing of the exported paths.
+
+    """
+    url = job.url
+    export_url = url
+    if job.collapse_standalone:
+        export_url = "{0}/{1}".format(url, job.standalone_path)
+
+    listing = svn_list_xml(export_url, recursive=True)
+    files = [e for e in listing if e['kind'] == 'file']
+    total_bytes = sum(e['size'] for e in files)
+    subprocesses = import_subprocess_count(job, plumbing=plumbing)
+
+    if job.shift_root_files:
+        subprocesses += SHIFT_ROOT_SUBPROCESS_COUNT
+        for root in svn_list_xml(url, recursive=False):
+            name = root['name'].rstrip('/')
+            if not is_shifted_root_entry(job, name):
+                continue
+            if root['kind'] == 'dir':
+                sub = svn_list_xml("{0}/{1}".format(url, name),
+                                   recursive=True)
+                sub = [e for e in sub if e['kind'] == 'file']
+                total_bytes += sum(e['size'] for e in sub)
+                files.extend(sub)
+            else:
+                total_bytes += root['size']
+                files.append(root)
+            subprocesses += 1
+
+    if job.checkout_externals:
+        subprocesses += EXTERNALS_SUBPROCESS_COUNT
+
+    entry['bytes'] = total_bytes
+    entry['files'] = len(files)
+    entry['subprocesses'] = subprocesses
+    return entry
+
+
+def plan_tag_file(tag_filename, repo_dir, estimate=True, jobs=4,
+                  plumbing=False):
+    """Build the import plan for a single tag file, plumbing is true for
+    imports with --git-plumbing.
+
+    """
+    with open(tag_filename, 'r') as tag_file:
+        tag_input = json.load(tag_file)
+    base_info = tag_input['config']
+    git_tags = git_tag_names(repo_dir)
+
+    entries = [_plan_tag(base_info, tag, git_tags)
+               for tag in tag_input['tags']]
+
+    if estimate:
+        # the jobs know the tag imported before them
+        tag_jobs = dict((job.tag, job)
+                        for job in jobs_from_manifest(tag_input))
+        work = [(tag_jobs[entry['tag_path']], entry) for entry in entries
+                if entry['action'] in ('import', 'alias')]
+        pool = ThreadPool(max(1, jobs))
+        try:
+            pool.map(lambda item: _estimate_cost(*item, plumbing=plumbing),
+                     work)
+        finally:
+            pool.close()
+            pool.join()
+
+    plan = {
+        'tag_file': tag_filename,
+        'branch': base_info['branch'],
+        'tag_directory': base_info['tag_directory'],
+        'tags': entries,
+        'summary': summarize_plan(entries),
+    }
+    return plan
+
+
+def summarize_plan(entries):
+    """Totals for a list of planned tags.
+
+    """
+    summary = {}
+    for entry in entries:
+        summary[entry['action']] = summary.get(entry['action'], 0) + 1
+    todo = [e for e in entries if e['bytes'] is not None]
+    summary['bytes'] = sum(e['bytes'] for e in todo)
+    summary['files'] = sum(e['files'] for e in todo)
+    summary['subprocesses'] = sum(e['subprocesses'] for e in todo)
+    summary['externals'] = len(
+        [e for e in entries if e['action'] in ('import', 'alias') and
+         e['checkout_externals']])
+    summary['shift_root_files'] = len(
+        [e for e in entries if e['action'] in ('import', 'alias') and
+         e['shift_root_files']])
+    return summary
+
+
+def print_plan(plan):
+    """Human readable version of the plan.
+
+    """
+    print("Import plan for {0} (branch '{1}', svn '{2}')".format(
+        plan['tag_file'], plan['branch'], plan['tag_directory']))
+    for entry in plan['tags']:
+        flags = []
+        if entry['checkout_externals']:
+            flags.append('externals')
+        if entry['collapse_standalone']:
+            flags.append('collapse')
+        if entry['shift_root_files']:
+            flags.append('shift-root')
+        if entry['generate_externals_description']:
+            flags.append('gen-externals')
+        cost = ''
+        if entry['bytes'] is not None:
+            cost = "{0:>12} bytes {1:>7} files {2:>4} procs".format(
+                entry['bytes'], entry['files'], entry['subprocesses'])
+        name = entry['tag']
+        if entry['action'] == 'alias':
+            name = "{0} -> {1}".format(entry['tag'], entry['git_tag'])
+        print("    {0:<9} {1:<40} {2} {3}".format(
+            entry['action'], name, cost, ','.join(flags)))
+    summary = plan['summary']
+    print("  summary:")
+    for key in sorted(summary):
+        print("    {0:<18} : {1}".format(key, summary[key]))
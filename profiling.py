@@ -0,0 +1,295 @@
+"""Profiling of the importer's own work, per phase and per tag.
+
+Most of an import is spent waiting for svn and git, but the python
+side (parsing svn xml, building externals descriptions, walking the
+working copy, hashing files) adds up over hundreds of tags. With
+--profile DIR a Profiler splits the run into the phases reported with
+progress.phase (svn export, svn log, git commit, ...) and for every
+phase, and every tag, keeps
+
+    wall     elapsed time
+    cpu      user + system time of the importer process
+    child    user + system time of the svn and git subprocesses that
+             finished, from os.times()
+    wait     wall time of the commands run through runner.py, i.e.
+             time spent waiting for subprocesses
+
+Each phase also has its own cProfile profile, accumulated over every
+tag. The profiles are timed with the process cpu clock, so functions
+that only wait for subprocesses don't show up and the profile shows
+where the python time goes. At the end of the run the summary and the
+hottest functions of each phase are printed and written to DIR:
+
+    DIR/profile.json         phase and tag totals
+    DIR/<phase>.prof         pstats file per phase, e.g. for
+                             'python -m pstats' or snakeviz
+
+Time outside tags (setup, notes, repacking) is reported as phase 'run',
+time in a tag before its first phase as 'tag setup'.
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import re
+import time
+
+import runner
+
+# phase of the time outside tags
+RUN_PHASE = 'run'
+
+# phase of a tag before its first phase is reported
+TAG_SETUP_PHASE = 'tag setup'
+
+# functions listed per phase in the summary
+DEFAULT_TOP = 10
+
+_FIELDS = ['wall', 'cpu', 'child', 'wait']
+
+
+def _add(totals, start, end):
+    for field in _FIELDS:
+        totals[field] = totals.get(field, 0.0) + end[field] - start[field]
+
+
+def _filename(phase):
+    return "{0}.prof".format(re.sub(r'[^A-Za-z0-9_.-]+', '-', phase))
+
+
+class Profiler(object):
+    """Accumulates time and cProfile profiles per phase and per tag.
+
+    """
+
+    def __init__(self, output_dir=None, top=DEFAULT_TOP):
+        self.output_dir = output_dir
+        self.top = top
+        self.phases = {}
+        self.tags = []
+        self._profiles = {}
+        self._tag = None
+        self._phase = None
+        self._start = None
+        # commands timed so far and their total wall time
+        self._timings_seen = len(runner.get_runner().timings)
+        self._wait = 0.0
+
+    def _counters(self):
+        """Current values of the clocks the profiler attributes to
+        phases.
+
+        """
+        times = os.times()
+        timings = runner.get_runner().timings
+        count = len(timings)
+        self._wait += sum(timing['seconds']
+                          for timing in timings[self._timings_seen:count])
+        self._timings_seen = count
+        return {
+            'wall': time.time(),
+            'cpu': times[0] + times[1],
+            'child': times[2] + times[3],
+            'wait': self._wait,
+        }
+
+    def _switch(self, phase):
+        """Attribute the time since the last switch to the current phase
+        and start profiling the new one.
+
+        """
+        now = self._counters()
+        if self._phase is not None:
+            self._profiles[self._phase].disable()
+            totals = self.phases.setdefault(self._phase, {'count': 0})
+            _add(totals, self._start, now)
+            if self._tag is not None:
+                _add(self._tag['phases'].setdefault(self._phase, {}),
+                     self._start, now)
+                _add(self._tag, self._start, now)
+        self._phase = phase
+        self._start = now
+        if phase is not None:
+            self.phases.setdefault(phase, {'count': 0})['count'] += 1
+            if phase not in self._profiles:
+                import cProfile
+                self._profiles[phase] = cProfile.Profile(time.process_time)
+            self._profiles[phase].enable()
+
+    def start(self):
+        self._switch(RUN_PHASE)
+
+    def start_tag(self, name):
+        if self._tag is not None:
+            self.finish_tag()
+        self._tag = {'tag': name, 'phases': {}}
+        self._switch(TAG_SETUP_PHASE)
+
+    def phase(self, name):
+        if self._phase != name:
+            self._switch(name)
+
+    def finish_tag(self):
+        if self._tag is None:
+            return
+        self._switch(RUN_PHASE)
+        self.tags.append(self._tag)
+        self._tag = None
+
+    def stop(self):
+        """Stop profiling, the totals and profiles are kept.
+        """
+        if self._tag is not None:
+            self.finish_tag()
+        self._switch(None)
+
+    # ---------------------------------------------------------------
+    # results
+    # ---------------------------------------------------------------
+    def stats(self, phase):
+        """pstats.Stats of a phase, or None if it wasn't profiled.
+        """
+        profile = self._profiles.get(phase)
+        if profile is None:
+            return None
+        import pstats
+        try:
+            return pstats.Stats(profile)
+        except TypeError:
+            # nothing was recorded
+            return None
+
+    def to_dict(self):
+        return {
+            'phases': self.phases,
+            'tags': self.tags,
+        }
+
+    def write(self):
+        """Write profile.json and the pstats file of every phase to the
+        output directory.
+
+        """
+        if not self.output_dir:
+            return
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        with open(os.path.join(self.output_dir, 'profile.json'),
+                  'w') as profile_file:
+            json.dump(self.to_dict(), profile_file, indent=4, sort_keys=True)
+        for phase in self._profiles:
+            stats = self.stats(phase)
+            if stats is not None:
+                stats.dump_stats(os.path.join(self.output_dir,
+                                              _filename(phase)))
+
+    def print_summary(self):
+        """Print the time per phase, slowest first, and the functions
+        using the most cpu in each phase.
+
+        """
+        if not self.phases:
+            return
+        import pstats
+
+        print("Profile: {0} tags".format(len(self.tags)))
+        print("    {0:<20} {1:>6} {2:>10} {3:>10} {4:>10} {5:>10}".format(
+            'phase', 'count', 'wall s', 'cpu s', 'child s', 'wait s'))
+        for phase in sorted(self.phases,
+                            key=lambda p: -self.phases[p].get('wall', 0.0)):
+            totals = self.phases[phase]
+            print("    {0:<20} {1:>6} {2:>10.2f} {3:>10.2f} {4:>10.2f} "
+                  "{5:>10.2f}".format(phase, totals['count'],
+                                      totals.get('wall', 0.0),
+                                      totals.get('cpu', 0.0),
+                                      totals.get('child', 0.0),
+                                      totals.get('wait', 0.0)))
+        if self.tags:
+            print("    most cpu per tag:")
+            for entry in sorted(self.tags,
+                                key=lambda t: -t.get('cpu', 0.0))[:5]:
+                print("        {0:<40} {1:>8.2f} s cpu {2:>8.2f} s "
+                      "wall".format(entry['tag'], entry.get('cpu', 0.0),
+                                    entry.get('wall', 0.0)))
+        for phase in sorted(self.phases,
+                            key=lambda p: -self.phases[p].get('cpu', 0.0)):
+            stats = self.stats(phase)
+            if stats is None or not self.top:
+                continue
+            print("    hottest functions in '{0}':".format(phase))
+            stats.sort_stats('tottime')
+            for func in stats.fcn_list[:self.top]:
+                _, calls, tottime, cumtime, _ = stats.stats[func]
+                print("        {0:>8.3f} s {1:>8.3f} s cum {2:>8} calls  "
+                      "{3}".format(tottime, cumtime, calls,
+                                   pstats.func_std_string(func)))
+
+
+_profiler = None
+
+
+def configure(output_dir=None, top=DEFAULT_TOP):
+    """Setup and start the process wide profiler, no output_dir disables
+    profiling.
+
+    """
+    global _profiler
+    disable()
+    if output_dir:
+        _profiler = Profiler(output_dir, top=top)
+        _profiler.start()
+    return _profiler
+
+
+def get_profiler():
+    """The process wide profiler, or None.
+    """
+    return _profiler
+
+
+def disable():
+    """Stop profiling in this process, e.g. in worker processes that
+    inherited the parent's profiler.
+
+    """
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+    _profiler = None
+
+
+def start_tag(name):
+    """Report the start of a tag, if the run is being profiled.
+    """
+    if _profiler is not None:
+        _profiler.start_tag(name)
+
+
+def finish_tag():
+    """Report the end of the current tag, if the run is being profiled.
+    """
+    if _profiler is not None:
+        _profiler.finish_tag()
+
+
+def phase(name):
+    """Report the phase of the current tag, if the run is being profiled.
+    """
+    if _profiler is not None:
+        _profiler.phase(name)
+
+
+def finish():
+    """Stop the process wide profiler, print its summary and write its
+    files.
+
+    """
+    global _profiler
+    if _profiler is None:
+        return
+    _profiler.stop()
+    _profiler.print_summary()
+    _profiler.write()
+    _profiler = None
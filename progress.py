@@ -0,0 +1,305 @@
+"""Progress reporting for long tag loops.
+
+A Progress tracks the number of tags done out of the total, the phase
+of the current tag (export, svn log, commit, push, ...), the command
+currently running, the rolling throughput over the last few tags and
+the resulting ETA. It prints a line when a tag starts and a heartbeat
+while a phase takes a long time, and can keep a json status file up
+to date for external monitors:
+
+    {
+        "done": 12, "total": 511, "current_tag": "clm4_5_1_r100",
+        "phase": "svn export", "command": "svn export ...",
+        "phase_seconds": 42.0, "tags_per_hour": 80.5,
+        "eta_seconds": 22300.0, "failed": 0, "updated": 1509743909.0,
+        ...
+    }
+
+The import code reports tags and phases through the module level
+add_total(), start_tag(), finish_tag() and phase(), which do nothing unless
+tag-loop.py configured a Progress. report.RunReport.tag reports the
+start and end of every tag.
+
+"""
+
+from __future__ import print_function
+
+import collections
+import json
+import os
+import threading
+import time
+
+import profiling
+import runner
+
+# number of recent tags used for the throughput and ETA
+ROLLING_WINDOW = 20
+
+# default seconds between heartbeat lines and status file updates
+DEFAULT_HEARTBEAT = 60
+
+
+def format_duration(seconds):
+    """Short human readable duration, e.g. '2h05m' or '42s'.
+    """
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "{0}h{1:02d}m".format(seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return "{0}m{1:02d}s".format(seconds // 60, seconds % 60)
+    return "{0}s".format(seconds)
+
+
+class Progress(object):
+    """Progress of a run over a known number of tags.
+
+    """
+
+    def __init__(self, total=0, status_filename=None,
+                 heartbeat=DEFAULT_HEARTBEAT):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.time()
+        self.current_tag = None
+        self.tag_started = None
+        self.phase_name = None
+        self.phase_started = None
+        self.command = None
+        self.status_filename = status_filename
+        self.heartbeat = heartbeat
+        self._durations = collections.deque(maxlen=ROLLING_WINDOW)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------------------------------------------------------------
+    # updates from the import
+    # ---------------------------------------------------------------
+    def add_total(self, count):
+        with self._lock:
+            self.total += count
+        self.write_status()
+
+    def start_tag(self, tag):
+        with self._lock:
+            self.current_tag = tag
+            self.tag_started = time.time()
+            self.phase_name = None
+            self.command = None
+            line = "Processing [{0}/{1}] : {2}    {3}".format(
+                self.done + 1, self.total, tag, self._rate_text())
+        print(line)
+        self.write_status()
+
+    def finish_tag(self, failed=False):
+        with self._lock:
+            if self.tag_started is not None:
+                self._durations.append(time.time() - self.tag_started)
+            self.done += 1
+            if failed:
+                self.failed += 1
+            self.current_tag = None
+            self.tag_started = None
+            self.phase_name = None
+            self.command = None
+        self.write_status()
+
+    def tags_done(self, count, seconds):
+        """Count tags that were imported elsewhere, e.g. by segment worker
+        processes, taking seconds in total.
+
+        """
+        with self._lock:
+            self.done += count
+            if count:
+                self._durations.extend([seconds / count] * count)
+            line = "Done [{0}/{1}]    {2}".format(self.done, self.total,
+                                                 self._rate_text())
+        print(line)
+        self.write_status()
+
+    def phase(self, name):
+        with self._lock:
+            self.phase_name = name
+            self.phase_started = time.time()
+        self.write_status()
+
+    def command_started(self, cmd):
+        with self._lock:
+            self.command = ' '.join(cmd)
+
+    def command_finished(self, cmd):
+        with self._lock:
+            self.command = None
+
+    # ---------------------------------------------------------------
+    # rates
+    # ---------------------------------------------------------------
+    def seconds_per_tag(self):
+        """Average seconds per tag over the last ROLLING_WINDOW tags.
+        """
+        if not self._durations:
+            return None
+        return sum(self._durations) / len(self._durations)
+
+    def eta_seconds(self):
+        per_tag = self.seconds_per_tag()
+        if per_tag is None:
+            return None
+        remaining = max(0, self.total - self.done)
+        elapsed = 0.0
+        if self.tag_started is not None:
+            # the current tag is part way done
+            elapsed = min(time.time() - self.tag_started, per_tag)
+        return remaining * per_tag - elapsed
+
+    def _rate_text(self):
+        per_tag = self.seconds_per_tag()
+        if per_tag is None:
+            return ''
+        return "({0:.1f} tags/hour, ETA {1})".format(
+            3600.0 / per_tag if per_tag else 0.0,
+            format_duration(self.eta_seconds()))
+
+    # ---------------------------------------------------------------
+    # status file and heartbeat
+    # ---------------------------------------------------------------
+    def status(self):
+        with self._lock:
+            now = time.time()
+            per_tag = self.seconds_per_tag()
+            return {
+                'done': self.done,
+                'total': self.total,
+                'failed': self.failed,
+                'current_tag': self.current_tag,
+                'phase': self.phase_name,
+                'command': self.command,
+                'tag_seconds': (now - self.tag_started
+                                if self.tag_started else None),
+                'phase_seconds': (now - self.phase_started
+                                  if self.phase_name else None),
+                'tags_per_hour': 3600.0 / per_tag if per_tag else None,
+                'eta_seconds': self.eta_seconds(),
+                'elapsed_seconds': now - self.started,
+                'pid': os.getpid(),
+                'updated': now,
+            }
+
+    def write_status(self):
+        """Atomically replace the status file, if there is one.
+        """
+        if not self.status_filename:
+            return
+        status = self.status()
+        tmp_filename = "{0}.tmp".format(self.status_filename)
+        # the heartbeat thread writes too
+        with self._write_lock:
+            with open(tmp_filename, 'w') as status_file:
+                json.dump(status, status_file, indent=4, sort_keys=True)
+            os.rename(tmp_filename, self.status_filename)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat):
+            status = self.status()
+            if status['current_tag'] is not None:
+                activity = status['command'] or status['phase'] or ''
+                print("    ... {0} {1} for {2}: {3}".format(
+                    status['current_tag'], status['phase'] or 'running',
+                    format_duration(status['phase_seconds'] or
+                                    status['tag_seconds']),
+                    activity[:100]))
+            self.write_status()
+
+    def start(self):
+        """Start the heartbeat and follow the commands of the runner.
+        """
+        runner.get_runner().listeners.append(self)
+        if self.heartbeat:
+            self._thread = threading.Thread(target=self._heartbeat)
+            self._thread.daemon = True
+            self._thread.start()
+        self.write_status()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        listeners = runner.get_runner().listeners
+        if self in listeners:
+            listeners.remove(self)
+        self.write_status()
+
+
+_progress = None
+
+
+def configure(**kwargs):
+    """Replace the process wide progress, see Progress for options.
+    """
+    global _progress
+    _progress = Progress(**kwargs)
+    return _progress
+
+
+def get_progress():
+    """The process wide progress, or None.
+    """
+    return _progress
+
+
+def disable():
+    """Stop tracking progress in this process, e.g. in worker processes
+    that inherited the parent's progress.
+
+    """
+    global _progress
+    _progress = None
+
+
+def add_total(count):
+    """Change the number of tags the run imports, e.g. for tags that are
+    skipped, if progress is being tracked.
+
+    """
+    if _progress is not None:
+        _progress.add_total(count)
+
+
+def start_tag(tag):
+    """Report the start of a tag, if progress is being tracked.
+    """
+    if _progress is not None:
+        _progress.start_tag(tag)
+
+
+def finish_tag(failed=False):
+    """Report the end of the current tag, if progress is being tracked.
+    """
+    if _progress is not None:
+        _progress.finish_tag(failed)
+
+
+def tags_done(count, seconds):
+    """Report tags imported by other processes, if progress is being
+    tracked.
+
+    """
+    if _progress is not None:
+        _progress.tags_done(count, seconds)
+
+
+def phase(name):
+    """Report the phase of the current tag, if progress is being tracked.
+    The phase is also reported to the profiler.
+
+    """
+    profiling.phase(name)
+    if _progress is not None:
+        _progress.phase(name)
@@ -0,0 +1,30 @@
+"""Minimum python version of the cesm2git scripts.
+
+Every entry point checks the version before importing anything else
+from this package, since the modules use python 3 only syntax, e.g.
+the async svn queries of svn_async.py. Keep this module importable by
+any python so the check can report the version instead of failing with
+a syntax error.
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+MINIMUM_VERSION = (3, 5)
+
+
+def check_python_version():
+    """Exit with an error message if the running python is older than
+    MINIMUM_VERSION.
+
+    """
+    if sys.version_info[0:2] < MINIMUM_VERSION:
+        print(70 * "*")
+        print("ERROR: {0} requires python >= {1}.x. ".format(
+            sys.argv[0], ".".join(str(x) for x in MINIMUM_VERSION)))
+        print("It appears that you are running python {0}".format(
+            ".".join(str(x) for x in sys.version_info[0:3])))
+        print(70 * "*")
+        sys.exit(1)
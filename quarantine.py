@@ -0,0 +1,304 @@
+"""Keep going past tags that fail to import.
+
+By default the first tag that fails stops the run. With --keep-going
+tag-loop.py imports a tag file through import_keep_going instead: a
+failing tag is recorded in the quarantine file with its error,
+backtrace and the temporary directories it left behind (artifacts),
+and the loop continues:
+
+  * with the git plumbing backend the remaining tags of the tag file
+    are imported on a side branch (cesm2git-quarantine-<branch>)
+    starting from the last good tag. They aren't tagged and the real
+    branch isn't moved, the side commits are recorded as 'pending',
+
+  * tags that need the porcelain backend (svn externals, or without
+    --git-plumbing) can't be built off the branch, so the rest of the
+    tag file is recorded as 'blocked'. Other tag files continue.
+
+--retry-quarantined runs the same loop over only the quarantined tags.
+The failed tags are imported again on the real branch, and each
+pending commit is reused by rewriting its parent when the parent's
+tree as seen by the import (without the removed root entries, see
+cesm2git.removed_root_entries) is the same as the one it was built
+on, otherwise the tag is imported again. Tags that succeed are
+removed from the quarantine file, the side branch is deleted when
+nothing is pending on it anymore.
+
+The quarantine file is json:
+
+    {
+        "tags": {
+            "clm4_5_32": {
+                "status": "failed", "tag_file": "clm-trunk-tags.json",
+                "branch": "clm", "tag": "clm4_5_32",
+                "error": "...", "traceback": "...", "phase": "svn export",
+                "artifacts": ["/.../clm-update-clm4_5_32"],
+                "attempts": 1, "time": 1509743909.0
+            },
+            "clm4_5_33": {
+                "status": "pending", "commit": "...", "parent": "...", ...
+            }
+        }
+    }
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import time
+import traceback
+
+import maintenance
+import progress
+import revmap
+from cesm2git import (build_plumbing_commit, import_tag, new_tag_from_job,
+                      publish_plumbing_commit, removed_root_entries)
+from git_backend import get_git_session
+from plan import git_tag_names
+from report import RunReport
+
+DEFAULT_QUARANTINE_FILE = 'quarantine.json'
+
+SIDE_BRANCH = 'cesm2git-quarantine-{0}'
+
+# quarantine states, pending tags were imported on the side branch
+FAILED = 'failed'
+BLOCKED = 'blocked'
+PENDING = 'pending'
+
+
+class Quarantine(object):
+    """Tags that failed, or were held back by a failure, keyed by git tag.
+
+    """
+
+    def __init__(self, filename=DEFAULT_QUARANTINE_FILE):
+        self.filename = filename
+        self.tags = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r') as quarantine_file:
+                self.tags = json.load(quarantine_file)['tags']
+
+    def save(self):
+        """Atomically replace the quarantine file, it is removed when
+        nothing is quarantined.
+
+        """
+        if not self.tags:
+            if os.path.isfile(self.filename):
+                os.remove(self.filename)
+            return
+        tmp_filename = "{0}.tmp".format(self.filename)
+        with open(tmp_filename, 'w') as quarantine_file:
+            json.dump({'tags': self.tags}, quarantine_file, indent=4,
+                      sort_keys=True)
+        os.rename(tmp_filename, self.filename)
+
+    def _record(self, job, tag_file, status, **info):
+        previous = self.tags.get(job.git_tag, {})
+        entry = {
+            'status': status,
+            'tag_file': tag_file,
+            'branch': job.branch,
+            'tag': job.tag_name,
+            'attempts': previous.get('attempts', 0),
+            'time': time.time(),
+        }
+        entry.update(info)
+        self.tags[job.git_tag] = entry
+        self.save()
+        return entry
+
+    def fail(self, job, tag_file, error, artifacts):
+        phase = None
+        if progress.get_progress() is not None:
+            phase = progress.get_progress().phase_name
+        attempts = self.tags.get(job.git_tag, {}).get('attempts', 0) + 1
+        self._record(job, tag_file, FAILED, error=str(error),
+                     traceback=traceback.format_exc(), phase=phase,
+                     artifacts=artifacts, attempts=attempts)
+        print("    QUARANTINED '{0}' : {1}".format(job.git_tag, error))
+
+    def block(self, job, tag_file, failed_tag):
+        self._record(job, tag_file, BLOCKED,
+                     error="blocked by '{0}'".format(failed_tag))
+        print("    blocked '{0}' by '{1}'".format(job.git_tag, failed_tag))
+
+    def pend(self, job, tag_file, commit, parent):
+        self._record(job, tag_file, PENDING, commit=commit, parent=parent,
+                     revision=job.svn_revision)
+
+    def release(self, job):
+        """Forget a tag that was imported, returns True if it was
+        quarantined.
+
+        """
+        if self.tags.pop(job.git_tag, None) is None:
+            return False
+        self.save()
+        return True
+
+    def entry(self, job):
+        return self.tags.get(job.git_tag)
+
+    def jobs(self, jobs, tag_file):
+        """The quarantined jobs of a tag file, in tag file order.
+        """
+        return [job for job in jobs
+                if self.tags.get(job.git_tag, {}).get('tag_file') == tag_file]
+
+    def pending_on(self, branch):
+        return [tag for tag, entry in self.tags.items()
+                if entry['status'] == PENDING and entry['branch'] == branch]
+
+    def print_summary(self):
+        if not self.tags:
+            return
+        print("Quarantine ({0}): {1} tags".format(self.filename,
+                                                  len(self.tags)))
+        for git_tag in sorted(self.tags):
+            entry = self.tags[git_tag]
+            print("    {0:<8} {1:<40} {2}".format(
+                entry['status'], git_tag, entry.get('error', '')[:80]))
+
+
+def _remove_artifacts(entry):
+    """Remove the temporary directories left by a previous attempt, they
+    would stop the tag from being imported again.
+
+    """
+    for path in entry.get('artifacts', []):
+        if os.path.isdir(path):
+            print("    removing '{0}' from the failed import".format(path))
+            shutil.rmtree(path)
+
+
+def _kept_entries(session, commit, job):
+    """Entries of a commit's tree that an import of job keeps.
+    """
+    entries = session.read_tree(commit)
+    for name in removed_root_entries(job):
+        entries.pop(name, None)
+    return entries
+
+
+def _import_job(job, repo, head, entry, export_dir, authors, debug,
+                plumbing):
+    """Import a single job, returns the commit written on top of head with
+    the plumbing backend, or None if the job was imported and pushed
+    with the porcelain backend.
+
+    """
+    if not plumbing:
+        import_tag(job, repo, authors=authors, debug=debug, push=True,
+                   plumbing=False)
+        return None
+
+    repo_dir = os.path.abspath(repo)
+    session = get_git_session(repo_dir)
+    new_tag = new_tag_from_job(job)
+    if entry is not None and entry['status'] == PENDING and \
+       session.rev_parse(entry['commit']) is not None and \
+       _kept_entries(session, entry['parent'], job) == \
+       _kept_entries(session, head, job):
+        print("    reusing pending commit {0}".format(entry['commit']))
+        job.svn_revision = entry.get('revision')
+        if entry['parent'] == head:
+            return entry['commit']
+        return session.reparent_commit(entry['commit'], [head])
+
+    commit = build_plumbing_commit(job, new_tag, repo_dir, head, export_dir,
+                                   authors=authors, debug=debug)
+    shutil.rmtree(export_dir)
+    return commit
+
+
+def import_keep_going(jobs, repo, quarantine, tag_file,
+                      authors='author-map.json', debug=False,
+                      plumbing=False, report=None):
+    """Import the jobs, all for the same branch and in order, recording
+    failures in the quarantine instead of stopping. Jobs whose git
+    tag exists are skipped. Returns the list of git tags created.
+
+    """
+    if report is None:
+        report = RunReport()
+    cwd = os.getcwd()
+    repo_dir = os.path.abspath("{0}/{1}".format(cwd, repo))
+    session = get_git_session(repo_dir)
+    existing = git_tag_names(repo_dir)
+
+    created = []
+    failed_tag = None
+    side_ref = None
+    head = None
+    for job in jobs:
+        if job.git_tag in existing:
+            if quarantine.release(job):
+                print("    git tag '{0}' exists, released from "
+                      "quarantine".format(job.git_tag))
+            progress.add_total(-1)
+            continue
+        entry = quarantine.entry(job)
+        if entry is not None:
+            _remove_artifacts(entry)
+        use_plumbing = plumbing and not job.checkout_externals
+        if failed_tag is not None and not use_plumbing:
+            quarantine.block(job, tag_file, failed_tag)
+            progress.add_total(-1)
+            continue
+
+        branch_ref = "refs/heads/{0}".format(job.branch)
+        if side_ref is None:
+            side_ref = "refs/heads/{0}".format(SIDE_BRANCH.format(job.branch))
+        export_dir = "{0}/{1}-update-{2}".format(cwd, repo, job.git_tag)
+        try:
+            with report.tag(job.tag_name, branch=job.branch):
+                try:
+                    if use_plumbing and head is None:
+                        head = session.rev_parse(branch_ref)
+                    commit = _import_job(job, repo, head, entry, export_dir,
+                                         authors, debug, use_plumbing)
+                except Exception as error:
+                    # recorded here while the progress knows the phase
+                    artifacts = []
+                    if os.path.isdir(export_dir):
+                        artifacts.append(export_dir)
+                    quarantine.fail(job, tag_file, error, artifacts)
+                    raise
+        except Exception:
+            if failed_tag is None:
+                failed_tag = job.git_tag
+            continue
+
+        if commit is None:
+            # imported with the porcelain backend, the branch moved
+            quarantine.release(job)
+            created.append(job.git_tag)
+            head = None
+            maintenance.after_tag()
+            continue
+        new_tag = job.git_tag
+        if failed_tag is None:
+            publish_plumbing_commit(session, job.branch, new_tag, commit,
+                                    head)
+            revmap.record(job, new_tag, commit=commit)
+            quarantine.release(job)
+            created.append(new_tag)
+            maintenance.after_tag()
+        else:
+            print("    {0} {1} : {2} (pending)".format(
+                SIDE_BRANCH.format(job.branch), new_tag, commit))
+            session.update_refs([(side_ref, commit, None)])
+            quarantine.pend(job, tag_file, commit, head)
+        head = commit
+
+    if side_ref is not None and failed_tag is None and \
+       session.rev_parse(side_ref) is not None and \
+       not quarantine.pending_on(jobs[0].branch):
+        # everything on the side branch was imported
+        session.update_refs([(side_ref, None, None)])
+    return created
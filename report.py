@@ -0,0 +1,141 @@
+"""Run report for tag imports.
+
+Records the wall time, outcome and peak memory of every tag imported in
+a run and writes them, with the subprocess timing summary and the
+memory budget statistics, as json.
+
+Peak memory is the resident set high water mark of the import process
+(VmHWM). On linux the high water mark is reset before each tag by
+writing '5' to /proc/self/clear_refs, so the value is the peak of that
+tag alone. Where that isn't available the value is the peak of the
+process so far from getrusage. Subprocesses (svn, git) are reported
+separately as the largest child process seen so far.
+
+"""
+
+from __future__ import print_function
+
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+import profiling
+import progress
+import runner
+import spool
+
+_CLEAR_REFS = '/proc/self/clear_refs'
+_STATUS = '/proc/self/status'
+
+
+def _maxrss_kb(who):
+    """ru_maxrss in kB, it is reported in bytes on macOS.
+    """
+    maxrss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024
+    return maxrss
+
+
+def reset_peak_rss():
+    """Reset the resident set high water mark of this process, returns
+    False if the platform doesn't support it.
+
+    """
+    try:
+        with open(_CLEAR_REFS, 'w') as clear_refs:
+            clear_refs.write('5')
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def peak_rss_kb():
+    """Resident set high water mark of this process in kB.
+    """
+    try:
+        with open(_STATUS, 'r') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return _maxrss_kb(resource.RUSAGE_SELF)
+
+
+def child_peak_rss_kb():
+    """Largest resident set of any finished subprocess in kB.
+    """
+    return _maxrss_kb(resource.RUSAGE_CHILDREN)
+
+
+class RunReport(object):
+    """Per tag timing and memory use for a run.
+
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.tags = []
+
+    @contextmanager
+    def tag(self, name, **info):
+        """Record the import of a single tag, exceptions are recorded as a
+        failure and re-raised.
+
+        """
+        entry = {'tag': name, 'status': 'ok'}
+        entry.update(info)
+        per_tag = reset_peak_rss()
+        start = time.time()
+        progress.start_tag(name)
+        profiling.start_tag(name)
+        try:
+            yield entry
+        except BaseException as error:
+            entry['status'] = 'failed'
+            entry['error'] = str(error)
+            raise
+        finally:
+            progress.finish_tag(entry['status'] == 'failed')
+            profiling.finish_tag()
+            entry['seconds'] = time.time() - start
+            entry['peak_rss_kb'] = peak_rss_kb()
+            entry['peak_rss_per_tag'] = per_tag
+            entry['child_peak_rss_kb'] = child_peak_rss_kb()
+            self.tags.append(entry)
+
+    def to_dict(self):
+        budget = spool.get_budget()
+        peaks = [t['peak_rss_kb'] for t in self.tags]
+        return {
+            'seconds': time.time() - self.started,
+            'tags': self.tags,
+            'peak_rss_kb': max(peaks) if peaks else peak_rss_kb(),
+            'child_peak_rss_kb': child_peak_rss_kb(),
+            'memory_budget': {
+                'limit': budget.limit,
+                'peak': budget.peak,
+                'spilled_bytes': budget.spilled_bytes,
+            },
+            'subprocesses': runner.get_runner().timing_summary(),
+        }
+
+    def write(self, filename):
+        with open(filename, 'w') as report_file:
+            json.dump(self.to_dict(), report_file, indent=4, sort_keys=True)
+
+    def print_summary(self):
+        """Print the slowest and largest tags.
+        """
+        if not self.tags:
+            return
+        print("Run report: {0} tags".format(len(self.tags)))
+        for entry in self.tags:
+            print("    {0:<40} {1:<6} {2:>8.1f} s {3:>9} kB peak "
+                  "{4:>9} kB child".format(entry['tag'], entry['status'],
+                                           entry['seconds'],
+                                           entry['peak_rss_kb'],
+                                           entry['child_peak_rss_kb']))
@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+"""Mapping between svn tag revisions and the git commits they were
+imported as.
+
+Every import records the svn url of the tag, the revision the tag was
+last changed in (from the svn log read for the commit), the git tag,
+branch and commit in an sqlite database in the repo's git directory
+(cesm2git-revmap.sqlite). The table is indexed by git tag, by svn url
+and revision and by commit, so 'was this imported, and as what?' is a
+single index lookup instead of listing the git tags or asking svn.
+
+The database isn't part of the repo history, so the mapping is also
+written as git notes on the imported commits (refs/notes/svn) at the
+end of every run:
+
+    svn-url: https://svn-ccsm-models.cgd.ucar.edu/clm2/trunk_tags/clm4_5_1_r120
+    svn-revision: 78432
+    tag: clm4_5_1_r120
+
+'git log --notes=svn' shows them, and --import-notes rebuilds the
+database from the notes, e.g. in a fresh clone after fetching
+refs/notes/svn.
+
+Queries from the command line:
+
+    ./revmap.py --repo clm --tag clm4_5_1_r120
+    ./revmap.py --repo clm --url https://.../clm2/trunk_tags/clm4_5_1_r120@78432
+    ./revmap.py --repo clm --commit 5e1f0c2
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+from python_version import check_python_version
+
+check_python_version()
+
+#
+# built-in modules
+#
+import argparse
+import os
+import time
+
+#
+# other modules in this package
+#
+import runner
+from git_backend import MODE_TREE, get_git_session
+
+DATABASE_NAME = 'cesm2git-revmap.sqlite'
+
+NOTES_REF = 'refs/notes/svn'
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS revmap (
+        tag TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        revision INTEGER,
+        branch TEXT,
+        git_commit TEXT NOT NULL,
+        imported REAL,
+        noted INTEGER DEFAULT 0
+    )""",
+    "CREATE INDEX IF NOT EXISTS revmap_url ON revmap (url, revision)",
+    "CREATE INDEX IF NOT EXISTS revmap_commit ON revmap (git_commit)",
+]
+
+_COLUMNS = ['tag', 'url', 'revision', 'branch', 'git_commit', 'imported']
+
+
+def git_dir_path(repo_dir):
+    """Absolute path of a repo's git directory.
+    """
+    output = runner.run(["git", "-C", repo_dir, "rev-parse", "--git-dir"])
+    return os.path.abspath(os.path.join(repo_dir,
+                                        output.decode('utf-8').strip()))
+
+
+def format_note(entry):
+    return "svn-url: {0}\nsvn-revision: {1}\ntag: {2}\n".format(
+        entry['url'], entry['revision'], entry['tag'])
+
+
+def read_notes_tree(session, tree, prefix=''):
+    """Entries of a notes tree as a flat dict of commit sha -> (mode,
+    sha). Notes trees may fan out into directories named after the
+    first digits of the commit ('ab/cdef...'), those are read
+    recursively.
+
+    """
+    entries = {}
+    for name, (mode, sha) in session.read_tree(tree).items():
+        path = prefix + name
+        if mode == MODE_TREE and len(name) == 2 and len(path) < 40:
+            entries.update(read_notes_tree(session, sha, path))
+        else:
+            entries[path] = (mode, sha)
+    return entries
+
+
+def parse_note(text):
+    fields = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        fields[key.strip()] = value.strip()
+    revision = fields.get('svn-revision')
+    return {
+        'url': fields.get('svn-url'),
+        'revision': int(revision) if revision else None,
+        'tag': fields.get('tag'),
+    }
+
+
+class RevisionMap(object):
+    """svn url and revision <-> git tag and commit for a single repo.
+
+    """
+
+    def __init__(self, repo_dir):
+        import sqlite3
+
+        self.repo_dir = os.path.abspath(repo_dir)
+        self.filename = os.path.join(git_dir_path(self.repo_dir),
+                                     DATABASE_NAME)
+        self._db = sqlite3.connect(self.filename)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+
+    def close(self):
+        self._db.close()
+
+    # ---------------------------------------------------------------
+    # recording
+    # ---------------------------------------------------------------
+    def record(self, job, new_tag, commit=None, revision=None):
+        """Record that the job was imported as new_tag. The commit is
+        looked up from the tag and the revision taken from the job if
+        they aren't given.
+
+        """
+        if commit is None:
+            commit = get_git_session(self.repo_dir).rev_parse(
+                "refs/tags/{0}^{{commit}}".format(new_tag))
+        if revision is None:
+            revision = job.svn_revision
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO revmap (tag, url, revision, branch, "
+                "git_commit, imported, noted) VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (new_tag, job.url, revision, job.branch, commit, time.time()))
+
+    def forget(self, tags):
+        """Remove tags, e.g. after a rollback, and the notes of their
+        commits.
+
+        """
+        tags = list(tags)
+        commits = set()
+        for tag in tags:
+            entry = self.by_tag(tag)
+            if entry is not None:
+                commits.add(entry['git_commit'])
+        with self._db:
+            self._db.executemany("DELETE FROM revmap WHERE tag = ?",
+                                 [(tag, ) for tag in tags])
+        # a commit imported as another tag too keeps its note
+        commits.difference_update(
+            row['git_commit'] for row in self._db.execute(
+                "SELECT git_commit FROM revmap").fetchall())
+        self._remove_notes(commits)
+
+    # ---------------------------------------------------------------
+    # queries
+    # ---------------------------------------------------------------
+    def _rows(self, where, args):
+        cursor = self._db.execute(
+            "SELECT {0} FROM revmap WHERE {1} ORDER BY tag".format(
+                ', '.join(_COLUMNS), where), args)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def by_tag(self, tag):
+        rows = self._rows("tag = ?", (tag, ))
+        return rows[0] if rows else None
+
+    def by_url(self, url, revision=None):
+        """Imports of an svn url, of any revision if revision is None.
+        """
+        if revision is None:
+            return self._rows("url = ?", (url, ))
+        return self._rows("url = ? AND revision = ?", (url, int(revision)))
+
+    def by_commit(self, commit):
+        """Imports of a commit, commit may be abbreviated.
+        """
+        if len(commit) == 40:
+            return self._rows("git_commit = ?", (commit, ))
+        return self._rows("git_commit >= ? AND git_commit < ?",
+                          (commit, commit + 'g'))
+
+    def imported(self, job, revision=None):
+        """True if the job's svn tag, at the revision if given, was
+        imported under the job's git tag.
+
+        """
+        entry = self.by_tag(job.git_tag)
+        if entry is None or entry['url'] != job.url:
+            return False
+        return revision is None or entry['revision'] == int(revision)
+
+    # ---------------------------------------------------------------
+    # git notes
+    # ---------------------------------------------------------------
+    def write_notes(self):
+        """Add the entries that don't have a note yet to refs/notes/svn in
+        a single notes commit. Returns the number of notes written.
+
+        """
+        rows = [dict(row) for row in self._db.execute(
+            "SELECT {0} FROM revmap WHERE noted = 0".format(
+                ', '.join(_COLUMNS))).fetchall()]
+        if not rows:
+            return 0
+        session = get_git_session(self.repo_dir)
+        parent = session.rev_parse(NOTES_REF)
+        entries = {}
+        if parent is not None:
+            entries = read_notes_tree(session, parent)
+        # the notes are written without fan out, git reads both
+        for row in rows:
+            entries[row['git_commit']] = (
+                '100644', session.hash_data(format_note(row).encode('utf-8')))
+        self._commit_notes(session, parent, entries,
+                           "Notes added by cesm2git for {0} "
+                           "imports".format(len(rows)))
+        with self._db:
+            self._db.executemany("UPDATE revmap SET noted = 1 WHERE tag = ?",
+                                 [(row['tag'], ) for row in rows])
+        return len(rows)
+
+    def _remove_notes(self, commits):
+        """Remove the notes of the commits from refs/notes/svn in a
+        single notes commit. Returns the number of notes removed.
+
+        """
+        session = get_git_session(self.repo_dir)
+        parent = session.rev_parse(NOTES_REF)
+        if parent is None or not commits:
+            return 0
+        entries = read_notes_tree(session, parent)
+        removed = [commit for commit in commits if commit in entries]
+        if not removed:
+            return 0
+        for commit in removed:
+            del entries[commit]
+        self._commit_notes(session, parent, entries,
+                           "Notes removed by cesm2git for {0} "
+                           "commits".format(len(removed)))
+        return len(removed)
+
+    def _commit_notes(self, session, parent, entries, message):
+        """Point refs/notes/svn at a new notes commit with the entries.
+        """
+        tree = session.mktree(entries)
+        session.flush_pack()
+        cmd = ["git", "-C", self.repo_dir, "commit-tree", tree, "-m",
+               message]
+        if parent is not None:
+            cmd.extend(["-p", parent])
+        commit = runner.run(cmd, retries=0).decode('ascii').strip()
+        session.update_refs([(NOTES_REF, commit, parent)])
+
+    def import_notes(self):
+        """Rebuild the entries from refs/notes/svn, returns the number of
+        entries imported. Notes of tags that don't exist anymore, e.g.
+        after a rollback, are ignored.
+
+        """
+        output = runner.run(["git", "-C", self.repo_dir, "notes", "--ref",
+                             NOTES_REF, "list"])
+        session = get_git_session(self.repo_dir)
+        count = 0
+        with self._db:
+            for line in output.decode('ascii').splitlines():
+                note, commit = line.split()
+                fields = parse_note(session.read_object(note)[2].decode(
+                    'utf-8'))
+                if not fields['url'] or not fields['tag'] or \
+                   session.rev_parse("refs/tags/{0}".format(
+                       fields['tag'])) is None:
+                    continue
+                self._db.execute(
+                    "INSERT OR REPLACE INTO revmap (tag, url, revision, "
+                    "branch, git_commit, imported, noted) VALUES "
+                    "(?, ?, ?, NULL, ?, NULL, 1)",
+                    (fields['tag'], fields['url'], fields['revision'],
+                     commit))
+                count += 1
+        return count
+
+
+_revmap = None
+
+
+def configure(repo_dir=None):
+    """Setup the process wide revision map of the repo tags are imported
+    into, no repo_dir disables recording.
+
+    """
+    global _revmap
+    if _revmap is not None:
+        _revmap.close()
+    _revmap = None
+    if repo_dir:
+        _revmap = RevisionMap(repo_dir)
+    return _revmap
+
+
+def get_revmap():
+    """The process wide revision map, or None.
+    """
+    return _revmap
+
+
+def record(job, new_tag, commit=None, revision=None):
+    """Record an imported tag, if a revision map is configured.
+    """
+    if _revmap is not None:
+        _revmap.record(job, new_tag, commit=commit, revision=revision)
+
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Look up which git commit an svn tag was imported as, '
+        'and the other way round.')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--commit', nargs=1, default=[''],
+                        help='imports of a git commit, may be abbreviated.')
+
+    parser.add_argument('--debug', action='store_true',
+                        help='extra debugging output')
+
+    parser.add_argument('--import-notes', action='store_true', default=False,
+                        help='rebuild the mapping from the refs/notes/svn '
+                        'git notes.')
+
+    parser.add_argument('--repo', nargs=1, required=True,
+                        help='path to repo')
+
+    parser.add_argument('--tag', nargs=1, default=[''],
+                        help='import of a git tag.')
+
+    parser.add_argument('--url', nargs=1, default=[''],
+                        help='imports of an svn url, url@revision for a '
+                        'single revision.')
+
+    options = parser.parse_args()
+    return options
+
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+def print_entries(entries):
+    for entry in entries:
+        print("{0:<40} {1} r{2} {3}".format(entry['tag'], entry['git_commit'],
+                                            entry['revision'], entry['url']))
+
+
+def main(options):
+    runner.configure(echo=options.debug)
+    revmap = RevisionMap(options.repo[0])
+    if options.import_notes:
+        print("Imported {0} entries from {1}".format(revmap.import_notes(),
+                                                     NOTES_REF))
+    entries = []
+    if options.tag[0]:
+        entry = revmap.by_tag(options.tag[0])
+        entries.extend([entry] if entry else [])
+    if options.url[0]:
+        url, _, revision = options.url[0].rpartition('@')
+        if not url or '/' in revision:
+            url, revision = options.url[0], None
+        entries.extend(revmap.by_url(url, revision or None))
+    if options.commit[0]:
+        entries.extend(revmap.by_commit(options.commit[0]))
+    print_entries(entries)
+    revmap.close()
+    if (options.tag[0] or options.url[0] or options.commit[0]) and \
+       not entries:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            import traceback
+            traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+"""Roll a component back to an earlier tag.
+
+Deletes the git tags of a tag file that come after a target tag (or
+all of them when rolling back to a root commit), resets the branch to
+the target and removes the branch's temporary segment and quarantine
+branches, in a single 'git update-ref --stdin' transaction. With
+--remote the same tags and branch are updated on the remote with a
+single atomic push. Worktrees are never touched, branches that are
+checked out are refused.
+
+    ./rollback.py --repo clm --tag-file clm-trunk-tags.json --to clm4_5_1_r120
+    ./rollback.py --repo ww3 --tag-file ww3-trunk-tags.json \\
+        --root 6ce7fc207a2cd152e --also-reset master --remote ncar
+
+Replaces reset_repo.sh and delete_gh_tags.sh.
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+from python_version import check_python_version
+
+check_python_version()
+
+#
+# built-in modules
+#
+import argparse
+import json
+import os
+import subprocess
+import traceback
+
+#
+# other modules in this package
+#
+import revmap
+import runner
+from cesm2git import (add_runner_options, configure_runner,
+                      git_check_branch_not_checked_out)
+from git_backend import close_git_sessions, get_git_session
+from quarantine import SIDE_BRANCH
+from segments import SEGMENT_BRANCH
+from tag_job import jobs_from_manifest
+
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Roll a component branch and its tags back to an '
+        'earlier tag or root commit.')
+
+    parser.add_argument('--also-reset', nargs='+', default=[],
+                        help='other branches to reset to the same commit, '
+                        'e.g. master.')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--debug', action='store_true',
+                        help='extra debugging output')
+
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='only print the refs that would change.')
+
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='reset branches even if the target is not an '
+                        'ancestor of the branch.')
+
+    parser.add_argument('--remote', nargs=1, default=[''],
+                        help='also delete the tags and reset the branches '
+                        'on the specified remote.')
+
+    parser.add_argument('--repo', nargs=1, required=True,
+                        help='path to repo')
+
+    parser.add_argument('--tag-file', nargs=1, required=True,
+                        help='tag file of the component, relative to repo')
+
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--root', nargs=1,
+                        help='remove every tag in the tag file and reset '
+                        'the branch to the specified commit.')
+
+    target.add_argument('--to', nargs=1,
+                        help='keep the specified tag, svn or git name, and '
+                        'the tags before it, remove the tags after it.')
+
+    add_runner_options(parser)
+
+    options = parser.parse_args()
+    return options
+
+
+# -------------------------------------------------------------------------------
+#
+# work functions
+#
+# -------------------------------------------------------------------------------
+def git_ref_values(repo_dir, patterns):
+    """Values of the refs matching the patterns as a dict of ref -> sha,
+    with a single call.
+
+    """
+    cmd = [
+        "git",
+        "-C", repo_dir,
+        "for-each-ref",
+        "--format=%(objectname) %(refname)",
+    ] + list(patterns)
+    output = runner.run(cmd)
+    values = {}
+    for line in output.decode('utf-8').splitlines():
+        sha, ref = line.split(' ', 1)
+        values[ref] = sha
+    return values
+
+
+def remote_ref_values(repo_dir, remote):
+    """Values of the remote's branches and tags as a dict of ref -> sha.
+    """
+    cmd = ["git", "-C", repo_dir, "ls-remote", "--heads", "--tags", remote]
+    output = runner.run(cmd)
+    values = {}
+    for line in output.decode('utf-8').splitlines():
+        sha, ref = line.split('\t', 1)
+        if not ref.endswith('^{}'):
+            values[ref] = sha
+    return values
+
+
+def git_commit_sha(repo_dir, rev):
+    output = runner.run(["git", "-C", repo_dir, "rev-parse", "--verify",
+                         "{0}^{{commit}}".format(rev)])
+    return output.decode('ascii').strip()
+
+
+def git_is_ancestor(repo_dir, ancestor, commit):
+    try:
+        runner.run(["git", "-C", repo_dir, "merge-base", "--is-ancestor",
+                    ancestor, commit], retries=0)
+    except subprocess.CalledProcessError:
+        return False
+    return True
+
+
+def rollback_plan(manifest, repo_dir, to_tag=None, root=None,
+                  also_reset=None, force=False):
+    """Refs to change to roll the tag file's branch back to to_tag, or to
+    the root commit. Returns a dict with the target commit, the refs of
+    the removed tags, the local tags and work branches to delete, the
+    branches to reset and the local ref updates as (ref, new, old)
+    tuples.
+
+    """
+    jobs = jobs_from_manifest(manifest)
+    branch = manifest['config']['branch']
+    git_tags = [job.git_tag for job in jobs]
+    if root is not None:
+        target = git_commit_sha(repo_dir, root)
+        removed = git_tags
+    else:
+        names = [(job.tag_name, job.git_tag) for job in jobs]
+        index = next((i for i, name in enumerate(names)
+                      if to_tag in name), None)
+        if index is None:
+            raise RuntimeError("ERROR: tag '{0}' is not in the tag file".format(
+                to_tag))
+        target = git_commit_sha(repo_dir, "refs/tags/{0}".format(
+            git_tags[index]))
+        removed = git_tags[index + 1:]
+
+    values = git_ref_values(repo_dir, ['refs/tags', 'refs/heads'])
+    updates = []
+    tags = []
+    removed = ["refs/tags/{0}".format(git_tag) for git_tag in removed]
+    for ref in removed:
+        if ref in values:
+            tags.append(ref)
+            updates.append((ref, None, values[ref]))
+
+    work_branches = []
+    segment_prefix = SEGMENT_BRANCH.format(branch, '')
+    for ref in sorted(values):
+        name = ref[len('refs/heads/'):]
+        if ref.startswith('refs/heads/') and \
+           (name == SIDE_BRANCH.format(branch) or
+            (name.startswith(segment_prefix) and
+             name[len(segment_prefix):].isdigit())):
+            work_branches.append(ref)
+            updates.append((ref, None, values[ref]))
+
+    branches = []
+    for name in [branch] + list(also_reset or []):
+        ref = "refs/heads/{0}".format(name)
+        if ref not in values:
+            raise RuntimeError("ERROR: branch '{0}' does not exist".format(
+                name))
+        if values[ref] == target:
+            continue
+        git_check_branch_not_checked_out(repo_dir, ref)
+        if not force and not git_is_ancestor(repo_dir, target, values[ref]):
+            raise RuntimeError("ERROR: {0} is not an ancestor of branch '{1}', "
+                               "use --force to reset it anyway".format(
+                                   target, name))
+        branches.append(ref)
+        updates.append((ref, target, values[ref]))
+
+    return {
+        'branch': branch,
+        'target': target,
+        'tags': tags,
+        'removed': removed,
+        'work_branches': work_branches,
+        'branches': branches,
+        'updates': updates,
+    }
+
+
+def print_rollback(plan):
+    print("Rollback of branch '{0}' to {1}".format(plan['branch'],
+                                                   plan['target']))
+    print("    {0} of {1} tags to delete".format(len(plan['tags']),
+                                                 len(plan['removed'])))
+    for ref in plan['tags']:
+        print("        {0}".format(ref))
+    for ref in plan['work_branches']:
+        print("    delete {0}".format(ref))
+    for ref in plan['branches']:
+        print("    reset  {0}".format(ref))
+
+
+def rollback_local(plan, repo_dir):
+    """Apply the plan to the repo in a single transaction, fails without
+    changing anything if any ref moved since the plan was made.
+
+    """
+    if plan['updates']:
+        get_git_session(repo_dir).update_refs(plan['updates'])
+
+
+def rollback_remote(plan, repo_dir, remote):
+    """Delete the tags and reset the branches on the remote with a single
+    atomic push. Branches are only reset if they still have the value
+    seen when the push starts.
+
+    """
+    values = remote_ref_values(repo_dir, remote)
+    cmd = ["git", "-C", repo_dir, "push", "--atomic", "--porcelain", remote]
+    refspecs = []
+    # tags that were only pushed are removed too
+    for ref in plan['removed'] + plan['work_branches']:
+        if ref in values:
+            refspecs.append(":{0}".format(ref))
+    for ref in plan['branches']:
+        if ref in values and values[ref] != plan['target']:
+            cmd.append("--force-with-lease={0}:{1}".format(ref, values[ref]))
+            refspecs.append("{0}:{1}".format(plan['target'], ref))
+    if not refspecs:
+        print("Nothing to change on remote '{0}'".format(remote))
+        return
+    print("Updating {0} refs on remote '{1}'".format(len(refspecs), remote))
+    runner.run(cmd + refspecs, capture=False, retries=0)
+
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+def main(options):
+    configure_runner(options)
+    repo_dir = os.path.abspath(options.repo[0])
+    tag_filename = os.path.join(repo_dir, options.tag_file[0])
+    with open(tag_filename, 'r') as tag_file:
+        manifest = json.load(tag_file)
+
+    plan = rollback_plan(manifest, repo_dir,
+                         to_tag=options.to[0] if options.to else None,
+                         root=options.root[0] if options.root else None,
+                         also_reset=options.also_reset, force=options.force)
+    print_rollback(plan)
+    if options.dry_run:
+        return 0
+    try:
+        rollback_local(plan, repo_dir)
+        revision_map = revmap.RevisionMap(repo_dir)
+        revision_map.forget(ref[len('refs/tags/'):]
+                            for ref in plan['removed'])
+        revision_map.close()
+        if options.remote[0]:
+            rollback_remote(plan, repo_dir, options.remote[0])
+    finally:
+        close_git_sessions()
+    return 0
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,390 @@
+"""Central runner for the svn and git subprocesses.
+
+All the wrapper functions in cesm2git.py go through a CommandRunner
+instead of calling subprocess directly. The runner:
+
+  * streams command output line by line to a log file (and optionally
+    the terminal) instead of buffering it all in memory. Output is only
+    kept in memory when the caller needs it, e.g. 'svn log --xml'.
+
+  * enforces a per-command timeout, so a hung svn connection can't
+    stall an unattended run forever.
+
+  * retries commands that fail with transient network errors, with
+    exponential backoff.
+
+  * records the wall time of every command and tells listeners, e.g.
+    the progress report, which command is running.
+
+  * can run independent commands concurrently.
+
+Failures are reported as subprocess.CalledProcessError, the same as
+subprocess.check_output, with the (tail of the) output attached.
+
+"""
+
+from __future__ import print_function
+
+import collections
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# default seconds before a command is considered hung
+DEFAULT_TIMEOUT = 3600
+
+# default number of retries for transient errors
+DEFAULT_RETRIES = 3
+
+# seconds to wait before the first retry, doubled for each retry
+DEFAULT_BACKOFF = 5.0
+
+# lines of output kept for error messages when output isn't captured
+ERROR_TAIL_LINES = 50
+
+# output from svn and git that indicates a network problem that is
+# worth retrying.
+TRANSIENT_ERRORS = re.compile(
+    r'E170013|E175002|E175012|E000104|E000110|E000111|E120108|E670008|'
+    r'Connection reset|Connection refused|Connection timed out|'
+    r'connection was closed|timed out|Could not resolve host|'
+    r'The remote end hung up unexpectedly|early EOF|'
+    r'Temporary failure in name resolution')
+
+# commands that may have taken effect when they time out, e.g. a push
+# that updated the remote refs before the connection hung, by
+# command_key. Their timeouts aren't retried.
+NOT_RETRIED_ON_TIMEOUT = frozenset([
+    'git commit', 'git commit-tree', 'git mktag', 'git push', 'git subtree',
+    'git tag', 'git update-ref',
+])
+
+# seconds to wait for the output of a command that exited or was
+# killed, a grandchild may still hold the output pipe open
+READER_GRACE = 5
+
+
+def command_key(cmd):
+    """Program and subcommand of a command line, e.g. 'svn export' or
+    'git commit' for 'git -C repo commit -m msg'.
+
+    """
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg in ('-C', '-c'):
+            # git options that take a value
+            next(args, None)
+        elif not arg.startswith('-'):
+            return "{0} {1}".format(cmd[0], arg)
+    return cmd[0]
+
+
+def _kill_group(process):
+    """Kill a command started in its own session and everything it
+    started.
+
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # already gone
+        pass
+    process.wait()
+
+
+class CommandTimeout(subprocess.CalledProcessError):
+    """Raised when a command didn't finish within its timeout.
+
+    """
+
+    def __str__(self):
+        return "Command '{0}' timed out".format(' '.join(self.cmd))
+
+
+class CommandRunner(object):
+    """Run external commands with logging, timeouts, retries and timing.
+
+    """
+
+    def __init__(self, log_filename=None, echo=False,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF):
+        self.echo = echo
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.timings = []
+        # objects with command_started(cmd) and command_finished(cmd)
+        # methods, e.g. progress.Progress
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._log_file = None
+        if log_filename:
+            self._log_file = open(log_filename, 'a')
+
+    def close(self):
+        """Close the log file.
+        """
+        if self._log_file:
+            self._log_file.close()
+            self._log_file = None
+
+    def _log(self, line, echo=None):
+        """Write a line of output to the log and terminal. Called from the
+        reader threads, so serialize the writes.
+
+        """
+        if echo is None:
+            echo = self.echo
+        with self._lock:
+            if self._log_file:
+                self._log_file.write(line)
+                self._log_file.flush()
+            if echo:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+    def _run_once(self, cmd, cwd, env, capture, timeout, stdin_data, echo):
+        """Run the command a single time, streaming output through the log.
+
+        Returns the return code and the output (the full output if
+        captured, otherwise the last few lines).
+
+        """
+        self._log("$ {0}\n".format(' '.join(cmd)))
+        stdin = None
+        if stdin_data is not None:
+            stdin = subprocess.PIPE
+        # a session of its own, so a timeout kills the command's children
+        # too, e.g. the ssh of svn+ssh or the sh running git subtree.
+        process = subprocess.Popen(cmd, shell=False, cwd=cwd, env=env,
+                                   stdin=stdin,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+        if capture:
+            lines = []
+        else:
+            lines = collections.deque(maxlen=ERROR_TAIL_LINES)
+
+        def _reader():
+            for line in iter(process.stdout.readline, b''):
+                lines.append(line)
+                self._log(line.decode('utf-8', 'replace'), echo)
+            process.stdout.close()
+
+        reader = threading.Thread(target=_reader)
+        reader.daemon = True
+        reader.start()
+
+        # the input is written by a thread of its own, a command that
+        # doesn't read it can't block the caller past the timeout
+        broken_pipe = []
+
+        def _writer():
+            try:
+                process.stdin.write(stdin_data)
+                process.stdin.close()
+            except (BrokenPipeError, ValueError):
+                # the command exited, or was killed, before reading all
+                # of its input. ValueError: the pipe was closed already.
+                broken_pipe.append(True)
+
+        writer = None
+        if stdin_data is not None:
+            writer = threading.Thread(target=_writer)
+            writer.daemon = True
+            writer.start()
+
+        timed_out = False
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            _kill_group(process)
+        except BaseException:
+            # e.g. ctrl-c, which doesn't reach the command's session
+            _kill_group(process)
+            raise
+        reader.join(READER_GRACE)
+        if reader.is_alive():
+            # a left over child holds the output open
+            _kill_group(process)
+            reader.join(READER_GRACE)
+        if writer is not None:
+            writer.join(READER_GRACE)
+
+        output = b''.join(lines)
+        if timed_out:
+            self._log("command timed out after {0} seconds\n".format(timeout))
+            return None, output
+        if broken_pipe:
+            self._log("command exited before reading all of its input\n")
+            # input that wasn't read is a failure even if the command
+            # exited successfully
+            return process.returncode or 1, output
+        return process.returncode, output
+
+    def run(self, cmd, cwd=None, env=None, capture=True, timeout=None,
+            retries=None, stdin_data=None, echo=None):
+        """Run a command, returning its output as bytes if capture is true.
+        If echo is true the output is also shown on the terminal as it
+        is produced.
+
+        Raises subprocess.CalledProcessError on failure, or
+        CommandTimeout if the command times out on every attempt.
+
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+
+        for listener in self.listeners:
+            listener.command_started(cmd)
+        try:
+            return self._run(cmd, cwd, env, capture, timeout, retries,
+                             stdin_data, echo)
+        finally:
+            for listener in self.listeners:
+                listener.command_finished(cmd)
+
+    def _run(self, cmd, cwd, env, capture, timeout, retries, stdin_data,
+             echo):
+        """Run a command with retries, see run.
+        """
+        start = time.time()
+        attempt = 0
+        while True:
+            returncode, output = self._run_once(cmd, cwd, env, capture,
+                                                timeout, stdin_data, echo)
+            if returncode == 0:
+                break
+            if returncode is None:
+                transient = command_key(cmd) not in NOT_RETRIED_ON_TIMEOUT
+            else:
+                transient = TRANSIENT_ERRORS.search(
+                    output.decode('utf-8', 'replace')) is not None
+            if not transient or attempt >= retries:
+                self._record(cmd, start, returncode, attempt + 1)
+                if returncode is None:
+                    raise CommandTimeout(-1, cmd, output=output)
+                raise subprocess.CalledProcessError(returncode, cmd,
+                                                    output=output)
+            delay = self.backoff * 2 ** attempt
+            attempt += 1
+            self._log("transient error, retry {0} of {1} in {2} "
+                      "seconds\n".format(attempt, retries, delay))
+            time.sleep(delay)
+
+        self._record(cmd, start, returncode, attempt + 1)
+        if capture:
+            return output
+        return b''
+
+    def _record(self, cmd, start, returncode, attempts):
+        """Keep the timing of a finished command.
+        """
+        with self._lock:
+            self.timings.append({
+                'cmd': cmd,
+                'seconds': time.time() - start,
+                'returncode': returncode,
+                'attempts': attempts,
+            })
+
+    def run_many(self, cmds, jobs=4, **kwargs):
+        """Run independent commands concurrently, returning their outputs
+        in the same order as cmds. The first failure is raised after
+        all the commands finish.
+
+        """
+        if not cmds:
+            return []
+        # multiprocessing is slow to import and most runs never get here
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(max(1, min(jobs, len(cmds))))
+        try:
+            results = pool.map(lambda c: self._run_catch(c, kwargs), cmds)
+        finally:
+            pool.close()
+            pool.join()
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def _run_catch(self, cmd, kwargs):
+        try:
+            return self.run(cmd, **kwargs)
+        except subprocess.CalledProcessError as error:
+            return error
+
+    def timing_summary(self):
+        """Total time and count per command, keyed by the program and
+        subcommand, e.g. 'svn export'.
+
+        """
+        summary = {}
+        with self._lock:
+            timings = list(self.timings)
+        for timing in timings:
+            key = command_key(timing['cmd'])
+            if key not in summary:
+                summary[key] = {'count': 0, 'seconds': 0.0, 'retries': 0}
+            summary[key]['count'] += 1
+            summary[key]['seconds'] += timing['seconds']
+            summary[key]['retries'] += timing['attempts'] - 1
+        return summary
+
+    def print_timing_summary(self):
+        """Print the time spent per command type, slowest first.
+        """
+        summary = self.timing_summary()
+        if not summary:
+            return
+        print("Subprocess timing:")
+        for key in sorted(summary, key=lambda k: -summary[k]['seconds']):
+            print("    {0:<20} {1:>6} calls {2:>10.1f} s {3:>4} "
+                  "retries".format(key, summary[key]['count'],
+                                   summary[key]['seconds'],
+                                   summary[key]['retries']))
+
+
+_runner = None
+
+
+def configure(**kwargs):
+    """Replace the process wide runner, see CommandRunner for options.
+    """
+    global _runner
+    if _runner is not None:
+        _runner.close()
+    _runner = CommandRunner(**kwargs)
+    return _runner
+
+
+def get_runner():
+    """Return the process wide runner, creating a default one if needed.
+    """
+    global _runner
+    if _runner is None:
+        _runner = CommandRunner()
+    return _runner
+
+
+def run(cmd, **kwargs):
+    """Run a command with the process wide runner.
+    """
+    return get_runner().run(cmd, **kwargs)
+
+
+def run_many(cmds, jobs=4, **kwargs):
+    """Run independent commands concurrently with the process wide runner.
+    """
+    return get_runner().run_many(cmds, jobs=jobs, **kwargs)
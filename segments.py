@@ -0,0 +1,252 @@
+"""Import a tag list as parallel history segments.
+
+Tags on a branch are imported one after the other because every tag's
+tree is built on the previous tag's tree. For a rebuild of a whole
+branch the tag list is instead split into contiguous segments that
+are imported in parallel processes with the git plumbing backend:
+
+  * segment 0 starts from the current branch head,
+
+  * every other segment first imports the tag before its range (the
+    seed) on top of the branch head, to get a stand-in for the tree the
+    previous segment will end with, and imports its range on top of
+    the seed.
+
+Each worker records its progress on a temporary branch
+(cesm2git-segment-<branch>-<n>). When all the workers finish the segments are
+stitched together in order: the commits are rewritten with the
+previous segment's last commit as parent, keeping the tree, author,
+committer, dates and message byte for byte. Then the tags are created
+and the branch is updated in a single transaction.
+
+The seed tree only differs from the real one when files that aren't
+removed by remove_current_working_copy were carried over from tags
+before the seed. That is detected by comparing the trees, and the
+segment is imported again sequentially on the stitched history, so
+the result is always the same as a sequential import.
+
+"""
+
+from __future__ import print_function
+
+import multiprocessing
+import os
+import shutil
+import time
+
+import git_backend
+import maintenance
+import profiling
+import progress
+import revmap
+import runner
+from cesm2git import (build_plumbing_commit, configure_runner,
+                      configure_staging, git_check_branch_not_checked_out,
+                      new_tag_from_job)
+from git_backend import NULL_SHA, close_git_sessions, get_git_session
+from plan import git_tag_names
+from report import RunReport
+
+# temporary branch of a segment, by branch and segment index
+SEGMENT_BRANCH = 'cesm2git-segment-{0}-{1}'
+
+
+def split_ranges(count, segments):
+    """Split count items into at most segments contiguous (start, end)
+    ranges of nearly equal size.
+
+    """
+    segments = max(1, min(segments, count))
+    ranges = []
+    start = 0
+    for index in range(segments):
+        end = start + (count - start) // (segments - index)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _init_worker(options):
+    """Setup the runner and export cache in a worker process, they aren't
+    inherited when processes are spawned instead of forked. Progress
+    is only reported by the main process.
+
+    """
+    progress.disable()
+    profiling.disable()
+    if options is not None:
+        configure_runner(options)
+        configure_staging(options)
+        git_backend.configure(write_packs=options.write_packs)
+
+
+def _import_range(repo_dir, jobs, parent, export_prefix, authors, debug,
+                  report):
+    """Import jobs one after the other on top of parent, returns the list
+    of (new_tag, commit, svn revision).
+
+    """
+    commits = []
+    for job in jobs:
+        new_tag = new_tag_from_job(job)
+        export_dir = "{0}-{1}".format(export_prefix, new_tag)
+        with report.tag(new_tag, branch=job.branch):
+            parent = build_plumbing_commit(job, new_tag, repo_dir, parent,
+                                           export_dir, authors=authors,
+                                           debug=debug)
+        shutil.rmtree(export_dir)
+        commits.append((new_tag, parent, job.svn_revision))
+    return commits
+
+
+def _import_segment(work):
+    """Worker process: import a single segment onto its temporary branch.
+
+    """
+    index, repo_dir, base, seed, jobs, export_prefix, authors, debug = work
+    start = time.time()
+    # forked workers inherit the timings recorded so far
+    timings_start = len(runner.get_runner().timings)
+    report = RunReport()
+    session = get_git_session(repo_dir)
+    try:
+        parent = base
+        if seed is not None:
+            seed_tag = new_tag_from_job(seed)
+            export_dir = "{0}-seed-{1}".format(export_prefix, seed_tag)
+            parent = build_plumbing_commit(seed, seed_tag, repo_dir, base,
+                                           export_dir, authors=authors,
+                                           debug=debug)
+            shutil.rmtree(export_dir)
+        seed_tree = session.rev_parse("{0}^{{tree}}".format(parent))
+        commits = _import_range(repo_dir, jobs, parent, export_prefix,
+                                authors, debug, report)
+        if commits:
+            session.update_refs([("refs/heads/{0}".format(
+                SEGMENT_BRANCH.format(jobs[0].branch, index)),
+                commits[-1][1], None)])
+    finally:
+        close_git_sessions()
+    return {
+        'index': index,
+        'seed_tree': seed_tree,
+        'commits': commits,
+        'seconds': time.time() - start,
+        'report': report.tags,
+        'timings': runner.get_runner().timings[timings_start:],
+    }
+
+
+def import_segments(jobs, repo, authors='author-map.json', segments=4,
+                    options=None, debug=False, push=True, report=None):
+    """Import the jobs, all for the same branch and in order, as parallel
+    segments and stitch them into a single linear history. Tags that
+    already exist in git are skipped. Returns the list of git tags
+    created.
+
+    """
+    if report is None:
+        report = RunReport()
+    cwd = os.getcwd()
+    repo_dir = os.path.abspath("{0}/{1}".format(cwd, repo))
+
+    branches = set(job.branch for job in jobs)
+    if len(branches) > 1:
+        raise RuntimeError("ERROR: segmented import of several branches: "
+                           "{0}".format(', '.join(sorted(branches))))
+    for job in jobs:
+        if job.checkout_externals:
+            raise RuntimeError("ERROR: tag '{0}' needs svn externals and can "
+                               "not be imported in segments".format(job.tag))
+    existing = git_tag_names(repo_dir)
+    todo = []
+    for job in jobs:
+        if job.git_tag in existing:
+            print("    git tag '{0}' already exists, skipping".format(
+                job.tag_name))
+        else:
+            todo.append(job)
+    progress.add_total(len(todo) - len(jobs))
+    if not todo:
+        return []
+
+    branch = todo[0].branch
+    branch_ref = "refs/heads/{0}".format(branch)
+    git_check_branch_not_checked_out(repo_dir, branch_ref)
+    output = runner.run(["git", "-C", repo_dir, "rev-parse", "--verify",
+                         "{0}^{{commit}}".format(branch_ref)])
+    base = output.decode('ascii').strip()
+
+    ranges = split_ranges(len(todo), segments)
+    work = []
+    for index, (start, end) in enumerate(ranges):
+        seed = todo[start - 1] if start > 0 else None
+        export_prefix = "{0}/{1}-segment-{2}".format(cwd, repo, index)
+        work.append((index, repo_dir, base, seed, todo[start:end],
+                     export_prefix, authors, debug))
+    print("Importing {0} tags on branch '{1}' in {2} segments".format(
+        len(todo), branch, len(work)))
+
+    pool = multiprocessing.Pool(len(work), initializer=_init_worker,
+                                initargs=(options, ))
+    try:
+        results = pool.map(_import_segment, work)
+    finally:
+        pool.close()
+        pool.join()
+
+    command_runner = runner.get_runner()
+    session = get_git_session(repo_dir)
+    parent = base
+    created = []
+    imported = []
+    updates = []
+    deletions = []
+    for result, (start, end) in zip(sorted(results,
+                                           key=lambda r: r['index']),
+                                    ranges):
+        index = result['index']
+        command_runner.timings.extend(result['timings'])
+        print("    segment {0}: {1} tags in {2:.1f} s".format(
+            index, len(result['commits']), result['seconds']))
+        parent_tree = session.rev_parse("{0}^{{tree}}".format(parent))
+        if result['seed_tree'] == parent_tree:
+            report.tags.extend(result['report'])
+            progress.tags_done(len(result['commits']), result['seconds'])
+            commits = []
+            for new_tag, commit, revision in result['commits']:
+                if index > 0:
+                    commit = session.reparent_commit(commit, [parent])
+                commits.append((new_tag, commit, revision))
+                parent = commit
+        else:
+            print("    segment {0}: seed tree differs from the previous "
+                  "segment, importing it again".format(index))
+            export_prefix = "{0}/{1}-segment-{2}-retry".format(cwd, repo,
+                                                               index)
+            commits = _import_range(repo_dir, todo[start:end], parent,
+                                    export_prefix, authors, debug, report)
+            parent = commits[-1][1]
+
+        for new_tag, commit, revision in commits:
+            imported.append((new_tag, commit, revision))
+            tag = session.make_tag(new_tag, commit,
+                                   "tag {0} from svn".format(new_tag))
+            updates.append(("refs/tags/{0}".format(new_tag), tag, NULL_SHA))
+            created.append(new_tag)
+        deletions.append(("refs/heads/{0}".format(
+            SEGMENT_BRANCH.format(branch, index)), None, None))
+
+    print("    {0} {1} : {2}".format(branch, created[-1], parent))
+    if push:
+        updates.append((branch_ref, parent, base))
+        session.update_refs(updates + deletions)
+        jobs_by_tag = dict((new_tag_from_job(job), job) for job in todo)
+        for new_tag, commit, revision in imported:
+            revmap.record(jobs_by_tag[new_tag], new_tag, commit=commit,
+                          revision=revision)
+        maintenance.after_tag(len(created))
+    else:
+        # the temporary branches are removed without push as well
+        session.update_refs(deletions)
+    return created
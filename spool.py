@@ -0,0 +1,184 @@
+"""Memory bounded buffers for file contents passing through the import.
+
+File contents that have to be held while they are processed, e.g. the
+source and result of applying an svn delta, are written to a
+SpooledBuffer. Buffers stay in memory while the process wide memory
+budget allows and spill to a staging file otherwise. Spilled buffers
+are read back through mmap, so the memory used for large files is
+page cache that the kernel can reclaim rather than process memory.
+
+The budget is shared by every buffer in the process, so the memory
+used for contents is bounded by the budget regardless of how large a
+tag or a single file is.
+
+"""
+
+from __future__ import print_function
+
+import mmap
+import os
+import tempfile
+import threading
+
+# default bytes of file contents held in memory at once
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# size of the chunks used when copying contents
+CHUNK_SIZE = 1 << 20
+
+
+class MemoryBudget(object):
+    """Bytes of buffer memory that may be in use at once.
+    """
+
+    def __init__(self, limit=DEFAULT_MEMORY_LIMIT, staging_dir=None):
+        self.limit = limit
+        self.staging_dir = staging_dir
+        self.in_use = 0
+        self.peak = 0
+        self.spilled_bytes = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """Try to reserve size bytes, returns False if over budget.
+        """
+        with self._lock:
+            if self.in_use + size > self.limit:
+                return False
+            self.in_use += size
+            self.peak = max(self.peak, self.in_use)
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.in_use -= size
+
+    def record_spill(self, size):
+        with self._lock:
+            self.spilled_bytes += size
+
+
+_budget = None
+
+
+def configure(limit=DEFAULT_MEMORY_LIMIT, staging_dir=None):
+    """Replace the process wide memory budget.
+    """
+    global _budget
+    if staging_dir and not os.path.isdir(staging_dir):
+        os.makedirs(staging_dir)
+    _budget = MemoryBudget(limit, staging_dir)
+    return _budget
+
+
+def get_budget():
+    """Return the process wide memory budget, creating the default one if
+    needed.
+
+    """
+    global _budget
+    if _budget is None:
+        _budget = MemoryBudget()
+    return _budget
+
+
+class SpooledBuffer(object):
+    """Write-once buffer that is kept in memory while the budget allows
+    and spilled to a memory mapped staging file otherwise.
+
+    """
+
+    def __init__(self, budget=None):
+        self._budget = budget or get_budget()
+        self._data = bytearray()
+        self._reserved = 0
+        self._file = None
+        self._filename = None
+        self._mmap = None
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    def write(self, data):
+        """Append data to the buffer.
+        """
+        if self._mmap is not None:
+            raise RuntimeError("Can not write to a buffer after reading it")
+        if self._file is None:
+            if self._budget.reserve(len(data)):
+                self._reserved += len(data)
+                self._data.extend(data)
+                self.size += len(data)
+                return
+            self._spill()
+        self._file.write(data)
+        self.size += len(data)
+        self._budget.record_spill(len(data))
+
+    def _spill(self):
+        """Move the contents to a staging file and give the memory back.
+        """
+        handle, self._filename = tempfile.mkstemp(
+            prefix='cesm2git-spool-', dir=self._budget.staging_dir)
+        self._file = os.fdopen(handle, 'w+b')
+        self._file.write(self._data)
+        self._budget.record_spill(len(self._data))
+        self._data = bytearray()
+        self._budget.release(self._reserved)
+        self._reserved = 0
+
+    def copy_from(self, stream, length):
+        """Copy length bytes from a stream into the buffer in chunks.
+        """
+        remaining = length
+        while remaining:
+            chunk = stream.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise EOFError("Unexpected end of stream")
+            self.write(chunk)
+            remaining -= len(chunk)
+
+    def view(self):
+        """Read only, sliceable view of the contents.
+        """
+        if self._file is None:
+            return memoryview(self._data)
+        if self.size == 0:
+            return memoryview(b'')
+        if self._mmap is None:
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def filename(self):
+        """Name of a file with the contents, e.g. for hash-object. In memory
+        buffers are written to a staging file first.
+
+        """
+        if self._file is None:
+            self._spill()
+        self._file.flush()
+        return self._filename
+
+    def close(self):
+        """Release the memory or staging file.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._filename)
+            self._file = None
+        self._budget.release(self._reserved)
+        self._reserved = 0
+        self._data = bytearray()
@@ -0,0 +1,307 @@
+"""Export cache and link based staging of svn exports.
+
+Without a cache every import exports the tag from svn into the
+working copy, and importing the same tag again (a retry, a rerun
+after a reset, a second branch) exports it again. With a cache the
+exports are written once to the cache directory, keyed by url and
+the revision the url was last changed in, and are materialized into
+the working copy with links instead of copies:
+
+    reflink    copy on write clone of the file data (btrfs, xfs,
+               ...), the working copy and cache can't affect each
+               other.
+
+    hardlink   the working copy file is the cache file. Cache files
+               are made read only, so code that would modify an
+               exported file in place fails instead of corrupting
+               the cache, break_link() gives the working copy its own
+               copy first.
+
+    copy       plain copy, used when links aren't possible, e.g. the
+               cache and working copy are on different file systems.
+
+'auto' uses the first of these that works, so materializing a large
+tree is a metadata only operation when the file system allows it.
+
+Cache entries are never invalidated, the key includes the last
+changed revision, so a tag that is modified in svn is exported again.
+Remove the cache directory to reclaim the space.
+
+"""
+
+from __future__ import print_function
+
+import errno
+import fcntl
+import os
+import shutil
+import stat
+import xml.etree.ElementTree as etree
+
+import runner
+
+# ioctl request number of FICLONE from linux/fs.h
+FICLONE = 0x40049409
+
+LINK_MODES = ['auto', 'reflink', 'hardlink', 'copy']
+
+# errors that mean a link type isn't supported between two paths
+_UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY,
+                errno.EPERM, errno.EMLINK)
+
+_WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def reflink(src, dst):
+    """Clone the data of src into a new file dst.
+    """
+    with open(src, 'rb') as src_file:
+        with open(dst, 'wb') as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            except (IOError, OSError):
+                dst_file.close()
+                os.remove(dst)
+                raise
+    shutil.copymode(src, dst)
+
+
+def break_link(path):
+    """Replace a hard linked file with a private, writable copy so it can
+    be modified in place without changing the export cache.
+
+    """
+    info = os.lstat(path)
+    if not stat.S_ISREG(info.st_mode):
+        return
+    if info.st_nlink > 1:
+        tmp_path = "{0}.cesm2git-tmp".format(path)
+        shutil.copy2(path, tmp_path)
+        os.rename(tmp_path, path)
+    os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) | stat.S_IWUSR)
+
+
+def svn_last_changed_revisions(urls):
+    """Revision each url was last changed in, with one svn info call.
+    """
+    cmd = ["svn", "info", "--xml"] + list(urls)
+    output = runner.run(cmd)
+    revisions = []
+    for entry in etree.fromstring(output).findall('entry'):
+        revisions.append(entry.find('commit').get('revision'))
+    if len(revisions) != len(urls):
+        raise RuntimeError("svn info returned {0} entries for {1} "
+                           "urls".format(len(revisions), len(urls)))
+    return revisions
+
+
+class ExportCache(object):
+    """svn exports stored under cache_dir and linked into working copies.
+
+    """
+
+    def __init__(self, cache_dir, mode='auto', jobs=4):
+        if mode not in LINK_MODES:
+            raise RuntimeError("Unknown link mode '{0}', expected one of "
+                               "{1}".format(mode, ', '.join(LINK_MODES)))
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.mode = mode
+        self.jobs = jobs
+        self._resolved_mode = None if mode == 'auto' else mode
+        _makedirs(self.cache_dir)
+
+    def _entry_path(self, url, revision, options):
+        import hashlib
+
+        key = "{0}@{1}\0{2}".format(url, revision, ' '.join(options))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def export_many(self, urls, options=None):
+        """Export the urls into the cache, returns the cache path of each.
+        Only urls that aren't cached yet are exported, concurrently.
+
+        """
+        import tempfile
+
+        options = list(options or [])
+        revisions = svn_last_changed_revisions(urls)
+        paths = []
+        cmds = []
+        pending = []
+        for url, revision in zip(urls, revisions):
+            path = self._entry_path(url, revision, options)
+            paths.append(path)
+            if os.path.lexists(path) or paths.count(path) > 1:
+                continue
+            _makedirs(os.path.dirname(path))
+            # export next to the entry and rename it into place, so an
+            # interrupted export is never mistaken for a cached one.
+            tmp_dir = tempfile.mkdtemp(prefix='export-',
+                                       dir=os.path.dirname(path))
+            tmp_path = os.path.join(tmp_dir, 'export')
+            cmds.append(["svn", "export"] + options +
+                        ["{0}@{1}".format(url, revision), tmp_path])
+            pending.append((path, tmp_dir))
+        try:
+            runner.run_many(cmds, jobs=self.jobs, capture=False)
+            for path, tmp_dir in pending:
+                tmp_path = os.path.join(tmp_dir, 'export')
+                self._protect(tmp_path)
+                try:
+                    os.rename(tmp_path, path)
+                except OSError:
+                    if not os.path.lexists(path):
+                        raise
+                    # another import cached the same export first, use
+                    # its copy and drop this one with the temp dir
+        finally:
+            for _, tmp_dir in pending:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return paths
+
+    def export(self, url, options=None):
+        return self.export_many([url], options)[0]
+
+    def cached_paths(self, urls, options=None):
+        """Cache paths of the current exports of the urls, None for urls
+        that aren't cached. Nothing is exported.
+
+        """
+        options = list(options or [])
+        revisions = svn_last_changed_revisions(urls)
+        paths = []
+        for url, revision in zip(urls, revisions):
+            path = self._entry_path(url, revision, options)
+            paths.append(path if os.path.lexists(path) else None)
+        return paths
+
+    @staticmethod
+    def _protect(path):
+        """Make the cached files read only, see break_link.
+        """
+        if os.path.isfile(path) and not os.path.islink(path):
+            os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~_WRITE_BITS)
+            return
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                filename = os.path.join(dirpath, name)
+                if not os.path.islink(filename):
+                    mode = stat.S_IMODE(os.lstat(filename).st_mode)
+                    os.chmod(filename, mode & ~_WRITE_BITS)
+
+    # ---------------------------------------------------------------
+    # materializing
+    # ---------------------------------------------------------------
+    def materialize(self, src, dst):
+        """Recreate the cached file or directory src at dst, replacing
+        existing files like 'svn export --force'. Returns the number of
+        files linked or copied.
+
+        """
+        if not os.path.isdir(src) or os.path.islink(src):
+            self._place(src, dst)
+            return 1
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(src):
+            rel = os.path.relpath(dirpath, src)
+            target_dir = os.path.normpath(os.path.join(dst, rel))
+            if os.path.lexists(target_dir) and \
+               not os.path.isdir(target_dir):
+                os.remove(target_dir)
+            _makedirs(target_dir)
+            for name in dirnames[:]:
+                if os.path.islink(os.path.join(dirpath, name)):
+                    # os.walk doesn't descend into links to directories
+                    filenames.append(name)
+            for name in filenames:
+                self._place(os.path.join(dirpath, name),
+                            os.path.join(target_dir, name))
+                count += 1
+        return count
+
+    def _place(self, src, dst):
+        if os.path.lexists(dst):
+            _remove(dst)
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            return
+        if self._resolved_mode is None:
+            for mode in LINK_MODES[1:]:
+                if self._try_place(mode, src, dst):
+                    self._resolved_mode = mode
+                    print("    staging exports with {0}s".format(mode))
+                    return
+        if not self._try_place(self._resolved_mode, src, dst):
+            if self.mode != 'auto':
+                raise RuntimeError("Can not {0} '{1}' to '{2}'".format(
+                    self.mode, src, dst))
+            self._resolved_mode = 'copy'
+            self._try_place('copy', src, dst)
+
+    def _try_place(self, mode, src, dst):
+        """Place src at dst with the link mode, returns False if the mode
+        isn't supported between the two paths.
+
+        """
+        try:
+            if mode == 'hardlink':
+                os.link(src, dst)
+                return True
+            if mode == 'reflink':
+                reflink(src, dst)
+            else:
+                shutil.copy2(src, dst)
+            # private data, so the cache's read only protection isn't
+            # needed.
+            os.chmod(dst, stat.S_IMODE(os.stat(dst).st_mode) | stat.S_IWUSR)
+        except (IOError, OSError) as error:
+            if mode == 'copy' or error.errno not in _UNSUPPORTED:
+                raise
+            return False
+        return True
+
+
+_cache = None
+_sparse_fetch = False
+
+
+def configure(cache_dir=None, mode='auto', jobs=4, sparse_fetch=False):
+    """Setup the process wide export cache, no cache_dir disables it.
+    sparse_fetch selects the sparse working copy fetch for tags that
+    don't need the whole tag, see cesm2git.svn_sparse_fetch.
+
+    """
+    global _cache, _sparse_fetch
+    _cache = None
+    if cache_dir:
+        _cache = ExportCache(cache_dir, mode=mode, jobs=jobs)
+    _sparse_fetch = sparse_fetch
+    return _cache
+
+
+def get_cache():
+    """The process wide export cache, or None if exports aren't cached.
+    """
+    return _cache
+
+
+def sparse_fetch_enabled():
+    """True if tags are fetched with a sparse working copy.
+    """
+    return _sparse_fetch
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Measure the start up time of the cesm2git.py entry point.
+
+Every tag imported by a subprocess-per-tag driver pays for starting
+the interpreter and importing cesm2git and the modules it imports,
+before any svn or git command runs. startup-benchmark.py runs
+
+    python cesm2git.py --help
+
+--runs times and prints the fastest and median wall time, next to a
+bare interpreter start for reference, then the modules with the
+largest cumulative import time from 'python -X importtime':
+
+    ./startup-benchmark.py --runs 50 --top 15
+
+Modules that only some tags need (configparser, xml.dom.minidom,
+sqlite3, cProfile, multiprocessing, ...) are imported by the functions
+that use them, a module showing up here that the command line doesn't
+need is a candidate for the same treatment.
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+from python_version import check_python_version
+
+check_python_version()
+
+#
+# built-in modules
+#
+import argparse
+import os
+import subprocess
+import time
+import traceback
+
+# default number of timed runs of each command
+DEFAULT_RUNS = 20
+
+# default number of modules listed by import time
+DEFAULT_TOP = 10
+
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Measure the start up time of cesm2git.py.')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--python', nargs=1, default=[sys.executable],
+                        help='python interpreter to measure.')
+
+    parser.add_argument('--runs', nargs=1, type=int, default=[DEFAULT_RUNS],
+                        help='number of timed runs of each command.')
+
+    parser.add_argument('--top', nargs=1, type=int, default=[DEFAULT_TOP],
+                        help='number of modules listed by import time.')
+
+    options = parser.parse_args()
+    return options
+
+
+# -------------------------------------------------------------------------------
+#
+# work functions
+#
+# -------------------------------------------------------------------------------
+def time_command(cmd, runs):
+    """Wall times in seconds of runs of a command, after one untimed run
+    that compiles the modules and warms the file system cache.
+
+    """
+    subprocess.check_call(cmd, stdout=subprocess.DEVNULL)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call(cmd, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return sorted(times)
+
+
+def import_times(python, module, runs):
+    """Dict of module -> fastest cumulative import time in microseconds
+    of every module imported by importing module, from runs of 'python
+    -X importtime'.
+
+    """
+    fastest = {}
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [python, "-X", "importtime", "-c", "import {0}".format(module)],
+            stderr=subprocess.STDOUT)
+        for line in output.decode('utf-8').splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            fields = line[len('import time:'):].split('|')
+            try:
+                microseconds = int(fields[1])
+            except ValueError:
+                # the header line
+                continue
+            name = fields[2].strip()
+            fastest[name] = min(fastest.get(name, microseconds),
+                                microseconds)
+    return fastest
+
+
+def print_times(name, times):
+    print("    {0:<30} {1:>8.1f} ms min {2:>8.1f} ms median".format(
+        name, 1000 * times[0], 1000 * times[len(times) // 2]))
+
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+def main(options):
+    python = options.python[0]
+    runs = max(1, options.runs[0])
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'cesm2git.py')
+    print("Start up time of {0} runs:".format(runs))
+    print_times("python -c pass", time_command([python, "-c", "pass"], runs))
+    print_times("cesm2git.py --help",
+                time_command([python, script, "--help"], runs))
+
+    os.chdir(os.path.dirname(script))
+    fastest = import_times(python, 'cesm2git', runs)
+    print("Slowest imports, cumulative:")
+    for module in sorted(fastest, key=lambda m: -fastest[m])[
+            :options.top[0]]:
+        print("    {0:<30} {1:>8.1f} ms".format(module,
+                                               fastest[module] / 1000.0))
+    return 0
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            traceback.print_exc()
+        sys.exit(1)
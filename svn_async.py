@@ -0,0 +1,350 @@
+"""Concurrent svn metadata queries with asyncio.
+
+The importer asks svn for metadata one tag at a time: 'svn log' for
+the commit author, date and message, 'svn list' of the tag root for
+the shifted root files, 'svn diff --summarize' against the previous
+tag for the changed paths, existence checks. Each is a full round trip
+to the server, paid once per tag. SvnMetadataClient runs many of
+these queries at once instead, at most 'concurrency' svn processes at
+a time, and parses the XML incrementally as it arrives, so collecting
+the metadata of a whole tag file takes about one round trip per
+concurrency tags:
+
+    client = SvnMetadataClient(concurrency=8)
+    logs = await asyncio.gather(*[client.log(job.url) for job in jobs])
+
+The coroutines are list(), info() and log(), the same entries as
+cesm2git.svn_list_xml and 'svn info'/'svn log --xml' as dicts, and
+output() for the raw output of any svn command. Commands are timed,
+retried on transient errors and reported to the runner listeners like
+commands run through runner.py, failures raise
+subprocess.CalledProcessError.
+
+prefetch_metadata(jobs) is the bulk entry point of the tag loop: it
+runs the metadata commands of every job up front and hands the
+outputs to cesm2git (seed_svn_metadata), which uses them instead of
+running the commands again when the tag is imported.
+
+"""
+
+from __future__ import print_function
+
+import asyncio
+import os
+import signal
+import subprocess
+import time
+import xml.etree.ElementTree as etree
+
+import runner
+from cesm2git import (seed_svn_metadata, svn_diff_summary_command,
+                      svn_list_root_command, svn_log_command)
+
+# default number of svn processes running at once
+DEFAULT_CONCURRENCY = 8
+
+# bytes read from a command's output at a time
+_READ_SIZE = 64 * 1024
+
+# 'svn info' of a path that doesn't exist
+_MISSING = ('W170000', 'E170000', 'E200009')
+
+
+def _list_entry(element):
+    size = element.find('size')
+    commit = element.find('commit')
+    return {
+        'kind': element.get('kind'),
+        'name': element.find('name').text,
+        'size': int(size.text) if size is not None else 0,
+        # revision the entry was last changed in, e.g. a tag was copied
+        'revision': int(commit.get('revision')) if commit is not None
+        else None,
+    }
+
+
+def _info_entry(element):
+    commit = element.find('commit')
+    url = element.find('url').text
+    relative_url = element.findtext('relative-url')
+    if relative_url is None:
+        # svn < 1.8
+        root = element.findtext('repository/root') or ''
+        relative_url = '^' + url[len(root):]
+    return {
+        'kind': element.get('kind'),
+        'url': url,
+        # url relative to the repository root, '^/path', url quoted
+        'relative_url': relative_url,
+        'revision': int(element.get('revision')),
+        'last_changed_rev': int(commit.get('revision')),
+    }
+
+
+def _log_entry(element):
+    entry = {
+        'revision': int(element.get('revision')),
+        'author': element.findtext('author'),
+        'date': element.findtext('date'),
+        'msg': element.findtext('msg'),
+    }
+    paths = element.find('paths')
+    if paths is not None:
+        # svn log --verbose
+        entry['paths'] = []
+        for path in paths.findall('path'):
+            copyfrom_rev = path.get('copyfrom-rev')
+            entry['paths'].append({
+                'path': path.text,
+                'action': path.get('action'),
+                'kind': path.get('kind'),
+                'copyfrom_path': path.get('copyfrom-path'),
+                'copyfrom_rev': int(copyfrom_rev) if copyfrom_rev else None,
+            })
+    return entry
+
+
+class _ElementCollector(object):
+    """Incremental parser that converts every finished element with the
+    tag name, e.g. each 'entry' of 'svn list --xml', and drops it.
+
+    """
+
+    def __init__(self, tag, convert):
+        self.tag = tag
+        self.convert = convert
+        self.items = []
+        self._parser = etree.XMLPullParser(events=('end', ))
+
+    def feed(self, data):
+        self._parser.feed(data)
+        self._collect()
+
+    def close(self):
+        self._parser.close()
+        self._collect()
+        return self.items
+
+    def _collect(self):
+        for _, element in self._parser.read_events():
+            if element.tag == self.tag:
+                self.items.append(self.convert(element))
+                element.clear()
+
+
+class SvnMetadataClient(object):
+    """Runs svn metadata queries concurrently, at most concurrency at a
+    time. Must be created and used in the same event loop.
+
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, command_runner=None):
+        if command_runner is None:
+            command_runner = runner.get_runner()
+        self.runner = command_runner
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run_once(self, cmd, collector):
+        self.runner._log("$ {0}\n".format(' '.join(cmd)))
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            start_new_session=True)
+        chunks = []
+
+        async def _read():
+            while True:
+                data = await process.stdout.read(_READ_SIZE)
+                if not data:
+                    break
+                chunks.append(data)
+                if collector is not None:
+                    collector.feed(data)
+
+        try:
+            _, error = await asyncio.wait_for(
+                asyncio.gather(_read(), process.stderr.read()),
+                self.runner.timeout)
+        except asyncio.TimeoutError:
+            # the whole session, see runner.CommandRunner._run_once
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            await process.wait()
+            return None, b''.join(chunks)
+        returncode = await process.wait()
+        if returncode != 0:
+            self.runner._log(error.decode('utf-8', 'replace'))
+            return returncode, b''.join(chunks) + error
+        return returncode, b''.join(chunks)
+
+    async def output(self, cmd, tag=None, convert=None):
+        """Output of a command as bytes, or the converted elements with
+        the tag name if a tag is given. Retried on transient errors like
+        runner.run.
+
+        """
+        async with self._semaphore:
+            for listener in self.runner.listeners:
+                listener.command_started(cmd)
+            try:
+                return await self._run(cmd, tag, convert)
+            finally:
+                for listener in self.runner.listeners:
+                    listener.command_finished(cmd)
+
+    async def _run(self, cmd, tag, convert):
+        start = time.time()
+        attempt = 0
+        while True:
+            collector = None
+            if tag is not None:
+                collector = _ElementCollector(tag, convert)
+            returncode, output = await self._run_once(cmd, collector)
+            if returncode == 0:
+                break
+            transient = returncode is None or runner.TRANSIENT_ERRORS.search(
+                output.decode('utf-8', 'replace')) is not None
+            if not transient or attempt >= self.runner.retries:
+                self.runner._record(cmd, start, returncode, attempt + 1)
+                if returncode is None:
+                    raise runner.CommandTimeout(-1, cmd, output=output)
+                raise subprocess.CalledProcessError(returncode, cmd,
+                                                    output=output)
+            delay = self.runner.backoff * 2 ** attempt
+            attempt += 1
+            self.runner._log("transient error, retry {0} of {1} in {2} "
+                             "seconds\n".format(attempt, self.runner.retries,
+                                                delay))
+            await asyncio.sleep(delay)
+
+        self.runner._record(cmd, start, returncode, attempt + 1)
+        if collector is not None:
+            return collector.close()
+        return output
+
+    async def list(self, url, recursive=False):
+        """Entries of an svn url like cesm2git.svn_list_xml.
+        """
+        cmd = ["svn", "list", "--xml"]
+        if recursive:
+            cmd.append("--recursive")
+        cmd.append(url)
+        return await self.output(cmd, 'entry', _list_entry)
+
+    async def info(self, url):
+        """Kind, url, relative url, revision and last changed revision of
+        an svn url, or None if it doesn't exist.
+
+        """
+        try:
+            entries = await self.output(["svn", "info", "--xml", url],
+                                        'entry', _info_entry)
+        except subprocess.CalledProcessError as error:
+            if any(code.encode('ascii') in (error.output or b'')
+                   for code in _MISSING):
+                return None
+            raise
+        return entries[0] if entries else None
+
+    async def log(self, url, limit=1, verbose=False):
+        """The last limit log entries of an svn url, or all of them if
+        limit is None, as dicts with the revision, author, date and msg.
+        With verbose the changed paths are included as 'paths', with
+        their action and where they were copied from.
+
+        """
+        cmd = ["svn", "log", "--xml"]
+        if limit is not None:
+            cmd.extend(["--limit", str(limit)])
+        if verbose:
+            cmd.append("--verbose")
+        cmd.append(url)
+        return await self.output(cmd, 'logentry', _log_entry)
+
+
+def run_coroutine(coroutine):
+    """Run a coroutine to completion in a new event loop, for the callers
+    that aren't asynchronous themselves.
+
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def _gather(factory, items, concurrency):
+    """Results of factory(client, item) for every item, exceptions are
+    returned in place of the result.
+
+    """
+    client = SvnMetadataClient(concurrency=concurrency)
+    return await asyncio.gather(*[factory(client, item) for item in items],
+                                return_exceptions=True)
+
+
+def list_many(urls, recursive=False, concurrency=DEFAULT_CONCURRENCY):
+    """svn list of every url, in the same order. The first failure is
+    raised after all the queries finish.
+
+    """
+    results = run_coroutine(_gather(
+        lambda client, url: client.list(url, recursive=recursive), urls,
+        concurrency))
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+def existing_urls(urls, concurrency=DEFAULT_CONCURRENCY):
+    """Dict of url -> True if it exists in svn.
+    """
+    results = run_coroutine(_gather(lambda client, url: client.info(url),
+                                    urls, concurrency))
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return dict((url, result is not None)
+                for url, result in zip(urls, results))
+
+
+def _job_commands(job):
+    """The metadata commands importing a job runs, see cesm2git.
+    """
+    cmds = [svn_log_command(job)]
+    if job.shift_root_files:
+        cmds.append(svn_list_root_command(job))
+    diff_cmd = svn_diff_summary_command(job)
+    if diff_cmd is not None:
+        cmds.append(diff_cmd)
+    return cmds
+
+
+def prefetch_metadata(jobs, concurrency=DEFAULT_CONCURRENCY):
+    """Run the metadata commands of every job concurrently and seed their
+    outputs for the imports. Jobs whose commands fail are left to the
+    import, which fails for them the usual way. Returns the list of
+    jobs that failed.
+
+    """
+    start = time.time()
+    work = [(job, cmd) for job in jobs for cmd in _job_commands(job)]
+    if not work:
+        return []
+    results = run_coroutine(_gather(lambda client, item: client.output(
+        item[1]), work, concurrency))
+    failed = []
+    for (job, cmd), result in zip(work, results):
+        if isinstance(result, Exception):
+            if job not in failed:
+                failed.append(job)
+            continue
+        seed_svn_metadata(cmd, result)
+    print("Prefetched svn metadata of {0} tags with {1} queries in {2:.1f} "
+          "s".format(len(jobs), len(work), time.time() - start))
+    for job in failed:
+        print("WARNING: svn metadata query failed for '{0}'".format(job.tag))
+    return failed
@@ -0,0 +1,714 @@
+"""Import svn tags from an svn dump stream instead of the svn client.
+
+One sequential pass over the output of 'svnadmin dump' or
+'svnrdump dump' for the relevant part of the repository, e.g.
+
+    svnrdump dump https://svn-ccsm-models.cgd.ucar.edu/clm2 | \\
+        ./tag-loop.py --repo . --tag-file clm-trunk-tags.json \\
+            --svn-dump - --svn-dump-prefix clm2
+
+reconstructs the tree of every revision as it streams, writing file
+contents into git as blobs with the git plumbing session from
+git_backend.py. Revision trees share all unchanged directories, so
+copies from any earlier revision (how svn tags are created) are cheap.
+When the stream ends, the final state of each tag in the tag files is
+turned into a git tree with the same processing as the svn client
+path (collapsing the standalone directory, shifting root files,
+generating externals descriptions) and committed onto its branch with
+the author, date and message of the last revision that touched the
+tag. All branch and tag refs are updated in one transaction.
+
+Both full text and delta (svndiff0 and svndiff1) dumps are supported.
+Tags that need svn externals checked out can not be imported from a
+dump and are reported as errors.
+
+NOTE: content is imported exactly as stored in the repository, the
+same as 'svn export --ignore-keywords'. svn:eol-style other than
+native is not applied.
+
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+
+from authors import get_author_resolver
+from cesm2git import (generate_externals_description, is_shifted_root_entry,
+                      new_tag_from_job, removed_root_entries)
+from git_backend import (MODE_EXECUTABLE, MODE_FILE, MODE_SYMLINK,
+                         MODE_TREE, NULL_SHA, get_git_session)
+import maintenance
+import progress
+import revmap
+from report import RunReport
+from spool import SpooledBuffer
+
+
+class SvnDumpError(RuntimeError):
+    """Malformed or unsupported dump stream.
+    """
+    pass
+
+
+# -------------------------------------------------------------------------------
+#
+# in memory revision trees
+#
+# -------------------------------------------------------------------------------
+class _Dir(object):
+    """Directory node. Nodes are shared between revisions and are only
+    modified in place during the revision that created them.
+
+    """
+    __slots__ = ('entries', 'rev', 'git_sha')
+
+    def __init__(self, rev, entries=None):
+        self.entries = dict(entries or {})
+        self.rev = rev
+        self.git_sha = None
+
+
+class _File(object):
+    """File node, content is a git blob of the raw svn text.
+    """
+    __slots__ = ('sha', 'props', 'git_entry')
+
+    def __init__(self, sha, props):
+        self.sha = sha
+        self.props = props
+        self.git_entry = None
+
+
+def _split(path):
+    return [p for p in path.split('/') if p]
+
+
+def _lookup(root, path):
+    """Node at path in the tree, or None.
+    """
+    node = root
+    for part in _split(path):
+        if not isinstance(node, _Dir) or part not in node.entries:
+            return None
+        node = node.entries[part]
+    return node
+
+
+class _RevisionTree(object):
+    """Copy on write tree for the revision being read.
+    """
+
+    def __init__(self, rev, root):
+        self.rev = rev
+        self.root = self._own(root)
+
+    def _own(self, node):
+        if node.rev == self.rev:
+            return node
+        return _Dir(self.rev, node.entries)
+
+    def _parent(self, path):
+        parts = _split(path)
+        node = self.root
+        for part in parts[:-1]:
+            child = node.entries.get(part)
+            if child is None:
+                raise SvnDumpError("Missing parent directory for "
+                                   "'{0}'".format(path))
+            elif not isinstance(child, _Dir):
+                raise SvnDumpError("'{0}' is not a directory".format(part))
+            child = self._own(child)
+            node.entries[part] = child
+            node.git_sha = None
+            node = child
+        node.git_sha = None
+        return node, parts[-1]
+
+    def get(self, path):
+        return _lookup(self.root, path)
+
+    def set(self, path, node):
+        parent, name = self._parent(path)
+        parent.entries[name] = node
+
+    def delete(self, path):
+        parent, name = self._parent(path)
+        if name not in parent.entries:
+            raise SvnDumpError("Deleting missing path '{0}'".format(path))
+        del parent.entries[name]
+
+
+# -------------------------------------------------------------------------------
+#
+# svndiff
+#
+# -------------------------------------------------------------------------------
+def _read_varint(data, pos):
+    value = 0
+    while True:
+        byte = bytearray(data[pos:pos + 1])
+        if not byte:
+            raise SvnDumpError("Truncated svndiff integer")
+        pos += 1
+        value = (value << 7) | (byte[0] & 0x7f)
+        if not byte[0] & 0x80:
+            return value, pos
+
+
+def _svndiff1_section(data):
+    size, pos = _read_varint(data, 0)
+    data = data[pos:]
+    if len(data) == size:
+        return data
+    return zlib.decompress(data)
+
+
+def apply_svndiff(source, delta, target=None):
+    """Apply an svndiff0 or svndiff1 delta to the source text.
+
+    source and delta can be any sliceable buffer, e.g. the view of a
+    spool.SpooledBuffer. The result is written window by window to
+    target if given, so only one window is held in memory, otherwise
+    it is returned as bytes.
+
+    """
+    if delta[0:3] != b'SVN':
+        raise SvnDumpError("Invalid svndiff header")
+    version = bytearray(delta[3:4])[0]
+    if version not in (0, 1):
+        raise SvnDumpError("Unsupported svndiff version {0}".format(version))
+    result = None
+    if target is None:
+        result = target = io.BytesIO()
+    pos = 4
+    while pos < len(delta):
+        source_offset, pos = _read_varint(delta, pos)
+        source_length, pos = _read_varint(delta, pos)
+        target_length, pos = _read_varint(delta, pos)
+        instructions_length, pos = _read_varint(delta, pos)
+        new_data_length, pos = _read_varint(delta, pos)
+        instructions = delta[pos:pos + instructions_length]
+        pos += instructions_length
+        new_data = delta[pos:pos + new_data_length]
+        pos += new_data_length
+        if version == 1:
+            instructions = _svndiff1_section(instructions)
+            new_data = _svndiff1_section(new_data)
+
+        view = source[source_offset:source_offset + source_length]
+        window = bytearray()
+        new_pos = 0
+        ipos = 0
+        while ipos < len(instructions):
+            op = bytearray(instructions[ipos:ipos + 1])[0]
+            ipos += 1
+            action = op >> 6
+            length = op & 0x3f
+            if length == 0:
+                length, ipos = _read_varint(instructions, ipos)
+            if action == 0:
+                offset, ipos = _read_varint(instructions, ipos)
+                window.extend(view[offset:offset + length])
+            elif action == 1:
+                offset, ipos = _read_varint(instructions, ipos)
+                # copies from the target may overlap what they produce
+                for i in range(length):
+                    window.append(window[offset + i])
+            elif action == 2:
+                window.extend(new_data[new_pos:new_pos + length])
+                new_pos += length
+            else:
+                raise SvnDumpError("Invalid svndiff instruction")
+        if len(window) != target_length:
+            raise SvnDumpError("svndiff window produced {0} bytes, expected "
+                               "{1}".format(len(window), target_length))
+        target.write(window)
+    if result is None:
+        return target
+    return result.getvalue()
+
+
+# -------------------------------------------------------------------------------
+#
+# dump stream reader
+#
+# -------------------------------------------------------------------------------
+def _parse_props(data, props=None, delta=False):
+    """Parse a property block. With delta the block modifies props.
+    """
+    if props is None or not delta:
+        props = {}
+    else:
+        props = dict(props)
+
+    def _read_field(pos):
+        newline = data.index(b'\n', pos)
+        kind, length = data[pos:newline].split(b' ')
+        start = newline + 1
+        end = start + int(length)
+        # the value is followed by a newline
+        return kind, data[start:end], end + 1
+
+    pos = 0
+    while not data.startswith(b'PROPS-END', pos):
+        kind, key, pos = _read_field(pos)
+        key = key.decode('utf-8')
+        if kind == b'D':
+            props.pop(key, None)
+            continue
+        _, value, pos = _read_field(pos)
+        props[key] = value.decode('utf-8', 'replace')
+    return props
+
+
+class SvnDumpReader(object):
+    """Read a dump stream, building the tree of every revision and
+    writing file contents into git.
+
+    tag_directories are the svn paths containing the tags of
+    interest; the last revision touching each tag is recorded with its
+    revision properties.
+
+    """
+
+    def __init__(self, session, tag_directories, prefix=''):
+        self._session = session
+        self._prefix = prefix.strip('/')
+        self._tag_directories = [d.strip('/') for d in tag_directories]
+        self.revisions = {}
+        self.revision_props = {}
+        self.tag_revisions = {}
+        # a dump of a subdirectory starts inside the prefix directory
+        root = _Dir(0)
+        node = root
+        for part in _split(self._prefix):
+            node.entries[part] = _Dir(0)
+            node = node.entries[part]
+        self._youngest = root
+        self.revisions[0] = root
+
+    def close(self):
+        """Drop the revision trees.
+        """
+        self.revisions = {}
+        self.revision_props = {}
+
+    @property
+    def head(self):
+        """Tree of the last revision read.
+        """
+        return self._youngest
+
+    def _path(self, path):
+        path = path.strip('/')
+        if self._prefix:
+            path = "{0}/{1}".format(self._prefix, path).strip('/')
+        return path
+
+    def _tree_at(self, rev):
+        """Tree at a revision, revisions that aren't in the dump (e.g. when
+        the dump was filtered) resolve to the closest earlier one.
+
+        """
+        while rev > 0 and rev not in self.revisions:
+            rev -= 1
+        return self.revisions.get(rev, self.revisions[0])
+
+    def _touch(self, rev, path):
+        for tag_dir in self._tag_directories:
+            if path.startswith(tag_dir + '/'):
+                tag = path[len(tag_dir) + 1:].split('/')[0]
+                self.tag_revisions["{0}/{1}".format(tag_dir, tag)] = rev
+
+    # ---------------------------------------------------------------
+    # stream parsing
+    # ---------------------------------------------------------------
+    def _read_headers(self, stream):
+        """Read a block of 'Key: value' headers, skipping leading blank
+        lines. Returns None at the end of the stream.
+
+        """
+        headers = {}
+        while True:
+            line = stream.readline()
+            if not line:
+                return None if not headers else headers
+            line = line.rstrip(b'\n')
+            if not line:
+                if headers:
+                    return headers
+                continue
+            key, _, value = line.partition(b': ')
+            headers[key.decode('utf-8')] = value.decode('utf-8')
+
+    def _write_content(self, stream, length):
+        """Copy content from the stream into git in chunks, returns the
+        blob sha.
+
+        """
+        with SpooledBuffer() as content:
+            self._copy(stream, length, content)
+            return self._hash_buffer(content)
+
+    def _apply_delta(self, stream, length, sha):
+        """Apply a text delta from the stream to the blob sha (None for an
+        empty source), returns the sha of the result. The source, delta
+        and result are spooled, so large files spill to staging files
+        instead of being held in memory.
+
+        """
+        with SpooledBuffer() as source, SpooledBuffer() as delta, \
+                SpooledBuffer() as target:
+            if sha is not None and \
+               self._session.read_object_into(sha, source) is None:
+                raise SvnDumpError("Missing blob {0}".format(sha))
+            self._copy(stream, length, delta)
+            apply_svndiff(source.view(), delta.view(), target)
+            return self._hash_buffer(target)
+
+    def _hash_buffer(self, buffer):
+        """Write the contents of a buffer as a blob, returns the sha. Only
+        buffers that spilled already are hashed from their staging file.
+
+        """
+        if buffer.spilled:
+            return self._session.hash_files([buffer.filename()])[0]
+        return self._session.hash_data(buffer.view())
+
+    @staticmethod
+    def _copy(stream, length, buffer):
+        try:
+            buffer.copy_from(stream, length)
+        except EOFError:
+            raise SvnDumpError("Truncated dump stream")
+
+    def _read_blob(self, sha):
+        info = self._session.read_object(sha)
+        if info is None:
+            raise SvnDumpError("Missing blob {0}".format(sha))
+        return info[2]
+
+    def read(self, stream):
+        """Read the whole dump stream.
+        """
+        tree = None
+        rev = None
+        while True:
+            headers = self._read_headers(stream)
+            if headers is None:
+                break
+            if 'SVN-fs-dump-format-version' in headers:
+                version = int(headers['SVN-fs-dump-format-version'])
+                if version not in (2, 3):
+                    raise SvnDumpError("Unsupported dump format version "
+                                       "{0}".format(version))
+                continue
+            if 'UUID' in headers and len(headers) == 1:
+                continue
+            if 'Revision-number' in headers:
+                if tree is not None:
+                    self._finish_revision(rev, tree)
+                rev = int(headers['Revision-number'])
+                props = {}
+                length = int(headers.get('Prop-content-length', 0))
+                if length:
+                    props = _parse_props(stream.read(length))
+                self._skip_rest(stream, headers, length)
+                self.revision_props[rev] = props
+                tree = _RevisionTree(rev, self._youngest)
+                if rev % 1000 == 0:
+                    print("    read svn dump revision {0}".format(rev))
+                continue
+            if 'Node-path' in headers:
+                if tree is None:
+                    raise SvnDumpError("Node record before any revision")
+                self._read_node(stream, headers, rev, tree)
+                continue
+            raise SvnDumpError("Unknown dump record: {0}".format(headers))
+        if tree is not None:
+            self._finish_revision(rev, tree)
+
+    def _skip_rest(self, stream, headers, consumed):
+        total = int(headers.get('Content-length', consumed))
+        if total > consumed:
+            stream.read(total - consumed)
+
+    def _finish_revision(self, rev, tree):
+        self.revisions[rev] = tree.root
+        self._youngest = tree.root
+
+    def _read_node(self, stream, headers, rev, tree):
+        path = self._path(headers['Node-path'])
+        action = headers['Node-action']
+        kind = headers.get('Node-kind')
+        prop_length = int(headers.get('Prop-content-length', 0))
+        text_length = headers.get('Text-content-length')
+
+        props_data = b''
+        if prop_length:
+            props_data = stream.read(prop_length)
+        consumed = prop_length
+
+        if action in ('delete', 'replace'):
+            tree.delete(path)
+        if action == 'delete':
+            self._skip_rest(stream, headers, consumed)
+            self._touch(rev, path)
+            return
+
+        node = None
+        if action in ('add', 'replace'):
+            if 'Node-copyfrom-path' in headers:
+                source_rev = int(headers['Node-copyfrom-rev'])
+                source_path = self._path(headers['Node-copyfrom-path'])
+                node = _lookup(self._tree_at(source_rev), source_path)
+                if node is None:
+                    raise SvnDumpError(
+                        "Copy source '{0}@{1}' not found".format(
+                            source_path, source_rev))
+            elif kind == 'dir':
+                node = _Dir(rev)
+            else:
+                node = _File(None, {})
+        else:
+            node = tree.get(path)
+            if node is None:
+                raise SvnDumpError("Changing missing path '{0}'".format(path))
+
+        if isinstance(node, _Dir):
+            # directory properties (e.g. svn:externals, svn:ignore) aren't
+            # part of an export.
+            if node.rev != rev:
+                node = _Dir(rev, node.entries)
+            self._skip_rest(stream, headers, consumed)
+            tree.set(path, node)
+            self._touch(rev, path)
+            return
+
+        props = node.props
+        if 'Prop-content-length' in headers:
+            props = _parse_props(props_data, node.props,
+                                 headers.get('Prop-delta') == 'true')
+        sha = node.sha
+        if text_length is not None:
+            text_length = int(text_length)
+            if headers.get('Text-delta') == 'true':
+                sha = self._apply_delta(stream, text_length, sha)
+            else:
+                sha = self._write_content(stream, text_length)
+            consumed += text_length
+        if sha is None:
+            sha = self._session.hash_data(b'')
+        self._skip_rest(stream, headers, consumed)
+        tree.set(path, _File(sha, props))
+        self._touch(rev, path)
+
+    # ---------------------------------------------------------------
+    # git trees
+    # ---------------------------------------------------------------
+    def git_entry(self, node):
+        """(mode, sha) of a node in git.
+        """
+        if isinstance(node, _Dir):
+            return MODE_TREE, self.git_tree(node)
+        if node.git_entry is None:
+            if 'svn:special' in node.props:
+                data = self._read_blob(node.sha)
+                if data.startswith(b'link '):
+                    data = data[len(b'link '):]
+                node.git_entry = (MODE_SYMLINK,
+                                  self._session.hash_data(data))
+            elif 'svn:executable' in node.props:
+                node.git_entry = (MODE_EXECUTABLE, node.sha)
+            else:
+                node.git_entry = (MODE_FILE, node.sha)
+        return node.git_entry
+
+    def git_entries(self, node):
+        """Git tree entries of a directory node, empty directories are
+        dropped because git can't store them.
+
+        """
+        entries = {}
+        for name, child in node.entries.items():
+            if isinstance(child, _Dir) and self.git_tree(child) is None:
+                continue
+            entries[name] = self.git_entry(child)
+        return entries
+
+    def git_tree(self, node):
+        """Git tree sha of a directory node, or None if it is empty.
+        """
+        if node.git_sha is None:
+            entries = self.git_entries(node)
+            node.git_sha = ''
+            if entries:
+                node.git_sha = self._session.mktree(entries)
+        return node.git_sha or None
+
+
+# -------------------------------------------------------------------------------
+#
+# git import
+#
+# -------------------------------------------------------------------------------
+def _job_entries(reader, job, base_entries):
+    """Top level entries of the tag after the same processing as the svn
+    client path: svn_checkout_cesm and svn_shift_root_files.
+
+    """
+    tag_node = _lookup(reader.head, job.tag)
+    if not isinstance(tag_node, _Dir):
+        raise SvnDumpError("Tag '{0}' is not in the svn dump".format(job.tag))
+    export_node = tag_node
+    if job.collapse_standalone:
+        export_node = _lookup(tag_node, job.standalone_path)
+        if not isinstance(export_node, _Dir):
+            raise SvnDumpError("'{0}' is not in tag '{1}'".format(
+                job.standalone_path, job.tag))
+    entries = reader.git_entries(export_node)
+
+    if job.shift_root_files:
+        existing = set(base_entries) | set(entries)
+        for name, child in tag_node.entries.items():
+            if not is_shifted_root_entry(job, name):
+                continue
+            destination = name
+            if destination == "SVN_EXTERNAL_DIRECTORIES" or \
+               destination in existing:
+                destination = "{0}.{1}".format(name, job.shift_root_suffix)
+            if isinstance(child, _Dir) and reader.git_tree(child) is None:
+                continue
+            entries[destination] = reader.git_entry(child)
+    return entries
+
+
+def _generate_externals_description(session, entries):
+    """Run the externals description conversion on the externals files
+    of a tree, returning the entries for the generated files.
+
+    """
+    cwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp(prefix='cesm2git-externals-')
+    try:
+        for name in ["SVN_EXTERNAL_DIRECTORIES",
+                     "SVN_EXTERNAL_DIRECTORIES.standalone"]:
+            if name in entries:
+                with open(os.path.join(tmp_dir, name), 'wb') as ext_file:
+                    ext_file.write(session.read_object(entries[name][1])[2])
+        os.chdir(tmp_dir)
+        generated = generate_externals_description()
+        paths = [os.path.join(tmp_dir, name) for name in generated]
+        shas = session.hash_files(paths)
+        return dict((name, (MODE_FILE, sha))
+                    for name, sha in zip(generated, shas))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def import_dump(stream, jobs, repo_dir, authors_filename, prefix='',
+                push=True, report=None):
+    """Import the tags for the jobs from an svn dump stream into the git
+    repo. Jobs are committed in order onto their branches; tags that
+    already exist in git are skipped. Each tag is recorded in the
+    report.RunReport if one is given.
+
+    Returns the list of git tags created.
+
+    """
+    if report is None:
+        report = RunReport()
+    session = get_git_session(repo_dir)
+    author_resolver = get_author_resolver(authors_filename)
+
+    for job in jobs:
+        if job.checkout_externals:
+            raise SvnDumpError("Tag '{0}' needs svn externals and can not be "
+                               "imported from an svn dump".format(job.tag))
+
+    tag_directories = set(os.path.dirname(job.tag) for job in jobs)
+    reader = SvnDumpReader(session, tag_directories, prefix=prefix)
+    try:
+        print("Reading svn dump...")
+        # the dump read is reported like a tag
+        progress.add_total(1)
+        with report.tag('svn dump', phase='read'):
+            reader.read(stream)
+        print("    read {0} revisions".format(len(reader.revisions) - 1))
+
+        heads = {}
+        updates = []
+        created = []
+        imported = []
+        for job in jobs:
+            new_tag = new_tag_from_job(job)
+            tag_ref = "refs/tags/{0}".format(new_tag)
+            if session.rev_parse(tag_ref) is not None:
+                print("    git tag '{0}' already exists, skipping".format(
+                    new_tag))
+                progress.add_total(-1)
+                continue
+            with report.tag(new_tag, branch=job.branch):
+                branch_ref = "refs/heads/{0}".format(job.branch)
+                if branch_ref not in heads:
+                    head = session.rev_parse(branch_ref)
+                    if head is None:
+                        raise RuntimeError("ERROR: git branch '{0}' does not "
+                                           "exist".format(job.branch))
+                    heads[branch_ref] = (head, head)
+                original, parent = heads[branch_ref]
+
+                base = session.read_tree(parent)
+                for name in removed_root_entries(job):
+                    base.pop(name, None)
+                overlay = _job_entries(reader, job, base)
+                if job.generate_externals_description:
+                    merged = dict(base)
+                    merged.update(overlay)
+                    overlay.update(_generate_externals_description(session,
+                                                                   merged))
+                tree = session.overlay_tree(base, overlay)
+
+                rev = reader.tag_revisions[job.tag]
+                props = reader.revision_props[rev]
+                author = author_resolver.resolve(props.get('svn:author', ''))
+                message = '{0}\n\n'.format(new_tag)
+                if props.get('svn:log'):
+                    message += "{0}\n".format(props['svn:log'])
+                commit = session.commit_tree(tree, [parent], message, author,
+                                             props['svn:date'])
+                tag = session.make_tag(new_tag, commit,
+                                       "tag {0} from svn".format(new_tag))
+                print("    {0} {1} : {2} (r{3})".format(job.branch, new_tag,
+                                                        commit, rev))
+                heads[branch_ref] = (original, commit)
+                updates.append((tag_ref, tag, NULL_SHA))
+                created.append(new_tag)
+                imported.append((job, new_tag, commit, rev))
+        author_resolver.save_cache()
+
+        for branch_ref, (original, head) in heads.items():
+            if head != original:
+                updates.append((branch_ref, head, original))
+        if push and updates:
+            session.update_refs(updates)
+            for job, new_tag, commit, rev in imported:
+                revmap.record(job, new_tag, commit=commit, revision=rev)
+            maintenance.after_tag(len(created))
+    finally:
+        reader.close()
+    return created
+
+
+def open_dump(filename):
+    """Binary stream for a dump file name, '-' is stdin.
+    """
+    if filename == '-':
+        return getattr(sys.stdin, 'buffer', sys.stdin)
+    return open(filename, 'rb')
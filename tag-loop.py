@@ -9,13 +9,9 @@ from __future__ import print_function
 
 import sys
 
-if sys.hexversion < 0x02070000:
-    print(70 * "*")
-    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
-    print("It appears that you are running python {0}".format(
-        ".".join(str(x) for x in sys.version_info[0:3])))
-    print(70 * "*")
-    sys.exit(1)
+from python_version import check_python_version
+
+check_python_version()
 
 #
 # built-in modules
@@ -23,14 +19,8 @@ if sys.hexversion < 0x02070000:
 import argparse
 import json
 import os
-import subprocess
 import traceback
 
-if sys.version_info[0] == 2:
-    from ConfigParser import SafeConfigParser as config_parser
-else:
-    from configparser import ConfigParser as config_parser
-
 #
 # installed dependencies
 #
@@ -38,6 +28,27 @@ else:
 #
 # other modules in this package
 #
+from authors import get_author_resolver
+import git_backend
+from git_backend import close_git_sessions
+from cesm2git import (add_runner_options, add_staging_options,
+                      configure_runner, configure_staging, import_tag,
+                      svn_log_authors)
+import maintenance
+import object_store
+from plan import git_tag_names, plan_tag_file, print_plan
+import profiling
+import progress
+from quarantine import DEFAULT_QUARANTINE_FILE, Quarantine, import_keep_going
+from report import RunReport
+import revmap
+from segments import import_segments
+import spool
+import svn_async
+from staging import get_cache
+from svn_dump import import_dump, open_dump
+from tag_job import jobs_from_manifest
+from verify import print_verification, verification_failed, verify_tag_file
 
 
 # -------------------------------------------------------------------------------
@@ -52,6 +63,9 @@ def commandline_options():
     parser = argparse.ArgumentParser(
         description='FIXME: python program template.')
 
+    parser.add_argument('--authors', nargs=1, default=['author-map.json'],
+                        help='path to authors json file, relative to repo')
+
     parser.add_argument('--backtrace', action='store_true',
                         help='show exception backtraces as extra debugging '
                         'output')
@@ -63,16 +77,130 @@ def commandline_options():
                         help='dry run setting up changes, '
                         'but not calling external programs.')
 
+    parser.add_argument('--git-plumbing', action='store_true', default=False,
+                        help='write tags without externals directly into '
+                        'the repo with git plumbing instead of a '
+                        'temporary clone per tag.')
+
+    parser.add_argument('--heartbeat', nargs=1, type=int,
+                        default=[progress.DEFAULT_HEARTBEAT],
+                        help='seconds between progress heartbeat lines '
+                        'while a tag is being imported, 0 to disable.')
+
+    parser.add_argument('--jobs', nargs=1, type=int, default=[4],
+                        help='number of concurrent svn queries used by '
+                        '--plan and --verify')
+
+    parser.add_argument('--keep-going', action='store_true', default=False,
+                        help='record tags that fail in the quarantine '
+                        'file and continue with the remaining tags, see '
+                        'quarantine.py.')
+
+    parser.add_argument('--loose-objects', nargs=1, type=int,
+                        default=[maintenance.DEFAULT_LOOSE_OBJECTS],
+                        help='repack as soon as the repo has the specified '
+                        'number of loose objects.')
+
+    parser.add_argument('--memory-limit', nargs=1, type=int,
+                        default=[spool.DEFAULT_MEMORY_LIMIT // (1024 * 1024)],
+                        help='megabytes of file contents held in memory '
+                        'at once, larger contents are spilled to staging '
+                        'files.')
+
+    parser.add_argument('--object-store', nargs=1, default=[''],
+                        help='share objects with the other component repos '
+                        'through the bare repo at the specified path, '
+                        'created if needed. See object_store.py.')
+
+    parser.add_argument('--plan', action='store_true', default=False,
+                        help='compute the import plan and cost estimate '
+                        'for the tag files without importing anything.')
+
+    parser.add_argument('--plan-output', nargs=1, default=[''],
+                        help='write the import plan as json to the '
+                        'specified file.')
+
+    parser.add_argument('--no-estimate', action='store_true', default=False,
+                        help='with --plan, only compare the tag file with '
+                        'the git repo, skip querying svn for sizes.')
+
+    parser.add_argument('--profile', nargs=1, default=[''],
+                        help='profile the run per phase and per tag and '
+                        'write the profiles to the specified directory, '
+                        'see profiling.py.')
+
+    parser.add_argument('--quarantine', nargs=1,
+                        default=[DEFAULT_QUARANTINE_FILE],
+                        help='quarantine file used by --keep-going and '
+                        '--retry-quarantined.')
+
     parser.add_argument('--repo', nargs=1, required=True,
                         help='path to repo')
 
+    parser.add_argument('--repack-every', nargs=1, type=int,
+                        default=[maintenance.DEFAULT_REPACK_EVERY],
+                        help='repack the repo after the specified number '
+                        'of tags, 0 leaves object storage to git gc.')
+
+    parser.add_argument('--report', nargs=1, default=[''],
+                        help='write the run report (time and peak memory '
+                        'per tag) as json to the specified file.')
+
     parser.add_argument('--resume', nargs=1, default=[''],
                         help='resume interrupted look at specified tag.')
 
-    parser.add_argument('--tag-file', nargs=1, required=True,
-                        help='path to text file containing tags '
+    parser.add_argument('--retry-quarantined', action='store_true',
+                        default=False,
+                        help='import only the tags in the quarantine '
+                        'file again, implies --keep-going.')
+
+    parser.add_argument('--segments', nargs=1, type=int, default=[0],
+                        help='rebuild each tag file in the specified number '
+                        'of parallel segments stitched into one history, '
+                        'uses the git plumbing backend.')
+
+    parser.add_argument('--staging-dir', nargs=1, default=[''],
+                        help='directory for spilled file contents, '
+                        'defaults to the system temp directory.')
+
+    parser.add_argument('--status-file', nargs=1, default=[''],
+                        help='keep a json status file (progress, current '
+                        'tag, phase and ETA) up to date for monitoring.')
+
+    parser.add_argument('--svn-concurrency', nargs=1, type=int,
+                        default=[svn_async.DEFAULT_CONCURRENCY],
+                        help='number of concurrent svn queries used to '
+                        'prefetch the svn metadata of the tags before '
+                        'importing them, 0 to query one tag at a time.')
+
+    parser.add_argument('--svn-dump', nargs=1, default=[''],
+                        help='import the tags from an svnadmin/svnrdump '
+                        'dump file instead of the svn server, - for stdin.')
+
+    parser.add_argument('--svn-dump-prefix', nargs=1, default=[''],
+                        help='svn path the dump paths are relative to, '
+                        'e.g. clm2 for a dump of .../clm2.')
+
+    parser.add_argument('--tag-file', nargs='+', required=True,
+                        help='path to text file(s) containing tags '
                         'to be imported')
 
+    parser.add_argument('--verify', action='store_true', default=False,
+                        help='compare the git tags with the svn tags in '
+                        'the tag files instead of importing anything.')
+
+    parser.add_argument('--write-packs', action='store_true', default=False,
+                        help='with --git-plumbing, write file contents '
+                        'into packs with git fast-import instead of '
+                        'loose objects.')
+
+    parser.add_argument('--verify-output', nargs=1, default=[''],
+                        help='write the verification results as json to '
+                        'the specified file.')
+
+    add_runner_options(parser)
+    add_staging_options(parser)
+
     options = parser.parse_args()
     return options
 
@@ -82,17 +210,6 @@ def commandline_options():
 # work functions
 #
 # -------------------------------------------------------------------------------
-def write_config_file(config, filename):
-    """Read the configuration file and process
-
-    """
-    # print("Writing configuration file : {0}".format(filename))
-
-    cfg_file = os.path.abspath(filename)
-    with open(cfg_file, 'w') as configfile:
-        config.write(configfile)
-
-
 def get_tag_list(tag_filename):
     """read the list of tags to be converted.
 
@@ -104,94 +221,293 @@ def get_tag_list(tag_filename):
     return tags
 
 
+def report_unmapped_authors(base_info, authors_filename):
+    """Resolve every svn author that committed to the tag directory up
+    front, so missing author map entries are reported before the import
+    starts instead of silently falling back to a default address.
+
+    """
+    author_resolver = get_author_resolver(authors_filename)
+    svn_authors = svn_log_authors(base_info['repo'],
+                                  base_info['tag_directory'])
+    unmapped = author_resolver.precompute(svn_authors)
+    author_resolver.save_cache()
+    if unmapped:
+        print("WARNING: {0} svn authors in {1} are not in {2}:".format(
+            len(unmapped), base_info['tag_directory'], authors_filename))
+        for author in unmapped:
+            print("    {0}".format(author))
+    return unmapped
+
+
 # -------------------------------------------------------------------------------
 #
 # main
 #
 # -------------------------------------------------------------------------------
-def main(options):
+def plan_imports(options):
+    """Compute and report the import plan for every tag file.
+
+    """
+    local_git_repo = options.repo[0]
+    plans = []
+    for tag_filename in options.tag_file:
+        tag_file = os.path.join(local_git_repo, tag_filename)
+        plan = plan_tag_file(tag_file, local_git_repo,
+                             estimate=not options.no_estimate,
+                             jobs=options.jobs[0],
+                             plumbing=options.git_plumbing)
+        print_plan(plan)
+        plans.append(plan)
+
+    plan_output = options.plan_output[0]
+    if plan_output:
+        with open(plan_output, 'w') as plan_file:
+            json.dump(plans, plan_file, indent=4, sort_keys=True)
+    return 0
+
+
+def verify_imports(options):
+    """Compare the git tags with svn for every tag file, returns a non-zero
+    status if any tag is missing or different.
+
+    """
+    local_git_repo = options.repo[0]
+    verifications = []
+    status = 0
+    for tag_filename in options.tag_file:
+        tag_file = os.path.join(local_git_repo, tag_filename)
+        verification = verify_tag_file(tag_file, local_git_repo,
+                                       jobs=options.jobs[0],
+                                       export_cache=get_cache())
+        print_verification(verification)
+        verifications.append(verification)
+        if verification_failed(verification):
+            status = 1
+
+    verify_output = options.verify_output[0]
+    if verify_output:
+        with open(verify_output, 'w') as verify_file:
+            json.dump(verifications, verify_file, indent=4, sort_keys=True)
+    return status
+
+
+def prefetch_svn_metadata(options, jobs):
+    """Query the svn metadata of the jobs that aren't imported yet
+    concurrently, before the imports need it.
+
+    """
+    if options.svn_concurrency[0] <= 0:
+        return
+    git_tags = git_tag_names(options.repo[0])
+    jobs = [job for job in jobs if job.git_tag not in git_tags]
+    progress.phase('svn metadata')
+    svn_async.prefetch_metadata(jobs, concurrency=options.svn_concurrency[0])
+
+
+def import_svn_dump(options, report):
+    """Import every tag in the tag files from a single pass over an svn
+    dump.
+
+    """
+    local_git_repo = options.repo[0]
+    jobs = []
+    for tag_filename in options.tag_file:
+        tag_file = os.path.join(local_git_repo, tag_filename)
+        jobs.extend(jobs_from_manifest(get_tag_list(tag_file),
+                                       options.resume[0].strip()))
+
+    authors_filename = os.path.join(local_git_repo, options.authors[0])
+    with open_dump(options.svn_dump[0]) as dump:
+        import_dump(dump, jobs, local_git_repo, authors_filename,
+                    prefix=options.svn_dump_prefix[0],
+                    push=not options.dry_run, report=report)
+    return 0
+
+
+def import_tag_file_segments(options, tag_filename, report):
+    """Import the tags in a single tag file as parallel segments.
+
+    """
+    local_git_repo = options.repo[0]
+    tag_file = os.path.join(local_git_repo, tag_filename)
+    tag_input = get_tag_list(tag_file)
+
+    jobs = jobs_from_manifest(tag_input, options.resume[0].strip())
+    if options.dry_run:
+        for job in jobs:
+            print(job.tag)
+        return 0
+
+    authors_filename = os.path.join(local_git_repo, options.authors[0])
+    report_unmapped_authors(tag_input['config'], authors_filename)
+    prefetch_svn_metadata(options, jobs)
+    import_segments(jobs, local_git_repo, authors=options.authors[0],
+                    segments=options.segments[0], options=options,
+                    debug=options.debug, report=report)
+    return 0
+
+
+def tag_file_jobs(options, tag_filename):
+    """Jobs of a tag file the run imports, only the quarantined ones
+    with --retry-quarantined.
+
+    """
+    tag_file = os.path.join(options.repo[0], tag_filename)
+    jobs = jobs_from_manifest(get_tag_list(tag_file),
+                              options.resume[0].strip())
+    if options.retry_quarantined:
+        jobs = Quarantine(options.quarantine[0]).jobs(jobs, tag_filename)
+    return jobs
+
+
+def import_tag_file_keep_going(options, tag_filename, report):
+    """Import the tags in a single tag file, quarantining the tags that
+    fail instead of stopping.
+
+    """
+    local_git_repo = options.repo[0]
+    tag_file = os.path.join(local_git_repo, tag_filename)
+    jobs = tag_file_jobs(options, tag_filename)
+    if not jobs:
+        return 0
+    if options.dry_run:
+        for job in jobs:
+            print(job.tag)
+        return 0
+
+    authors_filename = os.path.join(local_git_repo, options.authors[0])
+    report_unmapped_authors(get_tag_list(tag_file)['config'],
+                            authors_filename)
+    prefetch_svn_metadata(options, jobs)
+    import_keep_going(jobs, local_git_repo, Quarantine(options.quarantine[0]),
+                      tag_filename, authors=options.authors[0],
+                      debug=options.debug, plumbing=options.git_plumbing,
+                      report=report)
+    return 0
+
+
+def import_tag_file(options, tag_filename, report):
+    """Import every tag in a single tag file.
+
+    """
     # git repo that is being manipulated
     local_git_repo = options.repo[0]
-    config_filename = os.path.join(local_git_repo, 'tmp.cfg')
 
-    tag_file = os.path.join(local_git_repo, options.tag_file[0])
+    tag_file = os.path.join(local_git_repo, tag_filename)
     tag_input = get_tag_list(tag_file)
 
     base_info = tag_input['config']
-    # assume we are doing every tag in the tag file
-    found_resume_tag = True
+    if not options.dry_run:
+        authors_filename = os.path.join(local_git_repo, options.authors[0])
+        report_unmapped_authors(base_info, authors_filename)
+
     resume = options.resume[0].strip()
     if resume:
         # user requested resuming in the middle of the tag file
-        found_resume_tag = False
         print("Searching for tag {0}".format(resume))
 
-    for tag in tag_input["tags"]:
-        if found_resume_tag is False:
-            # we looking to resume a tag
-            # print("Comparing '{0}' : '{1}'".format(resume, tag["tag"]))
-            if resume == tag["tag"]:
-                # current tag is resume point
-                found_resume_tag = True
-            else:
-                # skip this tag and keep looking
-                continue
-
-        if 'skip' in tag and tag['skip'] is True:
-                # skip tag for some reason, e.g. bad svn tag
-                continue
-        print("Processing : {0}".format(tag["tag"]))
-        # setup the config file
-        config = config_parser()
-        config.add_section('git')
-        config.add_section('cesm')
-        config.add_section('externals')
-
-        # local git branch that new tags are added to
-        config.set('git', 'branch', base_info['branch'])
-
-        # configuration for this tag
-        config.set('cesm', 'repo', base_info['repo'])
-        tag_path = os.path.join(base_info["tag_directory"], tag["tag"])
-        config.set('cesm', 'tag', tag_path)
-
-        config.set('cesm', 'checkout_externals',
-                   str(tag['checkout_externals']))
-        config.set('cesm', 'collapse_standalone',
-                   str(tag['collapse_standalone']))
-        config.set('cesm', 'shift_root_files',
-                   str(tag['shift_root_files']))
-        value = str(False)
-        if 'generate_externals_description' in tag:
-            value = str(tag['generate_externals_description'])
-        config.set('cesm', 'generate_externals_description', value)
-
-        optional_keys = ['shift_root_suffix',
-                         'standalone_path', ]
-        for k in optional_keys:
-            try:
-                config.set('cesm', k, tag[k])
-            except KeyError:
-                config.set('cesm', k, str(None))
-
-        write_config_file(config, config_filename)
-
-        executable = os.path.join(local_git_repo, 'cesm2git.py')
-        cmd = [executable,
-               '--repo', local_git_repo,
-               '--config', config_filename,
-               '--feelin-lucky',
-               ]
-
+    jobs = jobs_from_manifest(tag_input, resume)
+    if not options.dry_run:
+        prefetch_svn_metadata(options, jobs)
+    for job in jobs:
         if not options.dry_run:
-            subprocess.check_output(cmd, shell=False,
-                                    stderr=subprocess.STDOUT)
+            # report.tag prints the progress of the loop
+            with report.tag(job.tag_name, branch=job.branch):
+                import_tag(job, local_git_repo, authors=options.authors[0],
+                           debug=options.debug, push=True,
+                           plumbing=options.git_plumbing)
+            maintenance.after_tag()
         else:
-            print(tag_path)
+            print("Processing : {0}".format(job.tag_name))
+            print(job.tag)
 
     return 0
 
 
+def count_tags(options):
+    """Number of tags the run will import, for the progress and ETA.
+
+    """
+    count = 0
+    for tag_filename in options.tag_file:
+        count += len(tag_file_jobs(options, tag_filename))
+    return count
+
+
+def main(options):
+    command_runner = configure_runner(options)
+    configure_staging(options)
+    spool.configure(limit=options.memory_limit[0] * 1024 * 1024,
+                    staging_dir=options.staging_dir[0] or None)
+    if options.plan:
+        return plan_imports(options)
+    if options.verify:
+        return verify_imports(options)
+    if options.retry_quarantined:
+        options.keep_going = True
+    if options.keep_going and (options.svn_dump[0] or
+                               options.segments[0] > 1):
+        raise RuntimeError("ERROR: --keep-going can not be combined with "
+                           "--svn-dump or --segments")
+
+    profiling.configure(options.profile[0] or None)
+    git_backend.configure(write_packs=options.write_packs)
+    repo_maintenance = None
+    if not options.dry_run:
+        store = object_store.configure(options.object_store[0] or None)
+        if store is not None:
+            store.link(options.repo[0])
+        repo_maintenance = maintenance.configure(
+            repo_dir=options.repo[0], every=options.repack_every[0],
+            loose_objects=options.loose_objects[0])
+        revmap.configure(options.repo[0])
+
+    report = RunReport()
+    run_progress = None
+    if not options.dry_run:
+        run_progress = progress.configure(
+            total=count_tags(options),
+            status_filename=options.status_file[0] or None,
+            heartbeat=options.heartbeat[0])
+        run_progress.start()
+    status = 0
+    try:
+        if options.svn_dump[0]:
+            status = import_svn_dump(options, report)
+        else:
+            import_file = import_tag_file
+            if options.keep_going:
+                import_file = import_tag_file_keep_going
+            elif options.segments[0] > 1:
+                import_file = import_tag_file_segments
+            for tag_filename in options.tag_file:
+                status = import_file(options, tag_filename, report)
+                if status != 0:
+                    break
+    finally:
+        if run_progress is not None:
+            run_progress.stop()
+        if revmap.get_revmap() is not None:
+            print("Wrote {0} svn notes to {1}".format(
+                revmap.get_revmap().write_notes(), revmap.NOTES_REF))
+            revmap.configure()
+        close_git_sessions()
+        if repo_maintenance is not None:
+            repo_maintenance.finish()
+        command_runner.print_timing_summary()
+        profiling.finish()
+        report.print_summary()
+        if options.report[0]:
+            report.write(options.report[0])
+    if options.keep_going:
+        quarantine = Quarantine(options.quarantine[0])
+        quarantine.print_summary()
+        if quarantine.tags:
+            status = 1
+    return status
+
+
 if __name__ == "__main__":
     options = commandline_options()
     try:
@@ -0,0 +1,298 @@
+"""Settings needed to import a single svn tag into git.
+
+A TagJob is created directly from an entry of a tag file (the
+'manifest') by tag-loop.py and consumed by cesm2git.import_tag. The
+config file format read by 'cesm2git.py --config' is still supported
+through TagJob.from_config_file:
+
+    [git]
+    branch = clm
+
+    [cesm]
+    repo = https://svn-ccsm-models.cgd.ucar.edu
+    tag = clm2/trunk_tags/clm4_5_1_r076
+    checkout_externals = False
+    collapse_standalone = True
+    shift_root_files = True
+    shift_root_suffix = standalone
+    standalone_path = models/lnd/clm
+
+    [externals]
+    models/ocn/pop2  = pop2/trunk_tags/cesm_pop_2_1_20140828
+
+NOTE: the options in the externals section are exactly the directory
+paths used in SVN_EXTERNAL_DIRECTORIES, the values are the url minus
+the repo prefix.
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+
+DEFAULT_SHIFT_ROOT_SUFFIX = 'standalone'
+
+# tag settings that are booleans, and their default values.
+BOOLEAN_SETTINGS = {
+    'checkout_externals': False,
+    'collapse_standalone': False,
+    'shift_root_files': False,
+    'generate_externals_description': False,
+}
+
+# tag settings that are optional strings
+OPTIONAL_SETTINGS = [
+    'alias',
+    'shift_root_suffix',
+    'standalone_path',
+]
+
+
+def string_to_bool(bool_string):
+    """Convert a boolean string to a boolean value
+    """
+    value = None
+    if bool_string.lower() == 'false':
+        value = False
+    elif bool_string.lower() == 'true':
+        value = True
+    else:
+        raise RuntimeError("Invalid string for boolean conversion "
+                           "'{0}'".format(bool_string))
+    return value
+
+
+def config_parser():
+    """A new config parser for cesm2git config files. configparser is
+    only imported by the jobs that read or write one.
+
+    """
+    from configparser import ConfigParser
+    return ConfigParser()
+
+
+def read_manifest(filename):
+    """Read a tag file.
+    """
+    with open(filename, 'r') as tag_file:
+        return json.load(tag_file)
+
+
+def write_manifest(filename, manifest):
+    """Atomically replace a tag file, in the layout of the checked in
+    tag files.
+
+    """
+    tmp_filename = "{0}.tmp".format(filename)
+    with open(tmp_filename, 'w') as tag_file:
+        json.dump(manifest, tag_file, indent=4)
+        tag_file.write('\n')
+    os.rename(tmp_filename, filename)
+
+
+def jobs_from_manifest(manifest, resume=''):
+    """Create the jobs for every tag in a tag file that should be
+    imported, in tag file order.
+
+    If resume is a tag name, tags before it in the tag file are not
+    included. Tags marked 'skip', e.g. bad svn tags, are never
+    included.
+
+    Every job knows the tag before it in the tag file, if that tag is
+    exported the same way, so the import can limit the git index
+    update to the paths svn changed between the two tags.
+
+    """
+    base_info = manifest['config']
+    # assume we are doing every tag in the tag file
+    found_resume_tag = not resume
+    jobs = []
+    previous = None
+    for tag in manifest['tags']:
+        if not found_resume_tag and resume == tag['tag']:
+            # current tag is resume point
+            found_resume_tag = True
+        if tag.get('skip', False) is True:
+            # skip tag for some reason, e.g. bad svn tag
+            continue
+        job = TagJob.from_manifest(base_info, tag)
+        if previous is not None and previous.layout == job.layout:
+            job.previous_tag = previous.tag
+            job.previous_git_tag = previous.git_tag
+        previous = job
+        if found_resume_tag:
+            jobs.append(job)
+    return jobs
+
+
+class TagJob(object):
+    """Everything needed to import one svn tag onto a git branch.
+
+    """
+
+    def __init__(self, branch, repo, tag, externals=None, **settings):
+        # local git branch that new tags are added to
+        self.branch = branch
+        # svn repo url and path of the tag relative to the repo
+        self.repo = repo
+        self.tag = tag
+        # externals to switch, directory path -> url minus repo prefix
+        self.externals = dict(externals or {})
+        # svn revision of the tag, known once its svn log was read
+        self.svn_revision = None
+        # svn tag and git tag of the tag imported before this one, if
+        # it's exported the same way, see jobs_from_manifest
+        self.previous_tag = None
+        self.previous_git_tag = None
+        # top level entries of the tag shifted into the working copy,
+        # name -> destination, known once the tag was exported
+        self.shifted_root_files = {}
+
+        for key, default in BOOLEAN_SETTINGS.items():
+            setattr(self, key, bool(settings.pop(key, default)))
+        for key in OPTIONAL_SETTINGS:
+            setattr(self, key, settings.pop(key, None))
+        if settings:
+            raise RuntimeError("Unknown tag settings for '{0}' : {1}".format(
+                tag, ', '.join(sorted(settings))))
+
+        if self.shift_root_suffix is None:
+            self.shift_root_suffix = DEFAULT_SHIFT_ROOT_SUFFIX
+        if self.collapse_standalone and not self.standalone_path:
+            raise RuntimeError("Tag '{0}' collapses the standalone directory "
+                               "but doesn't set 'standalone_path'".format(tag))
+
+    def __repr__(self):
+        return "TagJob({0!r}, {1!r}, {2!r})".format(
+            self.branch, self.repo, self.tag)
+
+    @property
+    def tag_name(self):
+        """Name of the svn tag, without the tag directory.
+        """
+        return self.tag.split('/')[-1]
+
+    @property
+    def git_tag(self):
+        """Name of the git tag the svn tag is imported as: the svn tag
+        name, or its alias, e.g. to fix a typo in the svn tag name,
+        followed by the tags of any switched externals.
+
+        """
+        git_tag = self.tag_name
+        if self.alias is not None:
+            git_tag = self.alias
+        for ext in self.externals:
+            git_tag += "-{0}".format(self.externals[ext].split('/')[-1])
+        return git_tag
+
+    @property
+    def layout(self):
+        """The settings that decide which files of the tag end up where in
+        the working copy. The switched externals only matter with
+        checkout_externals.
+
+        """
+        return (self.repo, self.checkout_externals, self.collapse_standalone,
+                self.standalone_path, self.shift_root_files,
+                self.shift_root_suffix, self.generate_externals_description)
+
+    @property
+    def url(self):
+        """Full svn url of the tag.
+        """
+        return "{0}/{1}".format(self.repo, self.tag)
+
+    @classmethod
+    def from_manifest(cls, base_info, tag):
+        """Create a job from the 'config' section of a tag file and one of
+        its 'tags' entries.
+
+        """
+        settings = {}
+        for key in BOOLEAN_SETTINGS:
+            if key in tag:
+                settings[key] = tag[key]
+        for key in OPTIONAL_SETTINGS:
+            if key in tag:
+                settings[key] = tag[key]
+        tag_path = os.path.join(base_info['tag_directory'], tag['tag'])
+        return cls(base_info['branch'], base_info['repo'], tag_path,
+                   externals=tag.get('externals', None), **settings)
+
+    @classmethod
+    def from_config_file(cls, filename):
+        """Create a job from a cesm2git config file, see the module
+        docstring for the format.
+
+        """
+        print("Reading configuration file : {0}".format(filename))
+
+        cfg_file = os.path.abspath(filename)
+        if not os.path.isfile(cfg_file):
+            raise RuntimeError(
+                "Could not find config file: {0}".format(cfg_file))
+
+        config = config_parser()
+        config.read(cfg_file)
+
+        for section in ['git', 'cesm']:
+            if not config.has_section(section):
+                raise RuntimeError("ERROR: repo config file must contain a "
+                                   "'{0}' section".format(section))
+
+        git = dict(config.items('git'))
+        cesm = dict(config.items('cesm'))
+        externals = {}
+        if config.has_section('externals'):
+            externals = dict(config.items('externals'))
+
+        for section, values, option in [('git', git, 'branch'),
+                                        ('cesm', cesm, 'repo'),
+                                        ('cesm', cesm, 'tag')]:
+            if option not in values:
+                raise RuntimeError("ERROR: repo config section '{0}' must "
+                                   "contain a '{1}' keyword.".format(
+                                       section, option))
+
+        settings = {}
+        for key in BOOLEAN_SETTINGS:
+            if key in cesm:
+                settings[key] = string_to_bool(cesm[key])
+        for key in OPTIONAL_SETTINGS:
+            # tag-loop.py used to write the string 'None' for unset keys
+            if key in cesm and cesm[key] != str(None):
+                settings[key] = cesm[key]
+
+        return cls(git['branch'], cesm['repo'], cesm['tag'],
+                   externals=externals, **settings)
+
+    def to_config(self):
+        """Config parser object equivalent to this job, for writing a
+        config file that 'cesm2git.py --config' can read.
+
+        """
+        config = config_parser()
+        config.add_section('git')
+        config.add_section('cesm')
+        config.add_section('externals')
+        config.set('git', 'branch', self.branch)
+        config.set('cesm', 'repo', self.repo)
+        config.set('cesm', 'tag', self.tag)
+        for key in sorted(BOOLEAN_SETTINGS):
+            config.set('cesm', key, str(getattr(self, key)))
+        for key in OPTIONAL_SETTINGS:
+            value = getattr(self, key)
+            if value is not None:
+                config.set('cesm', key, value)
+        for ext in sorted(self.externals):
+            config.set('externals', ext, self.externals[ext])
+        return config
+
+    def write_config_file(self, filename):
+        """Write the job as a cesm2git config file.
+
+        """
+        with open(os.path.abspath(filename), 'w') as configfile:
+            self.to_config().write(configfile)
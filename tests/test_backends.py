@@ -0,0 +1,124 @@
+"""Tests that the import backends write the same tree for a tag.
+
+The tags are imported from a local svn repository (file:// url), the
+tests are skipped if the svn client or svnadmin isn't installed.
+
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from cesm2git import import_tag
+from git_backend import close_git_sessions
+from tag_job import TagJob
+
+HAVE_SVN = all(any(os.access(os.path.join(path, name), os.X_OK)
+                   for path in os.environ.get('PATH', '').split(os.pathsep))
+               for name in ['svn', 'svnadmin'])
+
+IDENTITY = {
+    'GIT_AUTHOR_NAME': 'test',
+    'GIT_AUTHOR_EMAIL': 'test@example.org',
+    'GIT_COMMITTER_NAME': 'test',
+    'GIT_COMMITTER_EMAIL': 'test@example.org',
+}
+
+
+def write(path, text):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as output:
+        output.write(text)
+
+
+def run(*cmd):
+    return subprocess.check_output(cmd).decode('utf-8')
+
+
+@unittest.skipUnless(HAVE_SVN, "needs the svn client and svnadmin")
+class TestBackendTrees(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.environ = dict(os.environ)
+        os.environ.update(IDENTITY)
+        self.work_dir = tempfile.mkdtemp(prefix='backends-')
+        os.chdir(self.work_dir)
+
+        svn_repo = os.path.join(self.work_dir, 'svn')
+        run('svnadmin', 'create', svn_repo)
+        self.svn_url = 'file://' + svn_repo
+        tag_dir = os.path.join(self.work_dir, 'tag')
+        write(os.path.join(tag_dir, 'Makefile'), 'svn makefile\n')
+        write(os.path.join(tag_dir, 'README'), 'svn readme\n')
+        write(os.path.join(tag_dir, 'ChangeLog'), 'changes\n')
+        write(os.path.join(tag_dir, 'SVN_EXTERNAL_DIRECTORIES'), 'ext\n')
+        write(os.path.join(tag_dir, 'tools', 'mkdata'), 'tool\n')
+        write(os.path.join(tag_dir, 'models', 'lnd', 'clm', 'src', 'a.F90'),
+              'a\n')
+        run('svn', 'import', '--quiet', '--non-interactive', '--username',
+            'tester', '-m', 'tag t01', tag_dir,
+            self.svn_url + '/trunk_tags/t01')
+
+        # the branch head keeps a Makefile that isn't removed before
+        # the export, the shifted root Makefile has to be renamed
+        self.repo = 'repo'
+        run('git', 'init', '-q', self.repo)
+        os.chdir(self.repo)
+        write('Makefile', 'kept makefile\n')
+        write('README', 'old readme\n')
+        write('src/old.F90', 'old\n')
+        write('author-map.json', '{}\n')
+        run('git', 'add', 'Makefile', 'README', 'src')
+        run('git', 'commit', '-q', '-m', 'base')
+        for branch in ['porcelain', 'plumbing']:
+            run('git', 'branch', branch)
+        os.chdir(self.work_dir)
+
+    def tearDown(self):
+        close_git_sessions()
+        os.chdir(self.cwd)
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.work_dir)
+
+    def import_with(self, branch, plumbing):
+        job = TagJob(branch, self.svn_url, 'trunk_tags/t01',
+                     alias="t01-{0}".format(branch),
+                     collapse_standalone=True, shift_root_files=True,
+                     standalone_path='models/lnd/clm')
+        import_tag(job, self.repo, push=True, plumbing=plumbing)
+
+    def git(self, *args):
+        return run('git', '-C', self.repo, *args)
+
+    def test_shifted_root_files(self):
+        self.import_with('porcelain', plumbing=False)
+        self.import_with('plumbing', plumbing=True)
+
+        porcelain = self.git('ls-tree', '-r', 'porcelain')
+        plumbing = self.git('ls-tree', '-r', 'plumbing')
+        self.assertEqual(porcelain, plumbing)
+        self.assertEqual(self.git('show', 'plumbing:Makefile'),
+                         'kept makefile\n')
+        self.assertEqual(self.git('show', 'plumbing:Makefile.standalone'),
+                         'svn makefile\n')
+        names = self.git('ls-tree', '-r', '--name-only', 'plumbing').split()
+        self.assertEqual(sorted(names), [
+            'Makefile', 'Makefile.standalone', 'README',
+            'SVN_EXTERNAL_DIRECTORIES.standalone', 'src/a.F90',
+            'tools/mkdata'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+"""Tests for the paths cesm2git.git_changed_paths updates in the index.
+
+Each test makes a git repo whose HEAD is the previous tag, changes the
+working copy the way an import exports the new tag over it, and seeds
+the 'svn diff --summarize' output of the tag, so no svn server is
+needed.
+
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from cesm2git import (git_changed_paths, git_commit_changed_paths,
+                      remove_current_working_copy, seed_svn_metadata,
+                      svn_diff_summary_command)
+from tag_job import TagJob
+
+REPO = 'https://svn.example.org/repo'
+
+
+def write(path, text):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as output:
+        output.write(text)
+
+
+def git(*args):
+    return subprocess.check_output(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.org"] +
+        list(args)).decode('utf-8')
+
+
+def diff_summary(job, changes):
+    """svn diff --summarize --xml output for (item, path) changes,
+    paths relative to the compared urls.
+
+    """
+    old_url = svn_diff_summary_command(job)[-2]
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<diff>', '<paths>']
+    for item, path in changes:
+        lines.append('<path item="{0}" props="none" kind="file">{1}/{2}'
+                     '</path>'.format(item, old_url, path))
+    lines.extend(['</paths>', '</diff>'])
+    return '\n'.join(lines).encode('utf-8')
+
+
+class TestGitChangedPaths(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp(prefix='changed-paths-')
+        os.chdir(self.work_dir)
+        git("init", "-q")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.work_dir)
+
+    def commit_previous_tag(self, files):
+        for path, text in files.items():
+            write(path, text)
+        git("add", "--all")
+        git("commit", "-q", "-m", "t01")
+        git("tag", "t01")
+
+    def job(self, **settings):
+        job = TagJob('trunk', REPO, 'tags/t02', **settings)
+        job.previous_tag = 'tags/t01'
+        job.previous_git_tag = 't01'
+        return job
+
+    def test_changed_and_deleted(self):
+        self.commit_previous_tag({
+            '.gitignore': '*.log\n',
+            'README': 'old readme\n',
+            'doc/x.txt': 'x\n',
+            'src/a.F90': 'a\n',
+            'src/old.F90': 'old\n',
+            'utils/kept.F90': 'kept\n',
+        })
+        job = self.job()
+        remove_current_working_copy(job)
+        write('src/a.F90', 'a changed\n')
+        write('src/new.F90', 'new\n')
+        write('build.log', 'log\n')
+        write('Externals.cfg', 'generated\n')
+        seed_svn_metadata(svn_diff_summary_command(job), diff_summary(job, [
+            ('modified', 'src/a.F90'),
+            ('added', 'src/new.F90'),
+            ('added', 'build.log'),
+            ('deleted', 'src/old.F90'),
+            ('deleted', 'doc/x.txt'),
+            ('deleted', 'utils/kept.F90'),
+        ]))
+
+        added, removed = git_changed_paths(job, ['Externals.cfg'])
+        # the ignored build.log isn't added, as with 'git add --all'
+        self.assertEqual(added, ['Externals.cfg', 'src/a.F90',
+                                 'src/new.F90'])
+        # deleted paths are only removed inside the removed root entries,
+        # utils isn't one. README and doc weren't exported again,
+        # although svn didn't delete README.
+        self.assertEqual(removed, ['README', 'doc', 'doc/x.txt',
+                                   'src/old.F90'])
+
+    def test_commit_matches_add_all(self):
+        self.commit_previous_tag({
+            '.gitignore': '*.log\n',
+            'README': 'old readme\n',
+            'src/a.F90': 'a\n',
+            'src/old.F90': 'old\n',
+            'src/sub/b.F90': 'b\n',
+        })
+        job = self.job()
+        remove_current_working_copy(job)
+        write('src/a.F90', 'a changed\n')
+        write('src/new dir/new.F90', 'new\n')
+        write('build.log', 'log\n')
+        seed_svn_metadata(svn_diff_summary_command(job), diff_summary(job, [
+            ('modified', 'src/a.F90'),
+            ('added', 'src/new dir'),
+            ('added', 'src/new dir/new.F90'),
+            ('added', 'build.log'),
+            ('deleted', 'src/old.F90'),
+            ('deleted', 'src/sub'),
+        ]))
+        added, removed = git_changed_paths(job, [])
+
+        environ = dict(os.environ)
+        os.environ.update({'GIT_COMMITTER_NAME': 'test',
+                           'GIT_COMMITTER_EMAIL': 'test@example.org'})
+        try:
+            git_commit_changed_paths('t02', {
+                'author': 'test <test@example.org>',
+                'date': '2017-11-03T21:18:29.123456Z',
+                'msg': 'tag t02',
+                'revision': '1234',
+            }, added, removed)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+        git("add", "--all")
+        self.assertEqual(git("write-tree"), git("rev-parse", "HEAD^{tree}"))
+        self.assertEqual(git("rev-parse", "t02^{commit}"),
+                         git("rev-parse", "HEAD"))
+        self.assertEqual(git("rev-parse", "HEAD^"),
+                         git("rev-parse", "t01^{commit}"))
+
+    def test_removed_root_entry_exported_again(self):
+        self.commit_previous_tag({
+            'README': 'old readme\n',
+            'src/a.F90': 'a\n',
+        })
+        job = self.job()
+        remove_current_working_copy(job)
+        write('README', 'old readme\n')
+        write('src/a.F90', 'a\n')
+        seed_svn_metadata(svn_diff_summary_command(job),
+                          diff_summary(job, []))
+
+        self.assertEqual(git_changed_paths(job, []), ([], []))
+
+    def test_shifted_root_files(self):
+        self.commit_previous_tag({
+            'src/a.F90': 'a\n',
+            'SVN_EXTERNAL_DIRECTORIES.standalone': 'ext 1\n',
+        })
+        job = self.job(collapse_standalone=True, shift_root_files=True,
+                       standalone_path='models/lnd/clm')
+        remove_current_working_copy(job)
+        write('src/a.F90', 'a changed\n')
+        write('SVN_EXTERNAL_DIRECTORIES.standalone', 'ext 2\n')
+        write('Makefile.standalone', 'make\n')
+        job.shifted_root_files = {
+            'SVN_EXTERNAL_DIRECTORIES': 'SVN_EXTERNAL_DIRECTORIES.standalone',
+            'Makefile': 'Makefile.standalone',
+        }
+        seed_svn_metadata(svn_diff_summary_command(job), diff_summary(job, [
+            ('modified', 'models/lnd/clm/src/a.F90'),
+            ('modified', 'models/atm/cam/b.F90'),
+            ('modified', 'SVN_EXTERNAL_DIRECTORIES'),
+        ]))
+
+        added, removed = git_changed_paths(job, [])
+        # Makefile didn't change in svn, but is new under its shifted name
+        self.assertEqual(added, ['Makefile.standalone',
+                                 'SVN_EXTERNAL_DIRECTORIES.standalone',
+                                 'src/a.F90'])
+        self.assertEqual(removed, [])
+
+    def test_changed_path_missing_from_export(self):
+        self.commit_previous_tag({'src/a.F90': 'a\n'})
+        job = self.job()
+        seed_svn_metadata(svn_diff_summary_command(job), diff_summary(job, [
+            ('added', 'src/new.F90'),
+        ]))
+
+        self.assertIsNone(git_changed_paths(job, []))
+
+    def test_head_is_not_the_previous_tag(self):
+        self.commit_previous_tag({'src/a.F90': 'a\n'})
+        write('src/a.F90', 'a changed\n')
+        git("commit", "-q", "-a", "-m", "not from svn")
+
+        self.assertIsNone(git_changed_paths(self.job(), []))
+
+    def test_no_previous_tag(self):
+        self.commit_previous_tag({'src/a.F90': 'a\n'})
+        job = self.job()
+        job.previous_tag = None
+        job.previous_git_tag = None
+
+        self.assertIsNone(git_changed_paths(job, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
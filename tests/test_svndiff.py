@@ -0,0 +1,176 @@
+"""Tests for the svndiff decoder of svn_dump.py.
+
+The deltas are built by hand from the svndiff format description in
+the subversion sources (notes/svndiff): a 'SVN' header with the
+version, then windows of five integers (source offset, source length,
+target length, instructions length, new data length), the
+instructions and the new data. svndiff1 prefixes both sections with
+their original length and zlib compresses them unless that doesn't
+make them smaller.
+
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from svn_dump import SvnDumpError, _svndiff1_section, apply_svndiff
+
+# instruction actions
+SOURCE = 0
+TARGET = 1
+NEW = 2
+
+
+def varint(value):
+    """svndiff integer: 7 bits per byte, most significant first, the
+    high bit set on every byte but the last.
+
+    """
+    data = bytearray([value & 0x7f])
+    value >>= 7
+    while value:
+        data.insert(0, 0x80 | (value & 0x7f))
+        value >>= 7
+    return bytes(data)
+
+
+def instruction(action, length, offset=None):
+    if 0 < length < 0x40:
+        data = bytearray([(action << 6) | length])
+    else:
+        data = bytearray([action << 6]) + varint(length)
+    if offset is not None:
+        data += varint(offset)
+    return bytes(data)
+
+
+def section(data, compress):
+    """svndiff1 section, compressed or stored as is."""
+    if compress:
+        return varint(len(data)) + zlib.compress(data)
+    return varint(len(data)) + data
+
+
+def window(instructions, new_data, target_length, source_offset=0,
+           source_length=0, version=0, compress=True):
+    instructions = b''.join(instructions)
+    if version == 1:
+        instructions = section(instructions, compress)
+        new_data = section(new_data, compress)
+    return (varint(source_offset) + varint(source_length) +
+            varint(target_length) + varint(len(instructions)) +
+            varint(len(new_data)) + instructions + new_data)
+
+
+def delta(windows, version=0):
+    return b'SVN' + bytearray([version]) + b''.join(windows)
+
+
+class TestSvndiff(unittest.TestCase):
+
+    def test_new_data_only(self):
+        diff = delta([window([instruction(NEW, 5)], b'hello', 5)])
+        self.assertEqual(apply_svndiff(b'', diff), b'hello')
+
+    def test_empty_delta(self):
+        self.assertEqual(apply_svndiff(b'old', delta([])), b'')
+
+    def test_source_copies(self):
+        source = b'hello world'
+        diff = delta([window([instruction(SOURCE, 5, 6),
+                              instruction(NEW, 1),
+                              instruction(SOURCE, 5, 0)],
+                             b' ', 11, source_length=len(source))])
+        self.assertEqual(apply_svndiff(source, diff), b'world hello')
+
+    def test_source_view_offset(self):
+        # offsets of source copies are relative to the window's view
+        source = b'0123456789'
+        diff = delta([window([instruction(SOURCE, 3, 1)], b'', 3,
+                             source_offset=4, source_length=5)])
+        self.assertEqual(apply_svndiff(source, diff), b'567')
+
+    def test_target_copy(self):
+        diff = delta([window([instruction(NEW, 3),
+                              instruction(TARGET, 3, 0)], b'abc', 6)])
+        self.assertEqual(apply_svndiff(b'', diff), b'abcabc')
+
+    def test_overlapping_target_copy(self):
+        # a copy from the target may read bytes it produces itself
+        diff = delta([window([instruction(NEW, 2),
+                              instruction(TARGET, 7, 0)], b'ab', 9)])
+        self.assertEqual(apply_svndiff(b'', diff), b'ababababa')
+
+    def test_long_instruction_length(self):
+        # lengths that don't fit the 6 bits of the instruction byte
+        text = b'x' * 100 + b'y' * 200
+        diff = delta([window([instruction(NEW, len(text))], text,
+                             len(text))])
+        self.assertEqual(apply_svndiff(b'', diff), text)
+
+    def test_several_windows(self):
+        source = b'aaaabbbb'
+        diff = delta([
+            window([instruction(SOURCE, 4, 0)], b'', 4, source_offset=4,
+                   source_length=4),
+            window([instruction(NEW, 2), instruction(SOURCE, 2, 0)], b'--',
+                   4, source_offset=0, source_length=4),
+        ])
+        self.assertEqual(apply_svndiff(source, diff), b'bbbb--aa')
+
+    def test_svndiff1_compressed(self):
+        source = b'the quick brown fox'
+        new = b'lazy dog ' * 10
+        diff = delta([window([instruction(SOURCE, 10, 4),
+                              instruction(NEW, len(new)),
+                              instruction(TARGET, 5, 0)],
+                             new, 10 + len(new) + 5,
+                             source_length=len(source), version=1)],
+                     version=1)
+        self.assertEqual(apply_svndiff(source, diff),
+                         b'quick brow' + new + b'quick')
+
+    def test_svndiff1_uncompressed_sections(self):
+        # sections that don't shrink are stored as is
+        diff = delta([window([instruction(NEW, 3),
+                              instruction(TARGET, 2, 1)], b'abc', 5,
+                             version=1, compress=False)], version=1)
+        self.assertEqual(apply_svndiff(b'', diff), b'abcbc')
+
+    def test_svndiff1_section(self):
+        self.assertEqual(_svndiff1_section(varint(3) + b'abc'), b'abc')
+        data = b'z' * 50
+        self.assertEqual(_svndiff1_section(section(data, True)), data)
+        self.assertEqual(_svndiff1_section(varint(0)), b'')
+
+    def test_target_stream(self):
+        target = io.BytesIO()
+        diff = delta([window([instruction(NEW, 3)], b'abc', 3),
+                      window([instruction(NEW, 3)], b'def', 3)])
+        self.assertIs(apply_svndiff(b'', diff, target), target)
+        self.assertEqual(target.getvalue(), b'abcdef')
+
+    def test_invalid_header(self):
+        with self.assertRaises(SvnDumpError):
+            apply_svndiff(b'', b'XYZ\0')
+
+    def test_unsupported_version(self):
+        with self.assertRaises(SvnDumpError):
+            apply_svndiff(b'', delta([], version=2))
+
+    def test_window_length_mismatch(self):
+        diff = delta([window([instruction(NEW, 3)], b'abc', 4)])
+        with self.assertRaises(SvnDumpError):
+            apply_svndiff(b'', diff)
+
+
+if __name__ == '__main__':
+    unittest.main()
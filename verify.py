@@ -0,0 +1,287 @@
+"""Verify imported git tags against the svn tags.
+
+For every tag file:
+
+  * every tag that isn't skipped must have its git tag (the alias for
+    aliased tags), and directories in the svn tag directory that
+    aren't in the tag file are reported,
+
+  * the contents of each git tag are compared with svn. The files svn
+    would export for the tag, including shifted root files, are listed
+    with 'svn list --xml --recursive' and must be in the git tree with
+    the same size. When the tag's export is in the export cache (see
+    staging.py) the git blob hash of every cached file is compared
+    with the git tree entry too, so content changes that keep the
+    size are caught.
+
+Files that are only in git (e.g. .gitignore, generated externals
+descriptions, checked out externals) are counted but aren't errors.
+The tags are verified in parallel with one git ls-tree and one svn
+list per tag, plus one per shifted root entry.
+
+"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+import runner
+from cesm2git import (ROOT_EXPORT_OPTIONS, TAG_EXPORT_OPTIONS,
+                      is_shifted_root_entry, shifted_root_destination,
+                      svn_list_xml)
+from plan import git_tag_names
+from tag_job import jobs_from_manifest
+
+# number of paths listed per problem in the printed report
+PRINT_PATH_LIMIT = 10
+
+# svn stores symlinks as files containing 'link <target>'
+SVN_LINK_PREFIX_LENGTH = len('link ')
+
+
+def git_blob_sha(filename):
+    """git blob sha of a file, or of the target of a symlink.
+    """
+    if os.path.islink(filename):
+        data = os.readlink(filename).encode('utf-8', 'surrogateescape')
+        sha = hashlib.sha1("blob {0}\0".format(len(data)).encode('ascii'))
+        sha.update(data)
+        return sha.hexdigest()
+    sha = hashlib.sha1("blob {0}\0".format(
+        os.path.getsize(filename)).encode('ascii'))
+    with open(filename, 'rb') as blob_file:
+        for chunk in iter(lambda: blob_file.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def git_ls_tree(repo_dir, rev):
+    """Every file in a commit as a dict of path -> (mode, sha, size).
+    """
+    cmd = [
+        "git",
+        "-C", repo_dir,
+        "ls-tree",
+        "-r",
+        "-l",
+        "-z",
+        "--full-tree",
+        rev,
+    ]
+    output = runner.run(cmd)
+    files = {}
+    for record in output.split(b'\0'):
+        if not record:
+            continue
+        info, _, path = record.partition(b'\t')
+        mode, kind, sha, size = info.decode('ascii').split()
+        if kind != 'blob':
+            # submodules
+            continue
+        files[path.decode('utf-8', 'surrogateescape')] = (mode, sha,
+                                                          int(size))
+    return files
+
+
+def _listed_files(url, name, cache_path, listed=None):
+    """Expected files for an exported url, name is the git path the
+    export is placed at. listed is the entry of the url in the listing
+    of its parent, if it was listed already: files aren't listed again,
+    only directories are listed recursively.
+
+    """
+    if listed is not None and listed['kind'] == 'file':
+        listing = [{'kind': 'file', 'name': '', 'size': listed['size']}]
+    else:
+        listing = svn_list_xml(url, recursive=True)
+    files = []
+    for entry in listing:
+        if entry['kind'] != 'file':
+            continue
+        cache_file = None
+        if cache_path is not None:
+            cache_file = os.path.join(cache_path, entry['name']).rstrip('/')
+        files.append({
+            'path': os.path.join(name, entry['name']).strip('/'),
+            'size': entry['size'],
+            'cache': cache_file,
+        })
+    return files
+
+
+def shifted_root_names(job, roots, git_names):
+    """Git names of the shifted root entries of a tag. The names the
+    import found taken (see cesm2git.shifted_root_destination) are
+    taken from git_names, the top level entries of the git tree:
+    entries whose suffixed name isn't in the tree were imported under
+    their own name and didn't take it.
+
+    """
+    existing_files = set(git_names)
+    for root in roots:
+        suffixed = "{0}.{1}".format(root['name'], job.shift_root_suffix)
+        if suffixed not in git_names:
+            existing_files.discard(root['name'])
+    names = []
+    for root in roots:
+        # directory names from 'svn list' end with a '/' in the import
+        name = root['name']
+        if root['kind'] == 'dir':
+            name += '/'
+        names.append(shifted_root_destination(
+            job, name, existing_files).rstrip('/'))
+    return names
+
+
+def expected_files(job, git_names, export_cache=None):
+    """Files svn exports for a tag, as a list of dicts with the git path
+    the file is imported as, its svn size and its cached copy if the
+    export is in the export cache. git_names are the top level entries
+    of the git tree of the tag.
+
+    """
+    export_url = job.url
+    if job.collapse_standalone:
+        export_url = "{0}/{1}".format(job.url, job.standalone_path)
+    roots = []
+    if job.shift_root_files:
+        roots = [root for root in svn_list_xml(job.url)
+                 if is_shifted_root_entry(job, root['name'])]
+    root_urls = ["{0}/{1}".format(job.url, root['name']) for root in roots]
+
+    cached = None
+    cached_roots = [None] * len(roots)
+    if export_cache is not None:
+        cached = export_cache.cached_paths([export_url],
+                                           TAG_EXPORT_OPTIONS)[0]
+        if root_urls:
+            cached_roots = export_cache.cached_paths(root_urls,
+                                                     ROOT_EXPORT_OPTIONS)
+
+    files = _listed_files(export_url, '', cached)
+    names = shifted_root_names(job, roots, git_names)
+    for root, name, url, cache_path in zip(roots, names, root_urls,
+                                           cached_roots):
+        files.extend(_listed_files(url, name, cache_path, listed=root))
+    return files
+
+
+def verify_tag(job, repo_dir, git_tags, export_cache=None):
+    """Compare a single git tag with svn.
+    """
+    result = {
+        'tag': job.tag_name,
+        'git_tag': job.git_tag,
+        'status': 'ok',
+        'files': 0,
+        'hashed': 0,
+        'git_only': 0,
+        'missing': [],
+        'size_mismatch': [],
+        'hash_mismatch': [],
+    }
+    if job.git_tag not in git_tags:
+        result['status'] = 'missing-tag'
+        return result
+
+    git_files = git_ls_tree(repo_dir, "refs/tags/{0}".format(job.git_tag))
+    git_names = set(path.split('/')[0] for path in git_files)
+    matched = set()
+    for expected in expected_files(job, git_names, export_cache):
+        result['files'] += 1
+        path = expected['path']
+        if path not in git_files:
+            result['missing'].append(path)
+            continue
+        matched.add(path)
+        mode, sha, size = git_files[path]
+        svn_size = expected['size']
+        if mode == '120000':
+            svn_size -= SVN_LINK_PREFIX_LENGTH
+        if size != svn_size:
+            result['size_mismatch'].append(path)
+            continue
+        if expected['cache'] is not None and \
+           os.path.lexists(expected['cache']):
+            result['hashed'] += 1
+            if git_blob_sha(expected['cache']) != sha:
+                result['hash_mismatch'].append(path)
+    result['git_only'] = len(set(git_files) - matched)
+    if result['missing'] or result['size_mismatch'] or \
+       result['hash_mismatch']:
+        result['status'] = 'mismatch'
+    return result
+
+
+def verify_tag_file(tag_filename, repo_dir, jobs=4, export_cache=None):
+    """Verify every tag of a tag file.
+    """
+    with open(tag_filename, 'r') as tag_file:
+        manifest = json.load(tag_file)
+    base_info = manifest['config']
+    git_tags = git_tag_names(repo_dir)
+    tag_jobs = jobs_from_manifest(manifest)
+
+    known = set(tag['tag'] for tag in manifest['tags'])
+    tag_dir_url = "{0}/{1}".format(base_info['repo'],
+                                   base_info['tag_directory'])
+    untracked = sorted(entry['name'] for entry in svn_list_xml(tag_dir_url)
+                       if entry['kind'] == 'dir' and
+                       entry['name'] not in known)
+
+    pool = ThreadPool(max(1, jobs))
+    try:
+        results = pool.map(
+            lambda job: verify_tag(job, repo_dir, git_tags, export_cache),
+            tag_jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    summary['untracked'] = len(untracked)
+    summary['skipped'] = len(manifest['tags']) - len(tag_jobs)
+    return {
+        'tag_file': tag_filename,
+        'branch': base_info['branch'],
+        'tag_directory': base_info['tag_directory'],
+        'tags': results,
+        'untracked': untracked,
+        'summary': summary,
+    }
+
+
+def verification_failed(verification):
+    """True if any tag is missing or doesn't match svn.
+    """
+    return any(result['status'] != 'ok' for result in verification['tags'])
+
+
+def print_verification(verification):
+    """Human readable version of the verification, problems only.
+    """
+    print("Verification of {0} (branch '{1}', svn '{2}')".format(
+        verification['tag_file'], verification['branch'],
+        verification['tag_directory']))
+    for result in verification['tags']:
+        if result['status'] == 'ok':
+            continue
+        print("    {0:<12} {1}".format(result['status'], result['git_tag']))
+        for key in ['missing', 'size_mismatch', 'hash_mismatch']:
+            for path in result[key][:PRINT_PATH_LIMIT]:
+                print("        {0:<14} {1}".format(key, path))
+            if len(result[key]) > PRINT_PATH_LIMIT:
+                print("        {0:<14} ... {1} more".format(
+                    key, len(result[key]) - PRINT_PATH_LIMIT))
+    for name in verification['untracked']:
+        print("    {0:<12} {1}".format('untracked', name))
+    summary = verification['summary']
+    print("  summary:")
+    for key in sorted(summary):
+        print("    {0:<12} : {1}".format(key, summary[key]))
+
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+"""Import new svn tags as they appear.
+
+Instead of running tag-loop.py by hand when new tags are cut, watch.py
+keeps running and polls the tag directory of every tag file with a
+concurrent 'svn list --xml' (svn_async.py) every --interval seconds.
+A SIGUSR1 starts a poll immediately, e.g. from an svn post-commit
+hook:
+
+    ssh importer 'kill -USR1 $(cat /path/to/watch.pid)'
+
+When the listing has directories that aren't in the tag file, the
+verbose log of the tag directory (manifest.svn_tag_history) gives the
+revision every tag was created in; the listing only has the revision
+a directory last changed in, which is newer for tags that were
+committed to after they were copied. Tags created after the newest
+tag in the tag file are new tags. They are appended to the tag file
+with the settings of the tag before them (externals, collapse and
+shift options, ...), in the order they were created in svn, imported
+on the tag file's branch and pushed to --remote right away. Older svn
+tags that aren't in the tag file were left out on purpose and are
+never imported. The history is only fetched again when the listing has
+names that weren't classified in an earlier poll.
+
+The process stays warm between polls: the git plumbing sessions
+(--git-plumbing imports tags without externals straight into the
+repo, no clone per tag), the author cache, the export cache and the
+revision map are reused, and pushes to an ssh remote share one
+connection (ssh ControlMaster) unless GIT_SSH_COMMAND is set.
+
+    ./watch.py --repo clm --tag-file clm-trunk-tags.json --git-plumbing \\
+        --remote origin --pid-file watch.pid
+
+SIGTERM or ctrl-c stops the watcher after the tag being imported.
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+from python_version import check_python_version
+
+check_python_version()
+
+#
+# built-in modules
+#
+import argparse
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import traceback
+
+#
+# other modules in this package
+#
+import git_backend
+import maintenance
+import revmap
+import runner
+import svn_async
+from cesm2git import (add_runner_options, add_staging_options,
+                      configure_runner, configure_staging, import_tag,
+                      new_tag_from_job)
+from git_backend import close_git_sessions
+from manifest import TAG_ONLY_SETTINGS, svn_tag_history
+from plan import git_tag_names
+from report import RunReport
+from tag_job import jobs_from_manifest, read_manifest, write_manifest
+
+# default seconds between polls of svn
+DEFAULT_INTERVAL = 30
+
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Watch the svn tag directories of the tag files and '
+        'import new tags as they appear.')
+
+    parser.add_argument('--authors', nargs=1, default=['author-map.json'],
+                        help='path to authors json file, relative to repo')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--debug', action='store_true',
+                        help='extra debugging output')
+
+    parser.add_argument('--git-plumbing', action='store_true', default=False,
+                        help='write tags without externals directly into '
+                        'the repo with git plumbing instead of a '
+                        'temporary clone per tag.')
+
+    parser.add_argument('--interval', nargs=1, type=int,
+                        default=[DEFAULT_INTERVAL],
+                        help='seconds between polls of svn.')
+
+    parser.add_argument('--once', action='store_true', default=False,
+                        help='poll and import once, then exit.')
+
+    parser.add_argument('--pid-file', nargs=1, default=[''],
+                        help='write the process id to the specified file, '
+                        'for hooks that send SIGUSR1.')
+
+    parser.add_argument('--remote', nargs=1, default=[''],
+                        help='push the branch, new tags and svn notes to '
+                        'the specified remote after each tag.')
+
+    parser.add_argument('--repack-every', nargs=1, type=int,
+                        default=[maintenance.DEFAULT_REPACK_EVERY],
+                        help='repack the repo after the specified number '
+                        'of tags, 0 leaves object storage to git gc.')
+
+    parser.add_argument('--repo', nargs=1, required=True,
+                        help='path to repo')
+
+    parser.add_argument('--svn-concurrency', nargs=1, type=int,
+                        default=[svn_async.DEFAULT_CONCURRENCY],
+                        help='number of concurrent svn queries.')
+
+    parser.add_argument('--tag-file', nargs='+', required=True,
+                        help='tag files to watch, relative to repo')
+
+    add_runner_options(parser)
+    add_staging_options(parser)
+
+    options = parser.parse_args()
+    return options
+
+
+# -------------------------------------------------------------------------------
+#
+# work functions
+#
+# -------------------------------------------------------------------------------
+def tag_directory_url(manifest):
+    base_info = manifest['config']
+    return "{0}/{1}".format(base_info['repo'], base_info['tag_directory'])
+
+
+def unknown_tags(manifest, listing):
+    """Names of the directories in the listing of the tag directory
+    that aren't in the tag file.
+
+    """
+    known = set(tag['tag'] for tag in manifest['tags'])
+    return set(entry['name'] for entry in listing
+               if entry['kind'] == 'dir' and entry['name'] not in known)
+
+
+def new_tag_entries(manifest, history):
+    """Tag file entries for the svn tags in the history of the tag
+    directory (see manifest.svn_tag_history) that were created after
+    the newest tag in the tag file, in creation order, with the
+    settings of the last tag in the tag file.
+
+    """
+    created = dict((name, info['created']) for name, info in history.items())
+    known = set(tag['tag'] for tag in manifest['tags'])
+    newest = max([created[name] for name in known if name in created] +
+                 [0])
+    new = sorted((revision, name) for name, revision in created.items()
+                 if name not in known and revision > newest)
+    template = {}
+    if manifest['tags']:
+        template = dict(manifest['tags'][-1])
+    for key in TAG_ONLY_SETTINGS:
+        template.pop(key, None)
+    entries = []
+    for _, name in new:
+        entry = {'tag': name}
+        entry.update(template)
+        entries.append(entry)
+    return entries
+
+
+def push_tags(repo_dir, remote, branch, new_tags):
+    """Push the branch, the new tags and the svn notes in one push.
+    """
+    refspecs = ["refs/heads/{0}".format(branch)]
+    refspecs.extend("refs/tags/{0}".format(tag) for tag in new_tags)
+    if revmap.get_revmap() is not None:
+        refspecs.append(revmap.NOTES_REF)
+    runner.run(["git", "-C", repo_dir, "push", "--porcelain", remote] +
+               refspecs, capture=False)
+
+
+def share_ssh_connection():
+    """Reuse one ssh connection for every push, unless the user set up
+    ssh for git already.
+
+    """
+    if 'GIT_SSH_COMMAND' in os.environ or 'GIT_SSH' in os.environ:
+        return
+    control_path = os.path.join(tempfile.gettempdir(),
+                                'cesm2git-ssh-%r@%h:%p')
+    os.environ['GIT_SSH_COMMAND'] = (
+        "ssh -o ControlMaster=auto -o ControlPersist=600 "
+        "-o ControlPath={0}".format(control_path))
+
+
+class Watcher(object):
+    """Polls the tag files' svn tag directories and imports new tags.
+
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.repo = options.repo[0]
+        self.repo_dir = os.path.abspath(self.repo)
+        self.report = RunReport()
+        self.wake = threading.Event()
+        self.stopping = False
+        # svn tag names of every tag file that were classified as new
+        # or left out already, their history isn't fetched again
+        self.classified = {}
+
+    def request_poll(self, signum=None, frame=None):
+        self.wake.set()
+
+    def request_stop(self, signum=None, frame=None):
+        print("Stopping after the current tag")
+        self.stopping = True
+        self.wake.set()
+
+    def poll(self):
+        """Add the new svn tags to the tag files, returns the number of
+        tags added.
+
+        """
+        filenames = [os.path.join(self.repo, tag_filename)
+                     for tag_filename in self.options.tag_file]
+        manifests = [read_manifest(filename) for filename in filenames]
+        listings = svn_async.list_many(
+            [tag_directory_url(manifest) for manifest in manifests],
+            concurrency=self.options.svn_concurrency[0])
+        added = 0
+        for filename, manifest, listing in zip(filenames, manifests,
+                                               listings):
+            unknown = unknown_tags(manifest, listing)
+            classified = self.classified.setdefault(filename, set())
+            if not unknown - classified:
+                continue
+            entries = new_tag_entries(manifest,
+                                      svn_tag_history(manifest['config']))
+            classified.update(unknown)
+            if not entries:
+                continue
+            print("{0}: new svn tags {1}".format(
+                filename, ', '.join(entry['tag'] for entry in entries)))
+            manifest['tags'].extend(entries)
+            write_manifest(filename, manifest)
+            added += len(entries)
+        return added
+
+    def pending_jobs(self):
+        """Jobs of the tag files whose git tag doesn't exist, including
+        tags that failed in an earlier poll.
+
+        """
+        git_tags = git_tag_names(self.repo_dir)
+        jobs = []
+        for tag_filename in self.options.tag_file:
+            manifest = read_manifest(os.path.join(self.repo, tag_filename))
+            jobs.extend(job for job in jobs_from_manifest(manifest)
+                        if job.git_tag not in git_tags)
+        return jobs
+
+    def import_jobs(self, jobs):
+        """Import and push the jobs in order, a failure stops the
+        remaining tags of its branch until the next poll. Returns the
+        number of tags imported.
+
+        """
+        if jobs:
+            svn_async.prefetch_metadata(
+                jobs, concurrency=self.options.svn_concurrency[0])
+        failed_branches = set()
+        imported = 0
+        for job in jobs:
+            if self.stopping:
+                break
+            if job.branch in failed_branches:
+                continue
+            leftover = "{0}/{1}-update-{2}".format(os.getcwd(), self.repo,
+                                                   new_tag_from_job(job))
+            if os.path.isdir(leftover):
+                print("    removing '{0}' from the failed import".format(
+                    leftover))
+                shutil.rmtree(leftover)
+            try:
+                with self.report.tag(job.tag_name, branch=job.branch):
+                    new_tag = import_tag(job, self.repo,
+                                         authors=self.options.authors[0],
+                                         debug=self.options.debug, push=True,
+                                         plumbing=self.options.git_plumbing)
+            except Exception as error:
+                print("ERROR: importing '{0}' failed, retrying at the next "
+                      "poll: {1}".format(job.tag, error))
+                if self.options.backtrace:
+                    traceback.print_exc()
+                failed_branches.add(job.branch)
+                continue
+            imported += 1
+            maintenance.after_tag()
+            if revmap.get_revmap() is not None:
+                revmap.get_revmap().write_notes()
+            if self.options.remote[0]:
+                push_tags(self.repo_dir, self.options.remote[0], job.branch,
+                          [new_tag])
+        return imported
+
+    def run_once(self):
+        start = time.time()
+        self.poll()
+        jobs = self.pending_jobs()
+        imported = self.import_jobs(jobs)
+        if imported:
+            print("Imported {0} of {1} tags in {2:.1f} s".format(
+                imported, len(jobs), time.time() - start))
+        return imported == len(jobs)
+
+    def run(self):
+        """Poll until stopped.
+        """
+        print("Watching {0} every {1} s, pid {2}".format(
+            ', '.join(self.options.tag_file), self.options.interval[0],
+            os.getpid()))
+        while not self.stopping:
+            self.wake.clear()
+            try:
+                self.run_once()
+            except Exception as error:
+                # svn or the network is down, try again at the next poll
+                print("ERROR: poll failed: {0}".format(error))
+                if self.options.backtrace:
+                    traceback.print_exc()
+            finally:
+                close_git_sessions()
+            self.wake.wait(self.options.interval[0])
+
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+def main(options):
+    configure_runner(options)
+    configure_staging(options)
+    git_backend.configure()
+    revmap.configure(options.repo[0])
+    repo_maintenance = maintenance.configure(
+        repo_dir=options.repo[0], every=options.repack_every[0])
+    if options.remote[0]:
+        share_ssh_connection()
+
+    watcher = Watcher(options)
+    if options.once:
+        try:
+            return 0 if watcher.run_once() else 1
+        finally:
+            close_git_sessions()
+            if repo_maintenance is not None:
+                repo_maintenance.finish()
+
+    if options.pid_file[0]:
+        with open(options.pid_file[0], 'w') as pid_file:
+            pid_file.write("{0}\n".format(os.getpid()))
+    signal.signal(signal.SIGUSR1, watcher.request_poll)
+    signal.signal(signal.SIGTERM, watcher.request_stop)
+    signal.signal(signal.SIGINT, watcher.request_stop)
+    try:
+        watcher.run()
+    finally:
+        if repo_maintenance is not None:
+            repo_maintenance.finish()
+        if options.pid_file[0] and os.path.isfile(options.pid_file[0]):
+            os.remove(options.pid_file[0])
+    return 0
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            traceback.print_exc()
+        sys.exit(1)